@@ -0,0 +1,113 @@
+# answer_cache.py
+import hashlib
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from manifest import read_store_version
+
+# 语义命中的余弦相似度阈值，越高越保守
+ANSWER_CACHE_THRESHOLD = 0.95
+# 缓存条目有效期（秒）
+ANSWER_CACHE_TTL = 24 * 3600
+# 最多缓存的问答条数，超出后淘汰最久未使用的条目
+ANSWER_CACHE_MAX_ENTRIES = 1000
+
+
+class AnswerCache:
+    """
+    问答结果缓存，放在检索链之前
+    先按规范化后的问题文本精确匹配，再按问题向量的余弦相似度做语义匹配；
+    条目有 TTL，按 LRU 淘汰；向量库重新入库后（版本号变化）整体失效
+    semantic 为 False 时只做精确匹配，查询和写入都不请求嵌入模型
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        persist_dir,
+        threshold=ANSWER_CACHE_THRESHOLD,
+        ttl=ANSWER_CACHE_TTL,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        semantic=True,
+    ):
+        self.embeddings = embeddings
+        self.semantic = semantic
+        self.persist_dir = persist_dir
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (答案, 归一化问题向量, 写入时间)
+        self._entries = OrderedDict()
+        self._version = read_store_version(persist_dir)
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(question):
+        return hashlib.sha256(normalize_text(question).encode("utf-8")).hexdigest()
+
+    def _check_version(self):
+        version = read_store_version(self.persist_dir)
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def _embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _expire(self):
+        now = time.time()
+        for key in [k for k, (_, _, ts) in self._entries.items() if now - ts > self.ttl]:
+            del self._entries[key]
+
+    def lookup(self, question):
+        """命中时返回缓存的答案，否则返回 None"""
+        self._check_version()
+        self._expire()
+        key = self._key(question)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return self._entries[key][0]
+        if self.semantic and self._entries:
+            keys = list(self._entries)
+            matrix = np.stack([self._entries[k][1] for k in keys])
+            sims = matrix @ self._embed(question)
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                self._entries.move_to_end(keys[best])
+                self.semantic_hits += 1
+                return self._entries[keys[best]][0]
+        self.misses += 1
+        return None
+
+    def store(self, question, answer):
+        if not answer:
+            return
+        key = self._key(question)
+        vector = self._embed(question) if self.semantic else None
+        self._entries[key] = (answer, vector, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.exact_hits + self.semantic_hits + self.misses
+        hits = self.exact_hits + self.semantic_hits
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def report(self):
+        s = self.stats()
+        print(f"答案缓存：精确命中 {s['exact_hits']}，语义命中 {s['semantic_hits']}，"
+              f"未命中 {s['misses']}，命中率 {s['hit_rate']:.1%}")
@@ -0,0 +1,231 @@
+# bench_ingest.py
+"""
+离线入库基准测试
+生成指定规模和格式比例的合成语料，启动本地替身 Ollama 嵌入服务，
+分别测量 load_documents、分割、create_vector_store 以及流式增量入库全流程的
+耗时、吞吐量和峰值内存（包括解析进程池），结果以 JSON 输出，便于跨版本对比
+用法（在 Langchain 目录下运行）：
+    python benchmarks/bench_ingest.py --files 500 --mix txt=0.4,md=0.2,pdf=0.2,docx=0.1,xlsx=0.1 \
+        --latency-ms 20 --per-item-ms 5 --dim 3584 --output ingest.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from corpus import DEFAULT_MIX, generate_corpus, parse_mix
+from stub_ollama import StubOllamaServer
+
+
+def current_rss(pid="self"):
+    """进程常驻内存（字节），仅 Linux 可用，其他平台或进程已退出时返回 None"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def child_pids():
+    """当前进程的直接子进程（解析用的进程池 worker 等），仅 Linux 可用"""
+    parent, pids = os.getpid(), []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return pids
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # comm 字段可能含空格，ppid 位于右括号之后的第二个字段
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if ppid == parent:
+            pids.append(entry)
+    return pids
+
+
+class PeakRss:
+    """
+    后台线程定时采样本进程和全部子进程的 RSS 之和，记录阶段内的峰值；
+    children 为子进程部分的峰值。非 Linux 平台退回到 getrusage 的历史峰值
+    （RUSAGE_CHILDREN 只统计已退出子进程中最大的一个）
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self.children = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        rss = current_rss()
+        if not rss:
+            return
+        children = sum(current_rss(pid) or 0 for pid in child_pids())
+        self.peak = max(self.peak, rss + children)
+        self.children = max(self.children, children)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:
+            # 非 Linux：退回到进程生命周期内的峰值（Linux 为 KB，macOS 为字节）
+            unit = 1 if sys.platform == "darwin" else 1024
+            self.children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit + self.children
+
+
+def run_stage(results, name, func, work_dir, items_label=None):
+    """在独立工作目录中运行一个阶段，使嵌入缓存等相对路径互不影响"""
+    os.makedirs(work_dir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        with contextlib.redirect_stdout(sys.stderr), PeakRss() as rss:
+            start = time.perf_counter()
+            value, items = func()
+            seconds = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    results[name] = {
+        "seconds": round(seconds, 3),
+        "items": items,
+        "items_label": items_label,
+        "items_per_sec": round(items / seconds, 2) if seconds > 0 else None,
+        "peak_rss_mb": round(rss.peak / 1024 ** 2, 1),
+        "peak_children_rss_mb": round(rss.children / 1024 ** 2, 1),
+    }
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线入库基准测试")
+    parser.add_argument("--files", type=int, default=200, help="合成文件数")
+    parser.add_argument("--file-chars", type=int, default=5000, help="每个文件的字符数")
+    parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                        help="格式比例，如 txt=0.5,pdf=0.5")
+    parser.add_argument("--dim", type=int, default=3584, help="替身嵌入服务的向量维度")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="替身嵌入服务每个请求的延迟")
+    parser.add_argument("--per-item-ms", type=float, default=5.0, help="替身嵌入服务每条文本的额外延迟")
+    parser.add_argument("--parallel", type=int, default=4, help="替身嵌入服务的并行槽位数")
+    parser.add_argument("--batch-size", type=int, default=None, help="覆盖 EMBED_BATCH_SIZE")
+    parser.add_argument("--workers", type=int, default=None, help="覆盖 EMBED_WORKERS")
+    parser.add_argument("--parse-workers", type=int, default=None, help="覆盖 PARSE_WORKERS")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    parser.add_argument("--output", help="结果写入该 JSON 文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+
+    server = StubOllamaServer(dim=args.dim, latency_ms=args.latency_ms,
+                              per_item_ms=args.per_item_ms, parallel=args.parallel).start()
+    # ollama 客户端通过 OLLAMA_HOST 确定服务地址，必须在导入 vector 之前设置
+    os.environ["OLLAMA_HOST"] = server.url
+
+    import vector
+    from embed_pipeline import EMBED_BATCH_SIZE, EMBED_WORKERS
+    from loaders import PARSE_WORKERS
+
+    batch_size = args.batch_size or EMBED_BATCH_SIZE
+    workers = args.workers or EMBED_WORKERS
+    parse_workers = args.parse_workers or PARSE_WORKERS
+
+    root = tempfile.mkdtemp(prefix="bench_ingest_")
+    corpus_dir = os.path.join(root, "corpus")
+    results = {}
+    try:
+        start = time.perf_counter()
+        counts = generate_corpus(corpus_dir, args.files, args.file_chars, parse_mix(args.mix))
+        corpus_bytes = sum(
+            os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(corpus_dir) for f in files
+        )
+        generate_seconds = time.perf_counter() - start
+
+        def load():
+            docs = vector.load_documents(corpus_dir, max_workers=parse_workers)
+            return docs, len(docs)
+
+        docs = run_stage(results, "load", load, os.path.join(root, "load"), "documents")
+        results["load"]["mb_per_sec"] = round(corpus_bytes / 1024 ** 2 / results["load"]["seconds"], 2)
+
+        def split():
+            chunks = vector.build_text_splitter().split_documents(docs)
+            return chunks, len(chunks)
+
+        chunks = run_stage(results, "split", split, os.path.join(root, "split"), "chunks")
+
+        def embed_store():
+            db = vector.create_vector_store(chunks, persist_dir=os.path.join(root, "embed", "vector_store"),
+                                           batch_size=batch_size, max_workers=workers)
+            return None, db._collection.count() if db is not None else 0
+
+        run_stage(results, "embed_store", embed_store, os.path.join(root, "embed"), "chunks")
+        del docs, chunks
+
+        pipeline_dir = os.path.join(root, "pipeline")
+
+        def pipeline():
+            db = vector.update_vector_store(corpus_dir, os.path.join(pipeline_dir, "vector_store"), rebuild=True,
+                                            batch_size=batch_size, max_workers=workers,
+                                            parse_workers=parse_workers)
+            return None, db._collection.count()
+
+        run_stage(results, "pipeline", pipeline, pipeline_dir, "chunks")
+
+        def incremental_noop():
+            db = vector.update_vector_store(corpus_dir, os.path.join(pipeline_dir, "vector_store"),
+                                            batch_size=batch_size, max_workers=workers,
+                                            parse_workers=parse_workers)
+            return None, args.files
+
+        run_stage(results, "incremental_noop", incremental_noop, pipeline_dir, "files")
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "config": {
+            "files": args.files,
+            "file_chars": args.file_chars,
+            "mix": parse_mix(args.mix),
+            "dim": args.dim,
+            "latency_ms": args.latency_ms,
+            "per_item_ms": args.per_item_ms,
+            "server_parallel": args.parallel,
+            "batch_size": batch_size,
+            "workers": workers,
+            "parse_workers": parse_workers,
+        },
+        "corpus": {"files_by_format": counts, "bytes": corpus_bytes, "generate_seconds": round(generate_seconds, 2)},
+        "stub_server": {"requests": server.requests, "texts": server.items},
+        "stages": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
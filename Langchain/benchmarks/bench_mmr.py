@@ -0,0 +1,82 @@
+# bench_mmr.py
+"""
+MMR 重排耗时随 fetch_k 的变化：langchain 的逐候选循环实现 vs mmr.py 的 NumPy 实现
+两者选出的结果逐一比对，保证向量化实现与原实现等价
+用法（在 Langchain 目录下运行）：
+    python benchmarks/bench_mmr.py --dim 3584 --fetch-k 20,50,100,200,500,1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from langchain_chroma.vectorstores import maximal_marginal_relevance
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mmr import mmr_select, threshold_mmr
+
+
+def make_candidates(rng, fetch_k, dim):
+    """低秩结构 + 噪声的候选向量，候选之间有明显的相似簇，MMR 才有意义"""
+    basis = rng.standard_normal((16, dim)).astype(np.float32)
+    candidates = rng.standard_normal((fetch_k, 16)).astype(np.float32) @ basis
+    candidates += 0.3 * rng.standard_normal(candidates.shape).astype(np.float32)
+    query = candidates[0] + rng.standard_normal(dim).astype(np.float32) * candidates.std()
+    return query, candidates
+
+
+def time_ms(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return result, float(np.median(latencies))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MMR 重排耗时评测")
+    parser.add_argument("--dim", type=int, default=3584, help="向量维度，deepseek-r1:7b 为 3584")
+    parser.add_argument("--fetch-k", default="20,50,100,200,500,1000", help="逗号分隔的候选数")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    parser.add_argument("--score-threshold", type=float, default=0.4)
+    parser.add_argument("--repeat", type=int, default=5, help="每组重复次数，取中位数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    results = []
+    for fetch_k in [int(x) for x in args.fetch_k.split(",")]:
+        query, candidates = make_candidates(rng, fetch_k, args.dim)
+        baseline, baseline_ms = time_ms(
+            lambda: maximal_marginal_relevance(query, list(candidates), lambda_mult=args.lambda_mult, k=args.k),
+            args.repeat,
+        )
+        fast, fast_ms = time_ms(lambda: mmr_select(query, candidates, args.k, args.lambda_mult), args.repeat)
+        hits, threshold_ms = time_ms(
+            lambda: threshold_mmr(query, candidates, args.k, args.lambda_mult, args.score_threshold), args.repeat
+        )
+        results.append({
+            "fetch_k": fetch_k,
+            "langchain_ms": round(baseline_ms, 3),
+            "numpy_ms": round(fast_ms, 3),
+            "numpy_threshold_ms": round(threshold_ms, 3),
+            "speedup": round(baseline_ms / max(fast_ms, 1e-6), 1),
+            "same_selection": baseline == fast,
+            "above_threshold": len(hits),
+        })
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"维度 {args.dim}，k={args.k}，lambda_mult={args.lambda_mult}，score_threshold={args.score_threshold}")
+    for r in results:
+        print("  ".join(f"{key}={value}" for key, value in r.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# bench_qa_server.py
+"""
+问答服务压测
+默认在临时目录中用替身 Ollama 服务（嵌入 + 流式对话）入库一份小型合成语料，进程内启动 qa_server，
+然后以指定并发数发送 SSE 流式请求，统计首 token 延迟（TTFT）p50/p99、完整回答耗时、每秒请求数和 503 拒绝数
+也可以用 --url 压测已经在运行的服务
+用法（在 Langchain 目录下运行）：
+    python benchmarks/bench_qa_server.py --requests 200 --concurrency 32 --ttft-ms 200 --token-ms 20
+    python benchmarks/bench_qa_server.py --url http://127.0.0.1:8000 --requests 50 --concurrency 8
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from corpus import generate_corpus
+from stub_ollama import StubOllamaServer
+
+
+def percentile(values, p):
+    return round(float(np.percentile(values, p)) * 1000, 1) if values else None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_local_service(args, root):
+    """启动替身 Ollama、入库合成语料并在后台线程中运行 qa_server，返回 (服务地址, 替身服务, uvicorn 服务)"""
+    import uvicorn
+
+    stub = StubOllamaServer(dim=args.dim, parallel=args.parallel, ttft_ms=args.ttft_ms,
+                            token_ms=args.token_ms, tokens=args.tokens).start()
+    # ollama 客户端通过 OLLAMA_HOST 确定服务地址，必须在导入 vector / qa_server 之前设置
+    os.environ["OLLAMA_HOST"] = stub.url
+    # 检索链使用相对路径 ./vector_store
+    os.chdir(root)
+    generate_corpus("corpus", args.files, 3000, mix={"txt": 0.5, "md": 0.5})
+
+    import vector
+    import qa_server
+
+    with contextlib.redirect_stdout(sys.stderr):
+        vector.update_vector_store("corpus", "./vector_store", parse_workers=1)
+
+    port = free_port()
+    app = qa_server.create_app(args.max_concurrency, args.max_queue, args.queue_timeout)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", stub, server
+
+
+async def one_request(client, url, question, results):
+    start = time.perf_counter()
+    ttft = None
+    try:
+        async with client.stream("POST", f"{url}/ask/stream", json={"question": question}) as resp:
+            if resp.status_code == 503:
+                results["rejected"] += 1
+                return
+            resp.raise_for_status()
+            event = None
+            async for line in resp.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    if event == "error":
+                        raise RuntimeError(json.loads(line[5:])["error"])
+                    if ttft is None and event is None:
+                        ttft = time.perf_counter() - start
+                elif not line:
+                    event = None
+    except Exception as e:
+        results["errors"] += 1
+        results["last_error"] = str(e)
+        return
+    results["ttft"].append(ttft if ttft is not None else time.perf_counter() - start)
+    results["latency"].append(time.perf_counter() - start)
+
+
+async def run_load(url, total, concurrency, question):
+    results = {"ttft": [], "latency": [], "rejected": 0, "errors": 0}
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        async def bounded(i):
+            async with semaphore:
+                await one_request(client, url, f"{question} #{i}", results)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(i) for i in range(total)))
+        results["wall_seconds"] = time.perf_counter() - start
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="问答服务压测")
+    parser.add_argument("--url", help="压测已运行的服务；不指定时在本进程内启动替身环境")
+    parser.add_argument("--requests", type=int, default=100, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=16, help="客户端并发数")
+    parser.add_argument("--question", default="电梯维保需要注意哪些安全事项？")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="服务端同时生成的请求数")
+    parser.add_argument("--max-queue", type=int, default=32, help="服务端等待队列长度")
+    parser.add_argument("--queue-timeout", type=float, default=30.0, help="服务端排队超时秒数")
+    parser.add_argument("--parallel", type=int, default=4, help="替身 Ollama 的并行槽位数")
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="替身模型的首 token 延迟")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="替身模型每个 token 的间隔")
+    parser.add_argument("--tokens", type=int, default=64, help="替身模型每次回答的 token 数")
+    parser.add_argument("--dim", type=int, default=256, help="替身嵌入服务的向量维度")
+    parser.add_argument("--files", type=int, default=20, help="入库的合成文件数")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    args = parser.parse_args(argv)
+
+    root = stub = server = None
+    url = args.url
+    cwd = os.getcwd()
+    try:
+        if not url:
+            root = tempfile.mkdtemp(prefix="bench_qa_server_")
+            url, stub, server = start_local_service(args, root)
+        results = asyncio.run(run_load(url, args.requests, args.concurrency, args.question))
+        health = httpx.get(f"{url}/health").json()
+    finally:
+        if server is not None:
+            server.should_exit = True
+        if stub is not None:
+            stub.shutdown()
+        os.chdir(cwd)
+        if root and not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    completed = len(results["latency"])
+    report = {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "server_max_concurrency": health.get("max_concurrency"),
+            "server_max_queue": health.get("max_queue"),
+            "stub": None if args.url else {"ttft_ms": args.ttft_ms, "token_ms": args.token_ms, "tokens": args.tokens},
+        },
+        "completed": completed,
+        "rejected": results["rejected"],
+        "errors": results["errors"],
+        "requests_per_sec": round(completed / results["wall_seconds"], 2) if results["wall_seconds"] else None,
+        "ttft_ms_p50": percentile(results["ttft"], 50),
+        "ttft_ms_p99": percentile(results["ttft"], 99),
+        "latency_ms_p50": percentile(results["latency"], 50),
+        "latency_ms_p99": percentile(results["latency"], 99),
+    }
+    if results.get("last_error"):
+        report["last_error"] = results["last_error"]
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# bench_quantization.py
+"""
+对比不同压缩模式相对未压缩索引的 recall@k 和查询延迟，
+以及实际的磁盘占用和进程内存（RSS）与纯 Chroma 向量库的对比
+用法（在 Langchain 目录下运行）：
+    python benchmarks/bench_quantization.py                        # 使用 ./vector_store 中的向量
+    python benchmarks/bench_quantization.py --synthetic 100000 --dim 3584
+查询向量取自库内向量加噪声；也可以用 --queries 指定每行一个问题的文本文件，由嵌入模型实时向量化
+磁盘和内存在子进程中分别测量：纯 Chroma 检索，以及每种模式的压缩索引 + 按 id 从 Chroma 重排和取文本；
+合成向量会先写入临时的 Chroma 向量库
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from quantized_store import QUANTIZE_MODES, QUANTIZED_DIR_NAME, QuantizedIndex, fetch_store_vectors, normalize, top_n
+
+# 写入合成向量库时每批的条数
+SYNTHETIC_BATCH = 5000
+
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) if len(values) else 0.0
+
+
+def load_vectors(args):
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        # 低秩结构 + 噪声，比纯随机向量更接近真实嵌入的分布
+        basis = rng.standard_normal((64, args.dim)).astype(np.float32)
+        vectors = rng.standard_normal((args.synthetic, 64)).astype(np.float32) @ basis
+        vectors += 0.1 * rng.standard_normal(vectors.shape).astype(np.float32)
+        return [str(i) for i in range(args.synthetic)], vectors, None
+    from langchain_chroma import Chroma
+    from quantized_store import export_vectors
+    from vector import build_embeddings
+
+    embeddings = build_embeddings()
+    db = Chroma(persist_directory=args.persist_dir, embedding_function=embeddings)
+    ids, vectors = export_vectors(db)
+    return ids, vectors, embeddings
+
+
+def make_queries(args, vectors, embeddings):
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    rng = np.random.default_rng(1)
+    picked = vectors[rng.choice(len(vectors), size=min(args.num_queries, len(vectors)), replace=False)]
+    noise = rng.standard_normal(picked.shape).astype(np.float32) * picked.std() * 0.3
+    return picked + noise
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def chroma_size(persist_dir):
+    """Chroma 自身的文件：chroma.sqlite3 和各段目录，不含压缩索引、倒排索引、清单等"""
+    total = 0
+    for name in os.listdir(persist_dir):
+        path = os.path.join(persist_dir, name)
+        if os.path.isdir(path) and name != QUANTIZED_DIR_NAME:
+            total += dir_size(path)
+        elif name.startswith("chroma.sqlite3"):
+            total += os.path.getsize(path)
+    return total
+
+
+def write_synthetic_store(persist_dir, ids, vectors):
+    """把合成向量写入临时 Chroma 向量库，用于测量磁盘和内存"""
+    from langchain_chroma import Chroma
+
+    db = Chroma(persist_directory=persist_dir)
+    for s in range(0, len(ids), SYNTHETIC_BATCH):
+        db._collection.add(ids=ids[s:s + SYNTHETIC_BATCH], embeddings=vectors[s:s + SYNTHETIC_BATCH],
+                           documents=[f"synthetic {i}" for i in ids[s:s + SYNTHETIC_BATCH]])
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError):
+        return None
+
+
+def probe(args):
+    """
+    子进程入口：打开向量库，按实际检索路径跑完全部查询，输出查询过程中的 RSS 峰值
+    --probe chroma 为纯 Chroma 检索；其余为压缩索引检索，候选从 Chroma 取全精度向量重排，再按 id 取文本
+    """
+    from langchain_chroma import Chroma
+
+    queries = np.load(args.probe_queries)
+    db = Chroma(persist_directory=args.persist_dir)
+    index = QuantizedIndex.load(args.index_dir) if args.probe != "chroma" else None
+    # 每次查询后采样 RSS；ru_maxrss 在 exec 后会保留父进程的值，不能用来比较
+    peak = 0.0
+    for q in queries:
+        if index is None:
+            db._collection.query(query_embeddings=[q.tolist()], n_results=args.k)
+        else:
+            hits = index.search(q, args.k, rerank=args.rerank,
+                                fetch_vectors=lambda idx: fetch_store_vectors(db, index, idx))
+            db.get(ids=[index.ids[i] for i, _ in hits], include=["documents", "metadatas"])
+        peak = max(peak, current_rss_mb() or 0.0)
+    print(json.dumps({"peak_rss_mb": round(peak, 1)}))
+
+
+def run_probe(kind, persist_dir, queries_path, args, index_dir=None):
+    command = [sys.executable, os.path.abspath(__file__), "--probe", kind, "--persist-dir", persist_dir,
+               "--probe-queries", queries_path, "--k", str(args.k), "--rerank", str(args.rerank)]
+    if index_dir:
+        command += ["--index-dir", index_dir]
+    out = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure_footprint(args, ids, vectors, queries, work_dir):
+    """纯 Chroma 与 Chroma + 各模式压缩索引的磁盘占用和查询进程 RSS"""
+    persist_dir = args.persist_dir
+    if args.synthetic:
+        persist_dir = os.path.join(work_dir, "chroma")
+        write_synthetic_store(persist_dir, ids, vectors)
+    queries_path = os.path.join(work_dir, "queries.npy")
+    np.save(queries_path, np.asarray(queries, dtype=np.float32))
+
+    base_disk = chroma_size(persist_dir)
+    base = run_probe("chroma", persist_dir, queries_path, args)
+    rows = [{"store": "chroma", "disk_mb": round(base_disk / 1024 ** 2, 2), **base}]
+    for mode in QUANTIZE_MODES:
+        index_dir = os.path.join(work_dir, mode)
+        QuantizedIndex.build(mode, ids, vectors).save(index_dir)
+        index_disk = dir_size(index_dir)
+        r = run_probe(mode, persist_dir, queries_path, args, index_dir)
+        rows.append({
+            "store": f"chroma+{mode}",
+            "disk_mb": round((base_disk + index_disk) / 1024 ** 2, 2),
+            "index_disk_mb": round(index_disk / 1024 ** 2, 2),
+            **r,
+            "rss_vs_chroma_mb": round(r["peak_rss_mb"] - base["peak_rss_mb"], 1),
+        })
+    return rows
+
+
+def evaluate(name, search, queries, truth, k):
+    recalls, latencies = [], []
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        got = search(q)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(got) & expected) / k)
+    return {
+        "mode": name,
+        f"recall@{k}": round(float(np.mean(recalls)), 4),
+        "latency_ms_p50": round(percentile(latencies, 50), 3),
+        "latency_ms_p99": round(percentile(latencies, 99), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="压缩向量索引 recall、延迟、磁盘与内存评测")
+    parser.add_argument("--persist-dir", default="./vector_store")
+    parser.add_argument("--synthetic", type=int, default=0, help="使用 N 条合成向量代替向量库")
+    parser.add_argument("--dim", type=int, default=3584, help="合成向量维度")
+    parser.add_argument("--queries", help="问题文本文件，每行一个")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rerank", type=int, default=50, help="全精度重排的候选数")
+    parser.add_argument("--no-footprint", action="store_true", help="不测量磁盘占用和进程内存")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    # 内部使用：在子进程中测量单一模式的内存
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    parser.add_argument("--probe-queries", help=argparse.SUPPRESS)
+    parser.add_argument("--index-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.probe:
+        probe(args)
+        return
+
+    ids, vectors, embeddings = load_vectors(args)
+    if not ids:
+        print("向量库为空")
+        return
+    queries = make_queries(args, vectors, embeddings)
+    full = normalize(vectors)
+    truth = [set(top_n(full @ q, args.k).tolist()) for q in normalize(queries)]
+
+    results = [dict(
+        evaluate("float32", lambda q: top_n(full @ normalize(q), args.k).tolist(), queries, truth, args.k),
+        index_mb=round(full.nbytes / 1024 ** 2, 2),
+    )]
+    for mode in QUANTIZE_MODES:
+        start = time.perf_counter()
+        index = QuantizedIndex.build(mode, ids, vectors)
+        build_seconds = round(time.perf_counter() - start, 2)
+        for rerank in (0, args.rerank):
+            name = mode if not rerank else f"{mode}+rerank{rerank}"
+            # 全精度向量在实际检索中从 Chroma 按 id 读取，这里直接取内存中的原始向量
+            r = evaluate(name, lambda q: [i for i, _ in index.search(q, args.k, rerank=rerank,
+                                                                     fetch_vectors=lambda idx: vectors[idx])],
+                         queries, truth, args.k)
+            r["index_mb"] = round(index.nbytes / 1024 ** 2, 2)
+            r["build_seconds"] = build_seconds
+            results.append(r)
+
+    footprint = []
+    if not args.no_footprint:
+        work_dir = tempfile.mkdtemp(prefix="bench_quantization_")
+        try:
+            footprint = measure_footprint(args, ids, vectors, queries, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"recall": results, "footprint": footprint}, ensure_ascii=False, indent=2))
+        return
+    print(f"向量数 {len(ids)}，维度 {vectors.shape[1]}，查询数 {len(queries)}")
+    for r in results:
+        print("  ".join(f"{key}={value}" for key, value in r.items()))
+    if footprint:
+        print("磁盘占用与查询进程内存（压缩索引附加在 Chroma 旁，Chroma 的 float32 向量和 HNSW 索引仍然保留）：")
+        for r in footprint:
+            print("  ".join(f"{key}={value}" for key, value in r.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# bench_splitter.py
+"""
+对比 RecursiveCharacterTextSplitter 与 CJKSentenceSplitter 的分割速度和文本块长度分布
+用法（在 Langchain 目录下运行）：
+    python benchmarks/bench_splitter.py --pdf "deepseek r1.pdf" --synthetic-mb 20
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from langchain_core.documents import Document
+
+from cjk_splitter import CJKSentenceSplitter, approx_token_len
+from corpus import random_text
+from vector import build_text_splitter
+
+
+def synthetic_corpus(target_bytes, seed=0, doc_chars=20000):
+    """生成中英文混排的合成语料，按文档切开以模拟多文件"""
+    rng = random.Random(seed)
+    docs, size = [], 0
+    while size < target_bytes:
+        text = random_text(rng, doc_chars)
+        docs.append(Document(page_content=text, metadata={"source": f"synthetic_{len(docs)}.txt"}))
+        size += len(text.encode("utf-8"))
+    return docs
+
+
+def distribution(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    return {
+        "min": values[0],
+        "p50": values[len(values) // 2],
+        "p90": values[int(len(values) * 0.9)],
+        "max": values[-1],
+        "mean": round(statistics.fmean(values), 1),
+    }
+
+
+def bench(name, splitter, docs, repeat):
+    total_chars = sum(len(d.page_content) for d in docs)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = splitter.split_documents(docs)
+        best = min(best, time.perf_counter() - start)
+    lengths = [len(c.page_content) for c in chunks]
+    return {
+        "splitter": name,
+        "seconds": round(best, 4),
+        "chars_per_sec": round(total_chars / best),
+        "chunks": len(chunks),
+        "chunk_chars": distribution(lengths),
+        "has_start_index": all("start_index" in c.metadata for c in chunks),
+    }
+
+
+def run(docs, label, chunk_size, chunk_overlap, repeat):
+    splitters = {
+        "recursive": build_text_splitter(chunk_size, chunk_overlap, kind="recursive"),
+        "cjk": CJKSentenceSplitter(chunk_size, chunk_overlap),
+        # token 模式下 chunk_size 按 token 计，这里取字符数的一半使块大小大致可比
+        "cjk-token": CJKSentenceSplitter(chunk_size // 2, chunk_overlap // 2, approx_token_len),
+    }
+    results = []
+    for name, splitter in splitters.items():
+        r = bench(name, splitter, docs, repeat)
+        r["corpus"] = label
+        results.append(r)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="文本分割器基准测试")
+    parser.add_argument("--pdf", default="deepseek r1.pdf", help="真实 PDF 语料，不存在时跳过")
+    parser.add_argument("--synthetic-mb", type=float, default=20, help="合成语料大小（MB）")
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--chunk-overlap", type=int, default=150)
+    parser.add_argument("--repeat", type=int, default=3, help="每个分割器重复次数，取最快一次")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args(argv)
+
+    results = []
+    if os.path.exists(args.pdf):
+        from langchain_community.document_loaders import PyPDFLoader
+        results += run(PyPDFLoader(args.pdf).load(), os.path.basename(args.pdf),
+                       args.chunk_size, args.chunk_overlap, args.repeat)
+    else:
+        print(f"未找到 {args.pdf}，跳过 PDF 语料", file=sys.stderr)
+    docs = synthetic_corpus(int(args.synthetic_mb * 1024 * 1024))
+    results += run(docs, f"synthetic-{args.synthetic_mb}MB", args.chunk_size, args.chunk_overlap, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'语料':24s} {'分割器':10s} {'耗时(s)':>9s} {'字符/秒':>12s} {'块数':>8s}  块长度分布")
+    for r in results:
+        print(f"{r['corpus']:24s} {r['splitter']:10s} {r['seconds']:9.3f} {r['chars_per_sec']:12d} "
+              f"{r['chunks']:8d}  {r['chunk_chars']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# corpus.py
+"""
+合成语料生成：按格式比例生成 txt / md / pdf / docx / xlsx 文件，不依赖任何文档库
+PDF 只使用内置 Helvetica 字体，因此正文为英文；其他格式为中英文混排
+"""
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+CJK_WORDS = "电梯 维保 检验 设备 使用 单位 安全 注意 事项 模型 推理 强化 学习 训练 数据 结果 分析 系统 用户 文档".split()
+EN_WORDS = "the model reasoning reinforcement learning policy reward data training results analysis system".split()
+
+DEFAULT_MIX = {"txt": 0.4, "md": 0.2, "pdf": 0.2, "docx": 0.1, "xlsx": 0.1}
+
+
+def random_sentence(rng, cjk_ratio=0.7):
+    if rng.random() < cjk_ratio:
+        return "".join(rng.choices(CJK_WORDS, k=rng.randint(5, 30))) + rng.choice("。！？；")
+    return " ".join(rng.choices(EN_WORDS, k=rng.randint(5, 25))).capitalize() + rng.choice(".!?") + " "
+
+
+def random_text(rng, chars, cjk_ratio=0.7):
+    """生成约 chars 个字符的文本，随机插入段落换行"""
+    parts, size = [], 0
+    while size < chars:
+        s = random_sentence(rng, cjk_ratio)
+        if rng.random() < 0.1:
+            s += "\n\n" if rng.random() < 0.5 else "\n"
+        parts.append(s)
+        size += len(s)
+    return "".join(parts)
+
+
+def parse_mix(spec: str):
+    """解析 "txt=0.4,pdf=0.6" 形式的格式比例"""
+    mix = {}
+    for item in spec.split(","):
+        ext, _, weight = item.partition("=")
+        mix[ext.strip().lstrip(".")] = float(weight)
+    return mix
+
+
+def _pdf_escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, text, lines_per_page=50, line_chars=90):
+    lines = []
+    for para in text.split("\n"):
+        lines.extend(para[i:i + line_chars] for i in range(0, max(len(para), 1), line_chars))
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[""]]
+
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for n, page in enumerate(pages):
+        page_id, content_id = 4 + 2 * n, 5 + 2 * n
+        kids.append(f"{page_id} 0 R")
+        stream = "BT /F1 10 Tf 40 760 Td 14 TL " + " ".join(f"({_pdf_escape(l)}) Tj T*" for l in page) + " ET"
+        stream = stream.encode("latin-1", "replace")
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n" % obj_id + objects[obj_id] + b"\nendobj\n"
+    xref = len(out)
+    size = max(objects) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for obj_id in range(1, size):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_docx(path, text):
+    paras = "".join(f"<w:p><w:r><w:t xml:space=\"preserve\">{escape(p)}</w:t></w:r></w:p>" for p in text.split("\n"))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                   '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                   '<Default Extension="xml" ContentType="application/xml"/>'
+                   '<Override PartName="/word/document.xml" '
+                   'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                   '</Types>')
+        z.writestr("_rels/.rels",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   '<Relationship Id="rId1" Target="word/document.xml" Type="http://schemas.openxmlformats.org/'
+                   'officeDocument/2006/relationships/officeDocument"/></Relationships>')
+        z.writestr("word/document.xml",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                   f'<w:body>{paras}</w:body></w:document>')
+
+
+def write_xlsx(path, text, cols=4):
+    cells = [s for s in text.replace("\n", "").split("。") if s]
+    rows = []
+    for r in range(0, len(cells), cols):
+        row = "".join(
+            f'<c r="{chr(65 + c)}{r // cols + 1}" t="inlineStr"><is><t>{escape(v)}</t></is></c>'
+            for c, v in enumerate(cells[r:r + cols])
+        )
+        rows.append(f'<row r="{r // cols + 1}">{row}</row>')
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                   '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                   '<Default Extension="xml" ContentType="application/xml"/>'
+                   '<Override PartName="/xl/workbook.xml" '
+                   'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                   '<Override PartName="/xl/worksheets/sheet1.xml" '
+                   'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                   '</Types>')
+        z.writestr("_rels/.rels",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   '<Relationship Id="rId1" Target="xl/workbook.xml" Type="http://schemas.openxmlformats.org/'
+                   'officeDocument/2006/relationships/officeDocument"/></Relationships>')
+        z.writestr("xl/workbook.xml",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                   'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                   '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        z.writestr("xl/_rels/workbook.xml.rels",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   '<Relationship Id="rId1" Target="worksheets/sheet1.xml" Type="http://schemas.openxmlformats.org/'
+                   'officeDocument/2006/relationships/worksheet"/></Relationships>')
+        z.writestr("xl/worksheets/sheet1.xml",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                   f'<sheetData>{"".join(rows)}</sheetData></worksheet>')
+
+
+def generate_corpus(out_dir, num_files=200, file_chars=5000, mix=None, seed=0):
+    """
+    在 out_dir 下生成 num_files 个文件，按 mix 中的比例分配格式
+    :return: {扩展名: 文件数}
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    exts, weights = zip(*mix.items())
+    counts = {}
+    for i in range(num_files):
+        ext = rng.choices(exts, weights)[0]
+        sub_dir = os.path.join(out_dir, f"dir{i % 10}")
+        os.makedirs(sub_dir, exist_ok=True)
+        path = os.path.join(sub_dir, f"doc{i}.{ext}")
+        if ext == "pdf":
+            write_pdf(path, random_text(rng, file_chars, cjk_ratio=0.0))
+        elif ext == "docx":
+            write_docx(path, random_text(rng, file_chars))
+        elif ext == "xlsx":
+            write_xlsx(path, random_text(rng, file_chars))
+        elif ext in ("txt", "md"):
+            text = random_text(rng, file_chars)
+            if ext == "md":
+                text = f"# 文档 {i}\n\n" + text
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            raise ValueError(f"不支持生成的格式：{ext}")
+        counts[ext] = counts.get(ext, 0) + 1
+    return counts
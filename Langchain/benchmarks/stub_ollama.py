@@ -0,0 +1,181 @@
+# stub_ollama.py
+"""
+本地替身 Ollama 服务，用于在没有 GPU、没有网络的机器上做基准测试
+实现嵌入接口 /api/embed 与旧版 /api/embeddings，向量由文本哈希确定，相同文本得到相同向量；
+可配置维度、单次请求延迟、每条文本的额外延迟以及服务端并行槽位数（模拟 OLLAMA_NUM_PARALLEL）
+对话接口 /api/chat 以 NDJSON 流式返回固定数量的 token，可配置首 token 延迟和每个 token 的间隔
+用法：
+    python benchmarks/stub_ollama.py --port 11500 --dim 3584 --latency-ms 20 --per-item-ms 5
+    OLLAMA_HOST=http://127.0.0.1:11500 python vector.py ...
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def stub_embedding(text: str, dim: int):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_chunk(self, payload):
+        body = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n" % len(body) + body + b"\r\n")
+        self.wfile.flush()
+
+    def _chat(self, data):
+        """按 Ollama 的 NDJSON 流式格式逐 token 返回，生成期间占用一个并行槽位"""
+        server = self.server
+        model = data.get("model", "stub")
+        stream = data.get("stream", True)
+        created = datetime.now(timezone.utc).isoformat()
+        tokens = [f"token{i} " for i in range(server.tokens)]
+        with server.slots:
+            start = time.perf_counter()
+            time.sleep(server.ttft)
+            if not stream:
+                time.sleep(server.token_interval * len(tokens))
+            else:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, tok in enumerate(tokens):
+                    if i:
+                        time.sleep(server.token_interval)
+                    self._send_chunk({"model": model, "created_at": created,
+                                      "message": {"role": "assistant", "content": tok}, "done": False})
+        with server.lock:
+            server.requests += 1
+            server.items += len(tokens)
+        final = {
+            "model": model,
+            "created_at": created,
+            "message": {"role": "assistant", "content": "" if stream else "".join(tokens)},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - start) * 1e9),
+            "prompt_eval_count": sum(len(m.get("content", "")) for m in data.get("messages", [])) // 2,
+            "eval_count": len(tokens),
+        }
+        if not stream:
+            self._send_json(final)
+            return
+        self._send_chunk(final)
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _simulate(self, n_items):
+        """按配置的延迟占用一个并行槽位，槽位用完时请求排队"""
+        server = self.server
+        with server.slots:
+            time.sleep(server.latency + server.per_item * n_items)
+        with server.lock:
+            server.requests += 1
+            server.items += n_items
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": []})
+        elif self.path == "/api/version":
+            self._send_json({"version": "stub"})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        data = self._read_json()
+        if self.path == "/api/embed":
+            inputs = data.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._simulate(len(inputs))
+            self._send_json({
+                "model": data.get("model", "stub"),
+                "embeddings": [stub_embedding(t, self.server.dim) for t in inputs],
+            })
+        elif self.path == "/api/embeddings":
+            self._simulate(1)
+            self._send_json({"embedding": stub_embedding(data.get("prompt", ""), self.server.dim)})
+        elif self.path == "/api/chat":
+            self._chat(data)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, dim=3584, latency_ms=0.0, per_item_ms=0.0, parallel=4,
+                 ttft_ms=200.0, token_ms=20.0, tokens=64):
+        super().__init__((host, port), StubOllamaHandler)
+        self.dim = dim
+        self.latency = latency_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self.ttft = ttft_ms / 1000
+        self.token_interval = token_ms / 1000
+        self.tokens = tokens
+        self.slots = threading.BoundedSemaphore(parallel)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.items = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中运行，返回自身便于链式调用"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地替身 Ollama 嵌入服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--dim", type=int, default=3584, help="向量维度，deepseek-r1:7b 为 3584")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="每个请求的固定延迟")
+    parser.add_argument("--per-item-ms", type=float, default=5.0, help="每条文本的额外延迟")
+    parser.add_argument("--parallel", type=int, default=4, help="服务端并行槽位数")
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="对话接口的首 token 延迟")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="对话接口每个 token 的间隔")
+    parser.add_argument("--tokens", type=int, default=64, help="对话接口每次回答的 token 数")
+    args = parser.parse_args(argv)
+
+    server = StubOllamaServer(args.host, args.port, args.dim, args.latency_ms, args.per_item_ms, args.parallel,
+                              args.ttft_ms, args.token_ms, args.tokens)
+    print(f"替身 Ollama 服务已启动：{server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# cjk_splitter.py
+import math
+import re
+from collections import deque
+
+from langchain_core.documents import Document
+
+# 句子边界：中文句末标点（可带后引号/括号）、换行、后跟空白的西文句末标点
+_BOUNDARY = re.compile(
+    r"[。！？；…]+[”’」』）)]*"
+    r"|[.!?;]+[\"')\]]*(?=\s)"
+    r"|\n+"
+)
+# 近似分词：CJK 字符一字一个 token，西文单词/数字约 4 个字符一个 token，其他符号各算一个
+_TOKEN_PIECES = re.compile(
+    r"([㐀-䶿一-鿿豈-﫿぀-ヿ가-힯])"
+    r"|([A-Za-z0-9_]+)"
+    r"|(\S)"
+)
+
+
+def approx_token_len(text: str) -> int:
+    """不依赖分词器的 token 数估算，用于按 token 控制文本块大小"""
+    n = 0
+    for cjk, word, _ in _TOKEN_PIECES.findall(text):
+        n += math.ceil(len(word) / 4) if word else 1
+    return n
+
+
+class CJKSentenceSplitter:
+    """
+    线性时间的中英文句子感知分割器，可替代 RecursiveCharacterTextSplitter
+    一次正则扫描切出句子，再用滑动窗口把句子打包成不超过 chunk_size 的文本块，
+    相邻文本块之间保留不超过 chunk_overlap 的整句重叠；
+    每个句子只计算一次长度，超长句子按字符硬切分
+    文本块是原文的连续切片，start_index 直接取切片起点，无需再在原文中查找
+    参数说明：
+    - chunk_size / chunk_overlap：以 length_function 的单位计
+    - length_function：默认按字符计，传入 approx_token_len 或分词器计数函数即按 token 计
+    """
+
+    def __init__(self, chunk_size=800, chunk_overlap=150, length_function=len, add_start_index=True):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap 必须小于 chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_function = length_function
+        self.add_start_index = add_start_index
+
+    def _pieces(self, text):
+        """产出 (起点, 终点, 长度)，超过 chunk_size 的句子被切成多段"""
+        pos = 0
+        for m in _BOUNDARY.finditer(text):
+            if m.end() > pos:
+                yield from self._measure(text, pos, m.end())
+                pos = m.end()
+        if pos < len(text):
+            yield from self._measure(text, pos, len(text))
+
+    def _measure(self, text, start, end):
+        n = self.length_function(text[start:end])
+        if n <= self.chunk_size:
+            yield start, end, n
+            return
+        # 超长句子：按长度比例估算每段的字符数后硬切
+        step = max(1, (end - start) * self.chunk_size // n)
+        for s in range(start, end, step):
+            e = min(s + step, end)
+            yield s, e, self.length_function(text[s:e])
+
+    def split_spans(self, text):
+        """返回每个文本块在原文中的 (起点, 终点)，已去除首尾空白"""
+        spans = []
+        window = deque()
+        window_len = 0
+        last_end = -1
+
+        def emit():
+            s, e = window[0][0], window[-1][1]
+            while s < e and text[s].isspace():
+                s += 1
+            while e > s and text[e - 1].isspace():
+                e -= 1
+            if e > s:
+                spans.append((s, e))
+
+        for start, end, n in self._pieces(text):
+            if window and window_len + n > self.chunk_size:
+                emit()
+                last_end = window[-1][1]
+                # 从窗口头部弹出句子，剩下的作为与下一块的重叠部分
+                while window and (window_len > self.chunk_overlap or window_len + n > self.chunk_size):
+                    window_len -= window.popleft()[2]
+            window.append((start, end, n))
+            window_len += n
+        if window and window[-1][1] > last_end:
+            emit()
+        return spans
+
+    def split_text(self, text):
+        return [text[s:e] for s, e in self.split_spans(text)]
+
+    def split_documents(self, documents):
+        chunks = []
+        for doc in documents:
+            text = doc.page_content
+            for s, e in self.split_spans(text):
+                metadata = dict(doc.metadata)
+                if self.add_start_index:
+                    metadata["start_index"] = s
+                chunks.append(Document(page_content=text[s:e], metadata=metadata))
+        return chunks
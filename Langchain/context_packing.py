@@ -0,0 +1,168 @@
+# context_packing.py
+"""
+上下文组装：位于检索器和提示词模板之间
+检索结果经常包含同一文件中相邻的文本块，它们之间 chunk_overlap 长度的重叠会在 {context} 中重复出现；
+这里按 source（及 PDF 的 page）和 start_index 合并相邻或重叠的文本块，去掉重复文本，
+按相关性排序后截断到 token 预算，缩短 prefill 时间
+"""
+import hashlib
+import logging
+import threading
+
+from cjk_splitter import approx_token_len
+from embedding_cache import normalize_text
+from instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+# 上下文的 token 预算（估算值）
+CONTEXT_TOKEN_BUDGET = 2000
+# 两个文本块之间相隔不超过该字符数时视为相邻，直接拼接
+MERGE_GAP = 0
+
+
+class _Span:
+    """合并后的文本片段，rank 为其中最相关文本块的检索名次"""
+
+    def __init__(self, doc, rank):
+        self.source = doc.metadata.get("source", "")
+        self.page = doc.metadata.get("page")
+        self.start = doc.metadata.get("start_index")
+        if self.start is not None and self.start < 0:
+            self.start = None
+        self.text = doc.page_content
+        self.rank = rank
+        # 原文中的结束位置；中间插入省略号后 text 的长度不再对应原文位置，单独记录
+        self.end = self.start + len(self.text) if self.start is not None else None
+
+    def absorb(self, other):
+        """把起点不早于自身的 other 拼接到末尾，重叠部分只保留一份"""
+        overlap = self.end - other.start
+        if overlap < 0:
+            # 相隔不超过 gap 的两个文本块，中间省略的原文用省略号表示
+            self.text += "……" + other.text
+        elif other.end > self.end:
+            self.text += other.text[overlap:]
+        self.end = max(self.end, other.end)
+        self.rank = min(self.rank, other.rank)
+
+
+def merge_chunks(docs, gap=MERGE_GAP):
+    """
+    合并同一文档（同一页）中相邻或重叠的文本块，并去掉文本相同的块
+    没有 start_index 元数据的文本块不参与合并
+    :return: 按相关性（最高名次）排序的 _Span 列表
+    """
+    groups, spans = {}, []
+    for rank, doc in enumerate(docs):
+        span = _Span(doc, rank)
+        if span.start is None:
+            spans.append(span)
+        else:
+            groups.setdefault((span.source, span.page), []).append(span)
+    for group in groups.values():
+        group.sort(key=lambda s: s.start)
+        current = group[0]
+        for span in group[1:]:
+            if span.start <= current.end + gap:
+                current.absorb(span)
+            else:
+                spans.append(current)
+                current = span
+        spans.append(current)
+
+    seen, unique = set(), []
+    for span in sorted(spans, key=lambda s: s.rank):
+        digest = hashlib.md5(normalize_text(span.text).encode("utf-8")).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(span)
+    return unique
+
+
+def truncate_to_tokens(text, budget):
+    """截取不超过 budget 个估算 token 的最长前缀（二分查找）"""
+    if approx_token_len(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if approx_token_len(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def format_span(span):
+    head = f"[来源：{span.source}" + (f" 第 {span.page + 1} 页" if isinstance(span.page, int) else "") + "]"
+    return f"{head}\n{span.text}"
+
+
+class ContextPacker:
+    """
+    可直接放进 LCEL 链：retriever | RunnableLambda(packer)
+    每次调用记录原始上下文与组装后上下文的 token 数，report() 输出累计节省量
+    """
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, gap=MERGE_GAP, verbose=False):
+        """verbose 为 True 时每次查询把节省的 token 数打印到控制台，否则只写 INFO 日志"""
+        self.token_budget = token_budget
+        self.gap = gap
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def pack(self, docs):
+        with stage("pack"):
+            return self._pack(docs)
+
+    def _pack(self, docs):
+        spans = merge_chunks(docs, self.gap)
+        parts, used = [], 0
+        for span in spans:
+            block = format_span(span)
+            cost = approx_token_len(block)
+            if used + cost > self.token_budget:
+                # 预算不足时截断当前片段，之后的片段全部丢弃
+                block = truncate_to_tokens(block, self.token_budget - used)
+                if block:
+                    parts.append(block)
+                break
+            parts.append(block)
+            used += cost
+        context = "\n\n".join(parts)
+
+        # 之前直接把 Document 列表原样填入 {context}
+        before, after = approx_token_len(str(docs)), approx_token_len(context)
+        with self._lock:
+            self.queries += 1
+            self.tokens_before += before
+            self.tokens_after += after
+        message = (f"上下文组装：{len(docs)} 块 -> {len(parts)} 段，"
+                   f"prompt token {before} -> {after}，节省 {before - after}")
+        if self.verbose:
+            print(message)
+        else:
+            logger.info(message)
+        return context
+
+    __call__ = pack
+
+    def stats(self):
+        saved = self.tokens_before - self.tokens_after
+        return {
+            "queries": self.queries,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": saved,
+            "saved_ratio": saved / self.tokens_before if self.tokens_before else 0.0,
+        }
+
+    def report(self):
+        s = self.stats()
+        if s["queries"]:
+            print(f"上下文组装：{s['queries']} 次查询，共节省 prompt token {s['tokens_saved']}"
+                  f"（{s['saved_ratio']:.1%}），平均每次 {s['tokens_saved'] / s['queries']:.0f}")
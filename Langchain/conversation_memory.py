@@ -0,0 +1,195 @@
+# conversation_memory.py
+"""
+多轮对话记忆
+ConversationBufferMemory 保存全部历史，每轮都把越来越长的历史送进 prompt，prefill 延迟随轮数线性增长
+这里每个会话只原样保留最近 MEMORY_TURNS 轮，更早的轮次在回答流式输出结束后于后台线程中
+合并进滚动摘要；写入前去掉 deepseek-r1 的 <think> 推理过程；
+历史和摘要都有 token 上限，会话数有上限并按最久未使用淘汰，服务端内存可预期
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from cjk_splitter import approx_token_len
+from context_packing import truncate_to_tokens
+
+# 原样保留的最近轮数
+MEMORY_TURNS = 4
+# 送入 prompt 的历史（摘要 + 最近轮次）的 token 预算
+MEMORY_TOKEN_BUDGET = 1200
+# 单轮问题/回答保存的最大 token 数
+TURN_MAX_TOKENS = 600
+# 滚动摘要的最大 token 数
+SUMMARY_MAX_TOKENS = 400
+# 最多同时保存的会话数，超出后淘汰最久未使用的会话
+MAX_SESSIONS = 1000
+# 会话空闲超过该秒数后丢弃
+SESSION_TTL = 2 * 3600
+
+_THINK = re.compile(r"<think>.*?(</think>|$)", re.S)
+
+SUMMARY_PROMPT = """请把下面的对话历史压缩为一段简洁的中文摘要，保留用户关心的问题、已经给出的关键结论和专有名词，
+不要超过 {max_tokens} 字。
+
+已有摘要：
+{summary}
+
+新增对话：
+{turns}
+
+摘要："""
+
+
+def strip_think(text):
+    """去掉 <think>...</think> 推理过程，未闭合的 <think> 一直删到末尾"""
+    if "</think>" in text and "<think>" not in text:
+        text = text.split("</think>", 1)[1]
+    return _THINK.sub("", text).strip()
+
+
+def format_turns(turns):
+    return "\n".join(f"用户：{q}\n助手：{a}" for q, a in turns)
+
+
+def build_summarizer(llm):
+    """用对话模型生成滚动摘要，返回 summarize(旧摘要, [(问题, 回答)]) -> 新摘要"""
+
+    def summarize(summary, turns):
+        prompt = SUMMARY_PROMPT.format(
+            max_tokens=SUMMARY_MAX_TOKENS, summary=summary or "（无）", turns=format_turns(turns)
+        )
+        return strip_think(llm.invoke(prompt).content)
+
+    return summarize
+
+
+class ConversationMemory:
+    """单个会话的记忆：滚动摘要 + 待摘要的轮次 + 最近轮次"""
+
+    def __init__(self, max_turns=MEMORY_TURNS, token_budget=MEMORY_TOKEN_BUDGET):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary = ""
+        self.recent = deque()
+        # 已移出最近轮次、还没有合并进摘要的轮次
+        self.pending = []
+        self.summarizing = False
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+
+    def add_turn(self, question, answer):
+        """
+        记录一轮对话，回答中的 <think> 部分不保存
+        :return: 是否有需要合并进摘要的旧轮次
+        """
+        turn = (truncate_to_tokens(question, TURN_MAX_TOKENS),
+                truncate_to_tokens(strip_think(answer), TURN_MAX_TOKENS))
+        with self.lock:
+            self.last_used = time.time()
+            self.recent.append(turn)
+            while len(self.recent) > self.max_turns:
+                self.pending.append(self.recent.popleft())
+            return bool(self.pending) and not self.summarizing
+
+    def messages(self):
+        """
+        送入 MessagesPlaceholder("chat_history") 的消息列表
+        摘要优先，其次从最近的轮次往前填，超出 token 预算的更早轮次不再送入
+        """
+        with self.lock:
+            self.last_used = time.time()
+            summary, turns = self.summary, list(self.pending) + list(self.recent)
+        budget = self.token_budget
+        head = []
+        if summary:
+            head = [SystemMessage(content=f"此前对话摘要：{summary}")]
+            budget -= approx_token_len(summary)
+        tail = []
+        for question, answer in reversed(turns):
+            cost = approx_token_len(question) + approx_token_len(answer)
+            if cost > budget:
+                break
+            budget -= cost
+            tail[:0] = [HumanMessage(content=question), AIMessage(content=answer)]
+        return head + tail
+
+    def is_empty(self):
+        with self.lock:
+            return not (self.summary or self.pending or self.recent)
+
+    def fold(self, summarize):
+        """把待摘要的轮次合并进摘要，模型调用期间不持有锁"""
+        with self.lock:
+            if self.summarizing or not self.pending:
+                return
+            self.summarizing = True
+            summary, turns = self.summary, list(self.pending)
+        try:
+            new_summary = truncate_to_tokens(summarize(summary, turns), SUMMARY_MAX_TOKENS)
+        except Exception as e:
+            print(f"\n对话摘要失败：{str(e)}")
+            new_summary = None
+        with self.lock:
+            self.summarizing = False
+            if new_summary is not None:
+                self.summary = new_summary
+                # 摘要期间可能又有新的轮次进入 pending，只移除已经摘要的部分
+                del self.pending[:len(turns)]
+            elif len(self.pending) > self.max_turns:
+                # 摘要持续失败时丢弃最旧的轮次，保证内存有上限
+                del self.pending[:len(self.pending) - self.max_turns]
+
+
+class SessionStore:
+    """
+    按会话 id 隔离的记忆，线程安全
+    摘要在后台线程中生成，不占用回答的时间
+    """
+
+    def __init__(self, summarize, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL,
+                 max_turns=MEMORY_TURNS, token_budget=MEMORY_TOKEN_BUDGET, summary_workers=1):
+        self.summarize = summarize
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=summary_workers, thread_name_prefix="summary")
+
+    def get(self, session_id):
+        with self._lock:
+            now = time.time()
+            for key in [k for k, m in self._sessions.items() if now - m.last_used > self.ttl]:
+                del self._sessions[key]
+            memory = self._sessions.get(session_id)
+            if memory is None:
+                memory = ConversationMemory(self.max_turns, self.token_budget)
+                self._sessions[session_id] = memory
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return memory
+
+    def history(self, session_id):
+        return self.get(session_id).messages()
+
+    def record(self, session_id, question, answer):
+        """保存一轮对话；需要时在后台更新摘要"""
+        memory = self.get(session_id)
+        if memory.add_turn(question, answer):
+            self._executor.submit(memory.fold, self.summarize)
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
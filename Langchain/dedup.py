@@ -0,0 +1,101 @@
+# dedup.py
+import hashlib
+import re
+from collections import defaultdict
+
+import numpy as np
+
+# MinHash 排列数 = 分带数 × 每带行数
+# 16 带 × 8 行时，Jaccard 相似度约 0.7 以上的文本块才大概率落入同一个桶
+NUM_BANDS = 16
+ROWS_PER_BAND = 8
+# 候选对的估计 Jaccard 相似度达到该阈值才视为近似重复
+DEDUP_THRESHOLD = 0.8
+# 字符 n-gram 长度，对中文和英文都适用
+SHINGLE_SIZE = 5
+
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_SHINGLE_BASE = np.uint64(1000003)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def shingle_hashes(text: str, k: int = SHINGLE_SIZE):
+    """
+    把文本规范化后切成字符 k-gram，返回去重后的 32 位哈希数组
+    用 numpy 对码点做多项式滚动哈希，避免逐个 k-gram 调用哈希函数
+    """
+    text = _WHITESPACE.sub(" ", text).strip().lower()
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < k:
+        codes = np.pad(codes, (0, k - len(codes)))
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)
+    weights = _SHINGLE_BASE ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+    # uint64 溢出按 2^64 取模，结果再截断到 32 位
+    return np.unique((windows * weights).sum(axis=1) & _MAX_HASH)
+
+
+class MinHashDeduper:
+    """
+    基于 MinHash + LSH 分带的近似重复文本块检测
+    每个文本块计算一次签名，按带哈希进桶，只和同桶的候选比较，整体近似线性时间
+    精确重复（规范化后文本完全相同）直接命中，不计算签名
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_bands=NUM_BANDS, rows_per_band=ROWS_PER_BAND, seed=1):
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self.rows_per_band = rows_per_band
+        num_perm = num_bands * rows_per_band
+        rng = np.random.default_rng(seed)
+        # 乘法-移位哈希：a 取奇数，(a*x + b) 按 2^64 取模后取高 32 位
+        self._a = rng.integers(0, 1 << 64, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 64, size=num_perm, dtype=np.uint64)
+        self._exact = {}
+        self._buckets = [defaultdict(list) for _ in range(num_bands)]
+        self._signatures = {}
+        self.seen = 0
+        self.duplicates = 0
+
+    def signature(self, text: str):
+        hashes = shingle_hashes(text)
+        # (排列数 × shingle 数) 的矩阵运算，按行取最小值
+        phv = (np.outer(self._a, hashes) + self._b[:, None]) >> np.uint64(32)
+        return phv.min(axis=1).astype(np.uint32)
+
+    def add(self, doc_id: str, text: str):
+        """
+        登记一个文本块；若与已登记的文本块近似重复，返回代表文本块的 id，否则返回 None
+        """
+        self.seen += 1
+        exact_key = hashlib.sha1(_WHITESPACE.sub(" ", text).strip().encode("utf-8")).digest()
+        rep = self._exact.get(exact_key)
+        if rep is not None:
+            self.duplicates += 1
+            return rep
+
+        sig = self.signature(text)
+        bands = [sig[i * self.rows_per_band:(i + 1) * self.rows_per_band].tobytes() for i in range(self.num_bands)]
+        candidates = set()
+        for bucket, band in zip(self._buckets, bands):
+            candidates.update(bucket.get(band, ()))
+        best, best_sim = None, self.threshold
+        for cand in candidates:
+            sim = float(np.mean(self._signatures[cand] == sig))
+            if sim >= best_sim:
+                best, best_sim = cand, sim
+        if best is not None:
+            self._exact[exact_key] = best
+            self.duplicates += 1
+            return best
+
+        self._exact[exact_key] = doc_id
+        self._signatures[doc_id] = sig
+        for bucket, band in zip(self._buckets, bands):
+            bucket[band].append(doc_id)
+        return None
+
+    def report(self, batch_size=None):
+        msg = f"近似去重：检查文本块 {self.seen}，重复 {self.duplicates}，节省嵌入调用 {self.duplicates} 次（按文本块计）"
+        if batch_size:
+            msg += f"，约 {self.duplicates // batch_size} 个批次"
+        print(msg)
@@ -0,0 +1,193 @@
+# embed_pipeline.py
+import queue
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from itertools import islice
+
+# 每批发送给嵌入服务的文本块数
+EMBED_BATCH_SIZE = 32
+# 同时在途的嵌入请求数，建议与 Ollama 的 OLLAMA_NUM_PARALLEL 保持一致
+EMBED_WORKERS = 4
+# 单批失败后的最大重试次数
+EMBED_MAX_RETRIES = 3
+# 重试退避基数（秒），第 n 次重试等待 backoff * 2^n 秒并加随机抖动
+EMBED_BACKOFF = 1.0
+# 加载/分割与向量化之间缓冲的最大文本块数，决定流水线的峰值内存
+QUEUE_DEPTH = 256
+
+_END = object()
+
+
+def iter_batches(items, batch_size):
+    """将任意可迭代对象按 batch_size 切分为列表，不会一次性展开整个输入"""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def prefetch(iterable, queue_depth=QUEUE_DEPTH):
+    """
+    在后台线程中运行生成器，通过有界队列把结果交给调用方
+    让上游（加载、分割）与下游（向量化）同时进行；队列满时上游阻塞，内存占用有上限
+    上游抛出的异常会在调用方重新抛出
+    """
+    q = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        q.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            q.put(_END)
+        except BaseException as e:
+            q.put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # 调用方提前退出时通知上游线程停止
+        stop.set()
+
+
+def embed_with_retry(embeddings, texts, max_retries=EMBED_MAX_RETRIES, backoff=EMBED_BACKOFF):
+    """调用嵌入模型，失败时按指数退避重试，重试耗尽后抛出最后一次的异常"""
+    for attempt in range(max_retries + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * (1 + random.random() * 0.5))
+
+
+class ThroughputReporter:
+    """统计向量化进度，输出 块/秒 和预计剩余时间"""
+
+    def __init__(self, total=None, interval=1.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.start = time.time()
+        self._last_print = 0.0
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def update(self, n, failed=False):
+        if failed:
+            self.failed += n
+        else:
+            self.done += n
+        now = time.time()
+        if now - self._last_print >= self.interval:
+            self._last_print = now
+            self.print_progress()
+
+    def print_progress(self, end=""):
+        msg = f"\r已向量化 {self.done} 块，{self.rate:.1f} 块/秒"
+        if self.total:
+            remaining = self.total - self.done - self.failed
+            eta = remaining / self.rate if self.rate > 0 else float("inf")
+            msg += f"，进度 {self.done + self.failed}/{self.total}，预计剩余 {eta:.0f} 秒"
+        if self.failed:
+            msg += f"，失败 {self.failed} 块"
+        print(msg, end=end, flush=True)
+
+
+def embed_and_store(db, embeddings, documents, ids=None, **kwargs):
+    """
+    分批并发向量化文档，并在每批完成后立即写入 Chroma 集合
+    :param db: Chroma 向量库
+    :param embeddings: 嵌入模型（实现 embed_documents 即可）
+    :param documents: 文档的可迭代对象，可以是生成器
+    :param ids: 与 documents 一一对应的 id，可迭代对象；为 None 时随机生成
+    其余参数见 embed_pairs_and_store
+    :return: (成功写入块数, 失败的 id 列表)
+    """
+    if ids is None:
+        pairs = ((doc, str(uuid.uuid4())) for doc in documents)
+    else:
+        pairs = zip(documents, ids)
+    return embed_pairs_and_store(db, embeddings, pairs, **kwargs)
+
+
+def embed_pairs_and_store(
+    db,
+    embeddings,
+    pairs,
+    total=None,
+    batch_size=EMBED_BATCH_SIZE,
+    max_workers=EMBED_WORKERS,
+    max_retries=EMBED_MAX_RETRIES,
+    backoff=EMBED_BACKOFF,
+    on_stored=None,
+):
+    """
+    与 embed_and_store 相同，输入为 (文档, id) 的可迭代对象
+    :param total: 文档总数，仅用于估算剩余时间，流式输入时可以为 None
+    :param batch_size: 每批文本块数
+    :param max_workers: 同时在途的嵌入请求数
+    :param on_stored: 每批写入成功后以 (id 列表, 文本列表) 调用，用于同步维护倒排索引等附属索引
+    """
+    reporter = ThroughputReporter(total=total)
+    failed_ids = []
+    # 最多同时保留 max_workers * 2 个批次，既能让嵌入服务保持满载，又不会把整个语料提前读入内存
+    max_in_flight = max_workers * 2
+
+    def handle(future, batch):
+        batch_ids = [doc_id for _, doc_id in batch]
+        try:
+            vectors = future.result()
+            db._collection.upsert(
+                ids=batch_ids,
+                embeddings=vectors,
+                metadatas=[doc.metadata for doc, _ in batch],
+                documents=[doc.page_content for doc, _ in batch],
+            )
+            if on_stored is not None:
+                on_stored(batch_ids, [doc.page_content for doc, _ in batch])
+            reporter.update(len(batch))
+        except Exception as e:
+            failed_ids.extend(batch_ids)
+            reporter.update(len(batch), failed=True)
+            print(f"\n批次向量化失败（{len(batch)} 块）：{str(e)}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+        for batch in iter_batches(pairs, batch_size):
+            texts = [doc.page_content for doc, _ in batch]
+            future = executor.submit(embed_with_retry, embeddings, texts, max_retries, backoff)
+            in_flight[future] = batch
+            if len(in_flight) >= max_in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    handle(f, in_flight.pop(f))
+        for f in as_completed(list(in_flight)):
+            handle(f, in_flight.pop(f))
+
+    reporter.print_progress(end="\n")
+    return reporter.done, failed_ids
@@ -0,0 +1,312 @@
+# embedding_backends.py
+"""
+嵌入后端注册表，入库（vector.py）和查询（ollama_qa.py）共用同一份配置
+- ollama：通过 Ollama 服务向量化（原有方式，默认 deepseek-r1:7b）
+- sentence-transformers：进程内 CPU 推理的小型专用嵌入模型，按批推理，不占用 Ollama
+- hashed：确定性的特征哈希嵌入，无需模型，用于测试和基准
+向量库的集合元数据中记录入库时的后端、模型和维度，查询端不一致时直接报错；
+更换嵌入模型后用 migrate 子命令重新向量化已有向量库
+用法（在 Langchain 目录下运行）：
+    python embedding_backends.py info
+    python embedding_backends.py migrate --backend sentence-transformers --model BAAI/bge-small-zh-v1.5
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings
+
+# 默认嵌入后端与模型；改为 sentence-transformers 后需对已有向量库执行 migrate
+EMBED_BACKEND = "ollama"
+EMBED_MODEL = "deepseek-r1:7b"
+# 各后端未指定模型时使用的默认模型
+DEFAULT_MODELS = {
+    "ollama": "deepseek-r1:7b",
+    "sentence-transformers": "BAAI/bge-small-zh-v1.5",
+    "hashed": "hashed-256",
+}
+# 进程内模型每批推理的文本数
+LOCAL_BATCH_SIZE = 32
+
+EMBEDDING_BACKENDS = {}
+
+
+class EmbeddingMismatchError(ValueError):
+    """查询端的嵌入模型与向量库入库时使用的不一致"""
+
+
+def register_backend(name):
+    """注册嵌入后端：factory(model, **options) -> Embeddings"""
+
+    def decorator(factory):
+        EMBEDDING_BACKENDS[name] = factory
+        return factory
+
+    return decorator
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """
+    进程内 CPU 推理的 sentence-transformers 模型，模型只加载一次，按 batch_size 分批推理
+    bge 系列模型在查询端可加检索指令前缀（query_prefix），文档端不加
+    """
+
+    def __init__(self, model, device="cpu", batch_size=LOCAL_BATCH_SIZE, query_prefix=""):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model
+        self.batch_size = batch_size
+        self.query_prefix = query_prefix
+        self.client = SentenceTransformer(model, device=device)
+
+    @property
+    def dimension(self):
+        return self.client.get_sentence_embedding_dimension()
+
+    def _encode(self, texts):
+        vectors = self.client.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.astype(np.float32).tolist()
+
+    def embed_documents(self, texts):
+        return self._encode(texts)
+
+    def embed_query(self, text):
+        return self._encode([self.query_prefix + text])[0]
+
+
+class HashedEmbeddings(Embeddings):
+    """
+    确定性的特征哈希嵌入：分词后每个词按哈希映射到一个维度和正负号，按词频累加后归一化
+    相同文本总是得到相同向量，词重合越多余弦相似度越高
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    @property
+    def dimension(self):
+        return self.dim
+
+    def _embed(self, text):
+        from lexical_index import tokenize
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text, tokenizer="bigram"):
+            h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+@register_backend("ollama")
+def _ollama(model, **options):
+    from langchain_ollama import OllamaEmbeddings
+
+    return OllamaEmbeddings(model=model, **options)
+
+
+@register_backend("sentence-transformers")
+def _sentence_transformers(model, **options):
+    return SentenceTransformerEmbeddings(model, **options)
+
+
+@register_backend("hashed")
+def _hashed(model, **options):
+    # 模型名形如 hashed-256，数字为维度
+    dim = int(model.rsplit("-", 1)[-1]) if model.rsplit("-", 1)[-1].isdigit() else 256
+    return HashedEmbeddings(dim=options.get("dim", dim))
+
+
+def build_embeddings(backend=None, model=None, **options):
+    """
+    按后端名称创建嵌入模型，外层套一层磁盘缓存
+    缓存键包含后端和模型名，不同模型的向量不会混用
+    """
+    backend = backend or EMBED_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"未知的嵌入后端：{backend}，可选：{', '.join(EMBEDDING_BACKENDS)}")
+    model = model or (EMBED_MODEL if backend == EMBED_BACKEND else DEFAULT_MODELS[backend])
+    # ollama 后端沿用原来的缓存命名空间，已有缓存继续有效
+    namespace = model if backend == "ollama" else f"{backend}/{model}"
+    embeddings = CachedEmbeddings(EMBEDDING_BACKENDS[backend](model, **options), model_name=namespace)
+    embeddings.backend_name = backend
+    embeddings.embed_model = model
+    return embeddings
+
+
+def embedding_dimension(embeddings):
+    """嵌入维度；远程模型没有维度属性时向量化一条探测文本"""
+    dim = getattr(getattr(embeddings, "embeddings", embeddings), "dimension", None)
+    if dim is None:
+        dim = len(embeddings.embed_query("dimension probe"))
+    return int(dim)
+
+
+def embedding_signature(embeddings):
+    return {
+        "embed_backend": getattr(embeddings, "backend_name", "unknown"),
+        "embed_model": getattr(embeddings, "embed_model", type(embeddings).__name__),
+        "embed_dim": embedding_dimension(embeddings),
+    }
+
+
+def read_store_signature(db):
+    """向量库集合元数据中记录的嵌入后端、模型和维度，没有记录时返回 None"""
+    metadata = db._collection.metadata or {}
+    if "embed_model" not in metadata:
+        return None
+    return {key: metadata.get(key) for key in ("embed_backend", "embed_model", "embed_dim")}
+
+
+def write_store_signature(db, signature):
+    db._collection.modify(metadata={**(db._collection.metadata or {}), **signature})
+
+
+def stored_vector_dim(db):
+    """从集合中取一条向量推断维度，空集合返回 None"""
+    got = db._collection.get(limit=1, include=["embeddings"])
+    if len(got["ids"]) == 0:
+        return None
+    return len(got["embeddings"][0])
+
+
+def check_store_embeddings(db, embeddings):
+    """
+    检查当前嵌入模型与向量库入库时使用的是否一致，不一致时抛出 EmbeddingMismatchError
+    旧向量库没有记录时只比较向量维度
+    :return: 当前嵌入模型的签名
+    """
+    signature = embedding_signature(embeddings)
+    stored = read_store_signature(db)
+    if stored is not None:
+        if (stored["embed_model"], int(stored["embed_dim"])) != (signature["embed_model"], signature["embed_dim"]):
+            raise EmbeddingMismatchError(
+                f"向量库使用 {stored['embed_backend']}:{stored['embed_model']}（{stored['embed_dim']} 维）入库，"
+                f"当前配置为 {signature['embed_backend']}:{signature['embed_model']}（{signature['embed_dim']} 维），"
+                f"请运行 python embedding_backends.py migrate 重新向量化"
+            )
+        return signature
+    dim = stored_vector_dim(db)
+    if dim is not None and dim != signature["embed_dim"]:
+        raise EmbeddingMismatchError(
+            f"向量库中的向量为 {dim} 维，当前嵌入模型 {signature['embed_model']} 为 {signature['embed_dim']} 维，"
+            f"请运行 python embedding_backends.py migrate 重新向量化"
+        )
+    return signature
+
+
+def migrate_store(persist_dir, embeddings, batch_size=None, max_workers=None, read_batch=1000, keep_backup=True):
+    """
+    用新的嵌入模型重新向量化整个向量库
+    在临时目录中按原 id、文本和元数据重建集合与倒排索引，复制入库清单，完成后替换原目录；
+    压缩向量索引与新维度不兼容，不会复制，需要时重新构建
+    :return: 重新向量化的文本块数
+    """
+    from langchain_chroma import Chroma
+
+    from embed_pipeline import EMBED_BATCH_SIZE, EMBED_WORKERS, embed_pairs_and_store
+    from lexical_index import LEXICAL_INDEX_NAME, LexicalIndex
+    from manifest import MANIFEST_NAME, bump_store_version
+
+    persist_dir = os.path.abspath(persist_dir)
+    work_dir = persist_dir + ".migrating"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    source = Chroma(persist_directory=persist_dir)
+    total = source._collection.count()
+    target = Chroma(persist_directory=work_dir, embedding_function=embeddings)
+    lexical = LexicalIndex(os.path.join(work_dir, LEXICAL_INDEX_NAME))
+
+    def pairs():
+        for offset in range(0, total, read_batch):
+            got = source._collection.get(include=["documents", "metadatas"], limit=read_batch, offset=offset)
+            for doc_id, text, metadata in zip(got["ids"], got["documents"], got["metadatas"]):
+                yield Document(page_content=text, metadata=metadata or {}), doc_id
+
+    done, failed_ids = embed_pairs_and_store(
+        target, embeddings, pairs(), total=total,
+        batch_size=batch_size or EMBED_BATCH_SIZE, max_workers=max_workers or EMBED_WORKERS,
+        on_stored=lexical.add_many,
+    )
+    lexical.close()
+    if failed_ids:
+        raise RuntimeError(f"{len(failed_ids)} 个文本块向量化失败，原向量库未改动，临时目录：{work_dir}")
+    write_store_signature(target, embedding_signature(embeddings))
+    if os.path.exists(os.path.join(persist_dir, MANIFEST_NAME)):
+        shutil.copy2(os.path.join(persist_dir, MANIFEST_NAME), os.path.join(work_dir, MANIFEST_NAME))
+    bump_store_version(work_dir)
+    del source, target
+    # chromadb 按路径缓存客户端，替换目录前先释放，之后按路径重新打开的是新向量库
+    from chromadb.api.client import SharedSystemClient
+
+    SharedSystemClient.clear_system_cache()
+
+    backup_dir = f"{persist_dir}.bak-{time.strftime('%Y%m%d%H%M%S')}"
+    os.rename(persist_dir, backup_dir)
+    os.rename(work_dir, persist_dir)
+    if not keep_backup:
+        shutil.rmtree(backup_dir, ignore_errors=True)
+    else:
+        print(f"原向量库已备份到：{backup_dir}")
+    return done
+
+
+def main(argv=None):
+    from langchain_chroma import Chroma
+
+    from vector import VECTOR_DIR
+
+    parser = argparse.ArgumentParser(description="嵌入后端信息与向量库迁移")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="查看向量库记录的嵌入模型并与当前配置比较")
+    info.add_argument("--persist-dir", default=VECTOR_DIR)
+    migrate = sub.add_parser("migrate", help="用新的嵌入模型重新向量化向量库")
+    migrate.add_argument("--persist-dir", default=VECTOR_DIR)
+    migrate.add_argument("--backend", choices=sorted(EMBEDDING_BACKENDS), default=EMBED_BACKEND)
+    migrate.add_argument("--model", help="嵌入模型名称，默认取该后端的默认模型")
+    migrate.add_argument("--batch-size", type=int)
+    migrate.add_argument("--workers", type=int)
+    migrate.add_argument("--no-backup", action="store_true", help="迁移完成后删除原向量库")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        db = Chroma(persist_directory=args.persist_dir)
+        print(f"文本块数：{db._collection.count()}")
+        print(f"入库记录：{read_store_signature(db) or '无'}（向量维度 {stored_vector_dim(db)}）")
+        embeddings = build_embeddings()
+        print(f"当前配置：{embedding_signature(embeddings)}")
+        try:
+            check_store_embeddings(db, embeddings)
+            print("一致")
+        except EmbeddingMismatchError as e:
+            print(str(e))
+        return
+
+    embeddings = build_embeddings(args.backend, args.model)
+    start = time.time()
+    done = migrate_store(args.persist_dir, embeddings, args.batch_size, args.workers, keep_backup=not args.no_backup)
+    print(f"迁移完成，重新向量化 {done} 块，耗时 {time.time()-start:.2f} 秒")
+    if (args.backend, embeddings.embed_model) != (EMBED_BACKEND, EMBED_MODEL):
+        print(f"请把 embedding_backends.py 中的 EMBED_BACKEND / EMBED_MODEL 改为 "
+              f"{args.backend} / {embeddings.embed_model}，查询端才能使用新向量库")
+
+
+if __name__ == "__main__":
+    main()
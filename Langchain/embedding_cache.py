@@ -0,0 +1,166 @@
+# embedding_cache.py
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+# 嵌入缓存文件路径，入库和问答共用
+EMBED_CACHE_PATH = "./embedding_cache.sqlite3"
+# 缓存上限（字节），超出后按最近访问时间淘汰
+EMBED_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """统一 Unicode 形式并合并连续空白，避免仅空白不同的文本块重复向量化"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    基于 SQLite 的嵌入向量缓存
+    以 (模型名, 规范化文本哈希) 为键，向量以 float32 二进制存储；
+    超出容量时按最近访问时间淘汰，并统计命中/未命中次数
+    """
+
+    def __init__(self, path=EMBED_CACHE_PATH, max_bytes=EMBED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, keys):
+        """批量查询，返回与 keys 对应的向量列表，未命中的位置为 None"""
+        found = {}
+        with self._lock:
+            # SQLite 单条语句的参数个数有限，分段查询
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                self._conn.commit()
+            hit_count = sum(1 for k in keys if k in found)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        return [list(array("f", found[k])) if k in found else None for k in keys]
+
+    def put_many(self, keys, vectors):
+        now = time.time()
+        rows = [(k, array("f", v).tobytes(), now) for k, v in zip(keys, vectors)]
+        with self._lock:
+            for key, blob, _ in rows:
+                old = self._conn.execute(
+                    "SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                self._size += len(blob) - (old[0] if old else 0)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                rows,
+            )
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """淘汰最久未访问的条目，直到占用降到上限的 90%"""
+        target = self.max_bytes * 0.9
+        while self._size > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                self._size -= size
+                if self._size <= target:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size_bytes": self._size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    为任意 LangChain 嵌入模型加一层本地缓存
+    只把未命中的文本发给底层模型，结果写回缓存
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache: EmbeddingCache = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or EmbeddingCache()
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model_name, t) for t in texts]
+        vectors = self.cache.get_many(keys)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            # 同一批内重复的文本只请求一次
+            unique = {}
+            for i in missing:
+                unique.setdefault(keys[i], texts[i])
+            new_vectors = self.embeddings.embed_documents(list(unique.values()))
+            computed = dict(zip(unique.keys(), new_vectors))
+            self.cache.put_many(list(computed.keys()), list(computed.values()))
+            for i in missing:
+                vectors[i] = computed[keys[i]]
+        return vectors
+
+    def embed_query(self, text):
+        # 部分模型对查询和文档使用不同的前缀，查询向量单独存放
+        key = cache_key(f"{self.model_name}#query", text)
+        vector = self.cache.get_many([key])[0]
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many([key], [vector])
+        return vector
@@ -0,0 +1,256 @@
+# eval_retrieval.py
+"""
+检索效果与延迟评测
+读取标注集（每行一个 JSON：{"question": "...", "sources": ["文档路径", ...]}，sources 为能回答该问题的文档），
+用 ollama_qa.build_retriever 构建与问答链相同的检索器，统计：
+    recall@k：前 k 个文本块覆盖的相关文档数 / 相关文档数
+    MRR：第一个来自相关文档的文本块名次的倒数
+    检索延迟分位数：第一轮使用空的查询向量缓存（冷启动，含查询向量化），之后的轮次查询向量命中缓存（热）
+加 --e2e 时再把每个问题送入完整问答链，对话模型换成本地替身服务（benchmarks/stub_ollama.py），
+模型耗时（prefill + 生成）与其余流水线耗时（检索、上下文组装、提示词、解析）分开统计
+结果中记录标注集哈希、向量库版本、嵌入模型签名和检索参数，--compare 与之前保存的结果对比时先检查这些是否一致
+用法（在 Langchain 目录下运行）：
+    python eval_retrieval.py golden.jsonl --output eval_baseline.json
+    python eval_retrieval.py golden.jsonl --mode dense --fetch-k 50 --compare eval_baseline.json
+    python eval_retrieval.py golden.jsonl --e2e --ttft-ms 200 --token-ms 20
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from embedding_backends import build_embeddings, embedding_signature
+from embedding_cache import EmbeddingCache
+from instrumentation import Instrumentation, percentile
+from manifest import file_sha256, read_store_version
+from ollama_qa import RETRIEVAL_MODE, SEARCH_KWARGS, USE_QUANTIZED_INDEX, VECTOR_DIR, build_qa_chain, build_retriever
+
+# 统计 recall@k 的 k 值
+EVAL_KS = (1, 3, 5)
+# 每个问题的检索轮数，第一轮为冷启动
+EVAL_REPEAT = 3
+# 与基线对比时必须一致的配置项，不一致时指标不可直接比较
+COMPARABLE_KEYS = ("golden_sha256", "store_version", "embedding", "mode", "quantized", "search_kwargs")
+
+
+def load_golden(path):
+    """读取标注集，sources 可以是单个路径或路径列表"""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            sources = item.get("sources") or item.get("source")
+            if isinstance(sources, str):
+                sources = [sources]
+            if not item.get("question") or not sources:
+                raise ValueError(f"{path} 第 {n} 行缺少 question 或 sources")
+            items.append({"question": item["question"], "sources": sources})
+    return items
+
+
+def _norm_path(path):
+    return os.path.normpath(path).replace("\\", "/")
+
+
+def source_matches(source, relevant):
+    """标注的路径可以只写文件名或相对路径，与入库时记录的 source 按路径后缀匹配"""
+    source, relevant = _norm_path(source), _norm_path(relevant)
+    return source == relevant or source.endswith("/" + relevant)
+
+
+def score_ranking(doc_sources, relevant, ks):
+    """
+    :param doc_sources: 检索结果中各文本块的 source，按名次排列
+    :param relevant: 相关文档路径列表
+    :return: ({k: recall@k}, 倒数名次)
+    """
+    matched = [next((r for r in relevant if source_matches(s, r)), None) for s in doc_sources]
+    recall = {k: len({r for r in matched[:k] if r is not None}) / len(relevant) for k in ks}
+    first = next((i for i, r in enumerate(matched) if r is not None), None)
+    return recall, (1.0 / (first + 1) if first is not None else 0.0)
+
+
+def latency_summary(seconds):
+    """毫秒分位数"""
+    if not seconds:
+        return None
+    values = sorted(v * 1000 for v in seconds)
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p90": round(percentile(values, 90), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def evaluate_retrieval(retriever, golden, ks=EVAL_KS, repeat=EVAL_REPEAT):
+    """逐题检索 repeat 轮，名次指标取第一轮的结果"""
+    metrics = Instrumentation(jsonl_path=None)
+    recalls = {k: [] for k in ks}
+    reciprocal_ranks, cold, warm, stages, details = [], [], [], {}, []
+    for item in golden:
+        for i in range(repeat):
+            with metrics.track(mode="eval") as handler:
+                start = time.perf_counter()
+                docs = retriever.invoke(item["question"], config={"callbacks": [handler]})
+                elapsed = time.perf_counter() - start
+            (warm if i else cold).append(elapsed)
+            for name in ("embed", "retrieve", "lexical", "rerank"):
+                if name in handler.record.stages:
+                    stages.setdefault(name, []).append(handler.record.stages[name])
+            if i == 0:
+                sources = [d.metadata.get("source", "") for d in docs]
+                recall, rr = score_ranking(sources, item["sources"], ks)
+                for k in ks:
+                    recalls[k].append(recall[k])
+                reciprocal_ranks.append(rr)
+                details.append({"question": item["question"], "mrr": rr,
+                                **{f"recall@{k}": recall[k] for k in ks}, "retrieved": sources})
+    n = len(golden)
+    return {
+        **{f"recall@{k}": round(sum(recalls[k]) / n, 4) for k in ks},
+        "mrr": round(sum(reciprocal_ranks) / n, 4),
+        "latency_ms": {"cold": latency_summary(cold), "warm": latency_summary(warm)},
+        "stages_ms": {name: latency_summary(values) for name, values in stages.items()},
+    }, details
+
+
+def evaluate_end_to_end(chain, golden):
+    """完整问答链的耗时拆分：模型耗时 = prefill + 生成，其余为流水线开销"""
+    metrics = Instrumentation(jsonl_path=None)
+    rows = []
+    for item in golden:
+        with metrics.track(mode="eval-e2e") as handler:
+            chain.invoke(item["question"], config={"callbacks": [handler]})
+        rows.append(handler.record.to_dict())
+    model = [r.get("prefill", 0) + r.get("generation", 0) for r in rows]
+    overhead = [r["total"] - m for r, m in zip(rows, model)]
+    return {
+        "total_ms": latency_summary([r["total"] for r in rows]),
+        "model_ms": latency_summary(model),
+        "overhead_ms": latency_summary(overhead),
+        "retrieval_ms": latency_summary([r["retrieval"] for r in rows if r.get("retrieval") is not None]),
+        "pack_ms": latency_summary([r["pack"] for r in rows if r.get("pack") is not None]),
+        "ttft_ms": latency_summary([r["ttft"] for r in rows if r.get("ttft") is not None]),
+        "errors": sum(1 for r in rows if r.get("error")),
+    }
+
+
+def compare(result, baseline):
+    """打印与基线结果的差异；配置不一致时给出提示"""
+    changed = [key for key in COMPARABLE_KEYS if result["config"].get(key) != baseline["config"].get(key)]
+    if changed:
+        print(f"注意：与基线的以下配置不同，指标差异可能来自配置变化：{', '.join(changed)}")
+    rows = [(key, (key,)) for key in result["retrieval"] if key.startswith("recall@") or key == "mrr"]
+    for phase in ("cold", "warm"):
+        for p in ("p50", "p99"):
+            rows.append((f"{phase} {p} ms", ("latency_ms", phase, p)))
+    if result.get("e2e") and baseline.get("e2e"):
+        for key in ("overhead_ms", "model_ms", "total_ms"):
+            rows.append((f"e2e {key[:-3]} p50 ms", (key, "p50")))
+
+    def lookup(section, path):
+        value = section
+        for key in path:
+            value = (value or {}).get(key)
+        return value
+
+    print(f"{'指标':<24}{'基线':>12}{'本次':>12}{'变化':>12}")
+    for label, path in rows:
+        section = "e2e" if label.startswith("e2e") else "retrieval"
+        old, new = lookup(baseline.get(section), path), lookup(result.get(section), path)
+        if old is None or new is None:
+            continue
+        print(f"{label:<24}{old:>12.4f}{new:>12.4f}{new - old:>+12.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="检索效果与延迟评测")
+    parser.add_argument("golden", help="标注集 JSONL，每行 {\"question\": ..., \"sources\": [...]}")
+    parser.add_argument("--persist-dir", default=VECTOR_DIR, help="向量数据库目录")
+    parser.add_argument("--mode", default=RETRIEVAL_MODE, choices=("dense", "hybrid", "lexical"))
+    parser.add_argument("--quantized", action="store_true", default=USE_QUANTIZED_INDEX, help="使用压缩向量索引")
+    parser.add_argument("--ks", default=",".join(map(str, EVAL_KS)), help="统计 recall@k 的 k 值，逗号分隔")
+    parser.add_argument("--fetch-k", type=int, help="覆盖 MMR 候选数")
+    parser.add_argument("--lambda-mult", type=float, help="覆盖 MMR 多样性系数")
+    parser.add_argument("--score-threshold", type=float, help="覆盖相似度阈值")
+    parser.add_argument("--repeat", type=int, default=EVAL_REPEAT, help="每个问题的检索轮数，第一轮为冷启动")
+    parser.add_argument("--e2e", action="store_true", help="用替身对话模型跑完整问答链，拆分模型耗时与流水线开销")
+    parser.add_argument("--llm-url", help="替身对话服务地址；不指定时在本进程内启动 benchmarks/stub_ollama.py")
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="进程内替身模型的首 token 延迟")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="进程内替身模型每个 token 的间隔")
+    parser.add_argument("--tokens", type=int, default=64, help="进程内替身模型每次回答的 token 数")
+    parser.add_argument("--details", action="store_true", help="结果中包含逐题的检索结果")
+    parser.add_argument("--output", help="把结果写入 JSON 文件，便于之后对比")
+    parser.add_argument("--compare", help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args(argv)
+
+    golden = load_golden(args.golden)
+    ks = sorted({int(k) for k in args.ks.split(",")})
+    # 检索的文本块数不少于最大的 k，否则 recall@k 偏低
+    search_kwargs = {"k": max(max(ks), SEARCH_KWARGS["k"])}
+    for key in ("fetch_k", "lambda_mult", "score_threshold"):
+        if getattr(args, key) is not None:
+            search_kwargs[key] = getattr(args, key)
+
+    # 查询向量缓存放在临时目录中，每次评测的第一轮都是冷启动，结果可以跨次比较
+    tmp = tempfile.mkdtemp(prefix="eval_retrieval_")
+    embeddings = build_embeddings()
+    embeddings.cache = EmbeddingCache(os.path.join(tmp, "query_cache.sqlite3"))
+    stub = None
+    try:
+        retriever = build_retriever(args.persist_dir, search_kwargs, args.mode, args.quantized, embeddings)
+        vector_store = retriever.vector_store
+        config = {
+            "golden": os.path.abspath(args.golden),
+            "golden_sha256": file_sha256(args.golden),
+            "questions": len(golden),
+            "persist_dir": os.path.abspath(args.persist_dir),
+            "store_version": read_store_version(args.persist_dir),
+            "store_chunks": vector_store._collection.count(),
+            "embedding": embedding_signature(embeddings),
+            "mode": args.mode,
+            "quantized": args.quantized,
+            "search_kwargs": {**SEARCH_KWARGS, **search_kwargs},
+            "ks": ks,
+            "repeat": args.repeat,
+        }
+        print(f"评测 {len(golden)} 个问题，检索方式 {args.mode}，参数 {config['search_kwargs']}")
+        retrieval, details = evaluate_retrieval(retriever, golden, ks, max(args.repeat, 1))
+        result = {"ts": round(time.time(), 3), "config": config, "retrieval": retrieval}
+
+        if args.e2e:
+            llm_url = args.llm_url
+            if not llm_url:
+                from benchmarks.stub_ollama import StubOllamaServer
+                stub = StubOllamaServer(ttft_ms=args.ttft_ms, token_ms=args.token_ms, tokens=args.tokens).start()
+                llm_url = stub.url
+                config["stub"] = {"ttft_ms": args.ttft_ms, "token_ms": args.token_ms, "tokens": args.tokens}
+            chain = build_qa_chain(stream_to_stdout=False, retriever=retriever, llm_base_url=llm_url)
+            result["e2e"] = evaluate_end_to_end(chain, golden)
+        if args.details:
+            result["details"] = details
+    finally:
+        if stub is not None:
+            stub.shutdown()
+        embeddings.cache.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(json.dumps({k: v for k, v in result.items() if k != "details"}, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
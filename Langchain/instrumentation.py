@@ -0,0 +1,304 @@
+# instrumentation.py
+"""
+检索链分阶段耗时与吞吐量统计
+每次请求记录：查询向量化（embed）、向量检索（retrieve）、BM25 检索（lexical）、MMR 重排（rerank）、
+上下文组装（pack）、检索总耗时、首 token 延迟（TTFT）、prefill、生成耗时与 tokens/sec，
+以及 prompt / completion token 数和检索到的文本块数
+结果逐条追加到 JSONL 文件，同时汇总为 Prometheus 文本格式（qa_server 的 /metrics）
+用法（在 Langchain 目录下运行），输出各指标的分位数：
+    python instrumentation.py summary metrics.jsonl
+"""
+import argparse
+import json
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 每次请求一行 JSON
+METRICS_LOG = "./metrics.jsonl"
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 生成速度直方图的桶上界（tokens/sec）
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 200)
+
+# 当前请求的记录；检索器在 langchain 的线程池中运行时，上下文会被复制过去
+_current = ContextVar("rag_request_metrics", default=None)
+
+
+@contextmanager
+def stage(name):
+    """统计一个阶段的耗时，不在 track() 中时不做任何记录；同名阶段多次出现时累加"""
+    record = _current.get()
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.add_stage(name, time.perf_counter() - start)
+
+
+class RequestMetrics:
+    def __init__(self, **labels):
+        self.request_id = uuid.uuid4().hex
+        self.labels = labels
+        self.ts = time.time()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.retrieve_start = None
+        self.retrieve_end = None
+        self.retrieved_chunks = None
+        self.llm_start = None
+        self.first_token = None
+        self.llm_end = None
+        self.stream_tokens = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.cached = False
+        self.error = None
+        self.end = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def to_dict(self):
+        end = self.end or time.perf_counter()
+        out = {
+            "ts": round(self.ts, 3),
+            "request_id": self.request_id,
+            **self.labels,
+            "cached": self.cached,
+            "total": end - self.start,
+        }
+        out.update(self.stages)
+        if self.retrieve_start is not None and self.retrieve_end is not None:
+            out["retrieval"] = self.retrieve_end - self.retrieve_start
+        if self.first_token is not None:
+            out["ttft"] = self.first_token - self.start
+            if self.llm_start is not None:
+                out["prefill"] = self.first_token - self.llm_start
+            if self.llm_end is not None:
+                out["generation"] = self.llm_end - self.first_token
+        completion = self.completion_tokens if self.completion_tokens is not None else self.stream_tokens or None
+        out["prompt_tokens"] = self.prompt_tokens
+        out["completion_tokens"] = completion
+        if completion and out.get("generation"):
+            # 首 token 之后的生成速度，不含 prefill
+            out["tokens_per_sec"] = max(completion - 1, 1) / out["generation"]
+        out["retrieved_chunks"] = self.retrieved_chunks
+        if self.error:
+            out["error"] = self.error
+        return {k: (round(v, 6) if isinstance(v, float) else v) for k, v in out.items()}
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """挂到链的 callbacks 上，记录检索和生成的时间点与 token 数"""
+
+    # 异步链中直接在事件循环里调用，时间点不受线程池排队影响
+    run_inline = True
+
+    def __init__(self, record):
+        self.record = record
+
+    def on_retriever_start(self, serialized, query, **kwargs):
+        # 嵌套检索器（混合检索内部的向量检索）只记录最外层的起止时间
+        if self.record.retrieve_start is None:
+            self.record.retrieve_start = time.perf_counter()
+
+    def on_retriever_end(self, documents, **kwargs):
+        self.record.retrieve_end = time.perf_counter()
+        self.record.retrieved_chunks = len(documents)
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.record.llm_start = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.record.llm_start = time.perf_counter()
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.record.first_token is None:
+            self.record.first_token = time.perf_counter()
+        self.record.stream_tokens += 1
+
+    def on_llm_end(self, response, **kwargs):
+        self.record.llm_end = time.perf_counter()
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.record.prompt_tokens = usage.get("input_tokens")
+                    self.record.completion_tokens = usage.get("output_tokens")
+        if self.record.first_token is None:
+            # 非流式调用没有逐 token 回调，以结束时间作为首 token 时间
+            self.record.first_token = self.record.llm_end
+
+    def on_chain_error(self, error, **kwargs):
+        self.record.error = repr(error)
+
+    on_llm_error = on_chain_error
+    on_retriever_error = on_chain_error
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines, cumulative = [], 0
+        for bound, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Instrumentation:
+    """
+    按请求收集指标：
+        with metrics.track(mode="console") as handler:
+            chain.invoke(query, config={"callbacks": [handler]})
+    """
+
+    TIMED = ("embed", "retrieve", "lexical", "rerank", "pack", "retrieval", "ttft", "prefill", "generation", "total")
+
+    def __init__(self, jsonl_path=METRICS_LOG):
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._rate = Histogram(RATE_BUCKETS)
+        self._counters = {"requests": 0, "errors": 0, "cache_hits": 0,
+                          "prompt_tokens": 0, "completion_tokens": 0, "retrieved_chunks": 0}
+
+    @contextmanager
+    def track(self, **labels):
+        record = RequestMetrics(**labels)
+        token = _current.set(record)
+        try:
+            yield MetricsCallbackHandler(record)
+        except BaseException as e:
+            record.error = record.error or repr(e)
+            raise
+        finally:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # 异步生成器在其他上下文中被关闭
+                pass
+            record.end = time.perf_counter()
+            self.observe(record)
+
+    def observe(self, record):
+        row = record.to_dict()
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["errors"] += bool(row.get("error"))
+            self._counters["cache_hits"] += bool(row.get("cached"))
+            for key in ("prompt_tokens", "completion_tokens", "retrieved_chunks"):
+                self._counters[key] += row.get(key) or 0
+            for key in self.TIMED:
+                if row.get(key) is not None:
+                    self._latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(row[key])
+            if row.get("tokens_per_sec"):
+                self._rate.observe(row["tokens_per_sec"])
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return row
+
+    def render_prometheus(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            lines = ["# TYPE rag_stage_seconds histogram"]
+            for key in self.TIMED:
+                if key in self._latency:
+                    lines.extend(self._latency[key].render("rag_stage_seconds", f'stage="{key}"'))
+            lines.append("# TYPE rag_generation_tokens_per_second histogram")
+            lines.extend(self._rate.render("rag_generation_tokens_per_second", 'model="default"'))
+            for key, value in self._counters.items():
+                lines.append(f"# TYPE rag_{key}_total counter")
+                lines.append(f"rag_{key}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+def percentile(sorted_values, p):
+    """线性插值分位数，输入需已排序"""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * p / 100
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def summarize(rows):
+    """统计 JSONL 记录中各数值字段的分位数"""
+    values = {}
+    for row in rows:
+        for key, value in row.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "ts":
+                values.setdefault(key, []).append(value)
+    summary = {}
+    for key, vals in values.items():
+        vals.sort()
+        summary[key] = {
+            "count": len(vals),
+            "mean": sum(vals) / len(vals),
+            "p50": percentile(vals, 50),
+            "p90": percentile(vals, 90),
+            "p99": percentile(vals, 99),
+            "max": vals[-1],
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="检索链指标统计")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("summary", help="输出 JSONL 指标文件中各字段的分位数")
+    p.add_argument("path", nargs="?", default=METRICS_LOG)
+    p.add_argument("--last", type=int, help="只统计最后 N 条记录")
+    p.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args(argv)
+
+    with open(args.path, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    if args.last:
+        rows = rows[-args.last:]
+    summary = summarize(rows)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+    errors = sum(1 for r in rows if r.get("error"))
+    cached = sum(1 for r in rows if r.get("cached"))
+    print(f"请求数 {len(rows)}，失败 {errors}，缓存命中 {cached}")
+    print(f"{'指标':<20}{'count':>8}{'mean':>12}{'p50':>12}{'p90':>12}{'p99':>12}{'max':>12}")
+    order = list(Instrumentation.TIMED) + ["tokens_per_sec", "prompt_tokens", "completion_tokens", "retrieved_chunks"]
+    for key in order + sorted(k for k in summary if k not in order):
+        if key in summary:
+            s = summary[key]
+            print(f"{key:<20}{s['count']:>8}" + "".join(f"{s[c]:>12.4f}" for c in ("mean", "p50", "p90", "p99", "max")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# lexical_index.py
+"""
+BM25 倒排索引
+入库时与 Chroma 集合同步维护（同样的文本块 id），持久化为 SQLite；
+检索时无需请求嵌入模型，对错误码、零件号、产品名等精确标识的查询效果明显好于纯向量检索
+用法（在 Langchain 目录下运行），从已有向量库重建索引：
+    python lexical_index.py --rebuild
+"""
+import argparse
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, Field
+
+from instrumentation import stage
+
+try:
+    import jieba
+
+    jieba.setLogLevel(60)
+except ImportError:  # 未安装 jieba 时中文按二元组切分
+    jieba = None
+
+# 倒排索引文件默认保存在向量库目录下
+LEXICAL_INDEX_NAME = "lexical_index.sqlite3"
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+# 查询时跳过文档频率超过该比例的词，可以避免读取超长倒排表；默认不跳过，
+# 语料中常见的错误码、零件号正是需要精确匹配的词，BM25 的 IDF 已经会降低它们的权重
+MAX_DF_RATIO = None
+# 倒数排名融合（RRF）常数
+RRF_K = 60
+
+# 标识符（含数字或连字符的字母数字串，如 E-1024、AB12-34）、西文单词/数字、连续的 CJK 字符
+_TOKEN = re.compile(
+    r"[A-Za-z0-9]+(?:[-_./][A-Za-z0-9]+)+"
+    r"|[A-Za-z0-9]+"
+    r"|[㐀-䶿一-鿿豈-﫿]+"
+)
+_CJK = re.compile(r"[㐀-䶿一-鿿豈-﫿]")
+
+
+def default_tokenizer():
+    return "jieba" if jieba is not None else "bigram"
+
+
+def tokenize(text: str, tokenizer=None):
+    """
+    中英文分词
+    - 标识符整体保留，同时拆出各段，查询 "E-1024" 和 "1024" 都能命中
+    - 西文转小写
+    - 中文 tokenizer="jieba" 时用 jieba 搜索引擎模式分词，"bigram" 时切为单字 + 相邻二元组
+    """
+    tokenizer = tokenizer or default_tokenizer()
+    tokens = []
+    for m in _TOKEN.finditer(text):
+        tok = m.group(0)
+        if _CJK.match(tok):
+            if tokenizer == "jieba":
+                tokens.extend(jieba.lcut_for_search(tok))
+            else:
+                tokens.extend(tok)
+                tokens.extend(tok[i:i + 2] for i in range(len(tok) - 1))
+            continue
+        tok = tok.lower()
+        tokens.append(tok)
+        parts = re.split(r"[-_./]", tok)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    SQLite 持久化的 BM25 倒排索引
+    建索引时使用的中文分词方式记录在 meta 表中，查询时沿用，保证两端切词一致
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 检索器可能在多个线程中同时调用（HTTP 服务），连接上的操作串行执行
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, length INTEGER NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_term ON postings (term)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'tokenizer'").fetchone()
+        self.tokenizer = row[0] if row else default_tokenizer()
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('tokenizer', ?)", (self.tokenizer,))
+        self._conn.commit()
+        self._stats = None
+
+    def _check_tokenizer(self):
+        if self.tokenizer == "jieba" and jieba is None:
+            raise RuntimeError(f"倒排索引 {self.path} 使用 jieba 分词构建，请安装 jieba 或用 --rebuild 重建")
+
+    def _collection_stats(self):
+        """文档总数和平均长度，写入后失效重算"""
+        if self._stats is None:
+            n, avgdl = self._conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+            self._stats = (n, avgdl or 0.0)
+        return self._stats
+
+    def add_many(self, ids, texts):
+        """写入一批文本块，已存在的 id 先删除再写入"""
+        self._check_tokenizer()
+        docs, postings = [], []
+        for doc_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text, self.tokenizer))
+            docs.append((doc_id, sum(counts.values())))
+            postings.extend((term, doc_id, tf) for term, tf in counts.items())
+        with self._lock:
+            self._delete(ids)
+            self._conn.executemany("INSERT INTO docs (doc_id, length) VALUES (?, ?)", docs)
+            self._conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)", postings)
+            self._conn.commit()
+            self._stats = None
+
+    def _delete(self, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            marks = ",".join("?" * len(part))
+            self._conn.execute(f"DELETE FROM postings WHERE doc_id IN ({marks})", part)
+            self._conn.execute(f"DELETE FROM docs WHERE doc_id IN ({marks})", part)
+        self._stats = None
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit()
+
+    def clear(self):
+        """清空索引，之后按当前环境的分词方式重建"""
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self.tokenizer = default_tokenizer()
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('tokenizer', ?)", (self.tokenizer,))
+            self._conn.commit()
+            self._stats = None
+
+    def count(self):
+        with self._lock:
+            return self._collection_stats()[0]
+
+    def search(self, query, k=20, max_df_ratio=MAX_DF_RATIO):
+        """
+        返回 BM25 得分最高的 [(doc_id, 得分)]
+        :param max_df_ratio: 跳过文档频率超过该比例的词（全部词都超过时不跳过），None 表示不跳过
+        """
+        self._check_tokenizer()
+        with self._lock:
+            return self._search(query, k, max_df_ratio)
+
+    def _search(self, query, k, max_df_ratio):
+        n, avgdl = self._collection_stats()
+        if n == 0:
+            return []
+        terms = []
+        for term, qtf in Counter(tokenize(query, self.tokenizer)).items():
+            df = self._conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+            if df:
+                terms.append((term, qtf, df))
+        if max_df_ratio is not None and n > 10:
+            # 全部词都超过比例时不跳过，否则查询没有任何结果
+            pruned = [t for t in terms if t[2] <= n * max_df_ratio]
+            terms = pruned or terms
+        scores = Counter()
+        for term, qtf, df in terms:
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            rows = self._conn.execute(
+                "SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON p.doc_id = d.doc_id WHERE p.term = ?",
+                (term,),
+            )
+            for doc_id, tf, length in rows:
+                norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl))
+                scores[doc_id] += qtf * idf * norm
+        return scores.most_common(k)
+
+    def close(self):
+        self._conn.close()
+
+
+def open_existing_index(path):
+    """打开已有且非空的倒排索引；文件不存在或没有文本块时返回 None，不会创建空的索引文件"""
+    if not os.path.exists(path):
+        return None
+    index = LexicalIndex(path)
+    if index.count() == 0:
+        index.close()
+        return None
+    return index
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """倒数排名融合：每个排序列表中第 r 名贡献 1/(k + r)，返回按融合得分降序的 id 列表"""
+    fused = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return [doc_id for doc_id, _ in fused.most_common()]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    BM25 + 向量检索融合
+    - mode="hybrid"：两路结果用 RRF 融合
+    - mode="lexical"：只走倒排索引，不请求嵌入模型，嵌入服务繁忙时使用
+    search_kwargs 中 k 为返回条数，lexical_k 为倒排索引的候选数
+    """
+
+    lexical_index: LexicalIndex
+    vector_store: object
+    dense_retriever: object = None
+    mode: str = "hybrid"
+    search_kwargs: dict = Field(default_factory=dict)
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        k = self.search_kwargs.get("k", 4)
+        lexical_k = self.search_kwargs.get("lexical_k", max(k * 4, 20))
+        with stage("lexical"):
+            lexical_ids = [doc_id for doc_id, _ in self.lexical_index.search(query, lexical_k)]
+
+        docs_by_id = {}
+        rankings = [lexical_ids]
+        if self.mode == "hybrid" and self.dense_retriever is not None:
+            dense_docs = self.dense_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+            dense_ids = []
+            for doc in dense_docs:
+                if doc.id:
+                    docs_by_id[doc.id] = doc
+                    dense_ids.append(doc.id)
+            rankings.append(dense_ids)
+
+        ids = reciprocal_rank_fusion(rankings)[:k]
+        missing = [i for i in ids if i not in docs_by_id]
+        if missing:
+            with stage("retrieve"):
+                got = self.vector_store.get(ids=missing, include=["documents", "metadatas"])
+            for doc_id, text, meta in zip(got["ids"], got["documents"], got["metadatas"]):
+                docs_by_id[doc_id] = Document(page_content=text, metadata=meta or {}, id=doc_id)
+        return [docs_by_id[i] for i in ids if i in docs_by_id]
+
+
+def rebuild_from_store(db, index, batch_size=1000):
+    """从 Chroma 集合中的全部文本块重建倒排索引"""
+    index.clear()
+    total = db._collection.count()
+    for offset in range(0, total, batch_size):
+        got = db._collection.get(include=["documents"], limit=batch_size, offset=offset)
+        index.add_many(got["ids"], got["documents"])
+    return index.count()
+
+
+def main(argv=None):
+    from langchain_chroma import Chroma
+    from vector import VECTOR_DIR, build_embeddings
+
+    parser = argparse.ArgumentParser(description="BM25 倒排索引维护与查询")
+    parser.add_argument("--persist-dir", default=VECTOR_DIR, help="向量数据库目录")
+    parser.add_argument("--rebuild", action="store_true", help="从向量库重建倒排索引")
+    parser.add_argument("--query", help="用倒排索引查询并打印结果")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    index = LexicalIndex(os.path.join(args.persist_dir, LEXICAL_INDEX_NAME))
+    if args.rebuild:
+        db = Chroma(persist_directory=args.persist_dir, embedding_function=build_embeddings())
+        start = time.time()
+        n = rebuild_from_store(db, index)
+        print(f"倒排索引重建完成，文本块数：{n}，耗时 {time.time()-start:.2f} 秒")
+    if args.query:
+        start = time.perf_counter()
+        hits = index.search(args.query, args.k)
+        print(f"查询耗时 {(time.perf_counter()-start)*1000:.1f} ms")
+        for doc_id, score in hits:
+            print(f"{score:8.3f}  {doc_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# loaders.py
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from langchain_community.document_loaders import (
+    TextLoader,
+    PyPDFLoader,
+    Docx2txtLoader,
+    UnstructuredExcelLoader,
+)
+
+# 按扩展名选择单文件加载器
+LOADER_MAPPING = {
+    ".txt": (TextLoader, {"autodetect_encoding": True}),
+    ".md": (TextLoader, {"autodetect_encoding": True}),
+    ".py": (TextLoader, {"autodetect_encoding": True}),
+    ".pdf": (PyPDFLoader, {}),
+    ".docx": (Docx2txtLoader, {}),
+    ".xlsx": (UnstructuredExcelLoader, {}),
+    ".xls": (UnstructuredExcelLoader, {}),
+}
+
+# 解析时 CPU 占用高的格式放进进程池，纯文本在主进程直接读取即可
+CPU_BOUND_EXTS = {".pdf", ".docx", ".xlsx", ".xls"}
+
+# 解析进程数，默认等于 CPU 核数
+PARSE_WORKERS = os.cpu_count() or 1
+
+
+def file_ext(path: str) -> str:
+    return os.path.splitext(path)[1].lower()
+
+
+def iter_source_files(source_dir: str, exclude_dirs=()):
+    """一次遍历目录，按扩展名返回所有支持格式的文件路径（跳过向量库等目录）"""
+    exclude = {os.path.abspath(d) for d in exclude_dirs}
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) not in exclude]
+        for name in sorted(files):
+            if file_ext(name) in LOADER_MAPPING:
+                yield os.path.join(root, name)
+
+
+def load_file(path: str):
+    """按扩展名加载单个文件"""
+    loader_cls, loader_kwargs = LOADER_MAPPING[file_ext(path)]
+    return loader_cls(path, **loader_kwargs).load()
+
+
+def parse_file(path: str):
+    """
+    进程池中执行的解析函数
+    异常不向外抛出，而是连同耗时一起返回，由主进程统一统计
+    :return: (文档列表, 耗时秒数, 错误信息)
+    """
+    start = time.perf_counter()
+    try:
+        docs = load_file(path)
+        return docs, time.perf_counter() - start, None
+    except Exception as e:
+        return [], time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+class LoadStats:
+    """按格式统计文件数、文档数、解析耗时和失败文件"""
+
+    def __init__(self):
+        self.files = defaultdict(int)
+        self.docs = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.failures = []
+        self.start = time.time()
+
+    def record(self, path, docs, elapsed, error):
+        ext = file_ext(path)
+        self.files[ext] += 1
+        self.seconds[ext] += elapsed
+        if error:
+            self.failures.append((path, error))
+        else:
+            self.docs[ext] += len(docs)
+
+    def report(self):
+        print(f"\n文档解析统计（总耗时 {time.time()-self.start:.2f} 秒）：")
+        for ext in sorted(self.files):
+            print(f"  {ext:6s} 文件 {self.files[ext]:6d}，文档 {self.docs[ext]:7d}，"
+                  f"解析耗时合计 {self.seconds[ext]:.2f} 秒")
+        if self.failures:
+            print(f"解析失败 {len(self.failures)} 个文件：")
+            for path, error in self.failures:
+                print(f"  {path}：{error}")
+
+
+def iter_loaded(items, key=lambda item: item, max_workers=PARSE_WORKERS, stats=None):
+    """
+    解析文件并按完成顺序产出 (item, 文档列表, 错误信息)
+    items 中的元素通过 key 取得文件路径，附带的其他信息原样返回；
+    PDF/DOCX/Excel 交给大小为 max_workers 的进程池解析，在途任务数有上限，内存占用不会随文件数增长
+    """
+    stats = stats if stats is not None else LoadStats()
+    max_in_flight = max_workers * 2
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+
+        def drain(return_when):
+            finished, _ = wait(in_flight, return_when=return_when)
+            for future in finished:
+                item = in_flight.pop(future)
+                docs, elapsed, error = future.result()
+                stats.record(key(item), docs, elapsed, error)
+                yield item, docs, error
+
+        for item in items:
+            path = key(item)
+            if file_ext(path) in CPU_BOUND_EXTS:
+                in_flight[executor.submit(parse_file, path)] = item
+                if len(in_flight) >= max_in_flight:
+                    yield from drain(FIRST_COMPLETED)
+            else:
+                docs, elapsed, error = parse_file(path)
+                stats.record(path, docs, elapsed, error)
+                yield item, docs, error
+        while in_flight:
+            yield from drain(FIRST_COMPLETED)
@@ -0,0 +1,129 @@
+# manifest.py
+import hashlib
+import json
+import os
+import time
+
+# 清单文件默认保存在向量库目录下
+MANIFEST_NAME = "ingest_manifest.json"
+# 向量库版本文件，内容发生变化的入库完成后更新，供压缩索引和答案缓存判断是否失效
+STORE_VERSION_NAME = "store_version"
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """分块计算文件内容的 sha256，避免大文件一次性读入内存"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_store_version(persist_dir: str):
+    """读取向量库版本号，不存在时返回 None"""
+    try:
+        with open(os.path.join(persist_dir, STORE_VERSION_NAME), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def bump_store_version(persist_dir: str):
+    """向量库内容变化后写入新的版本号"""
+    os.makedirs(persist_dir, exist_ok=True)
+    version = f"{time.time():.6f}"
+    with open(os.path.join(persist_dir, STORE_VERSION_NAME), "w", encoding="utf-8") as f:
+        f.write(version)
+    return version
+
+
+def chunk_id(source: str, content_hash: str, index: int) -> str:
+    """
+    为文本块生成稳定的 id
+    同一文件、同一内容、同一位置的文本块每次运行得到相同 id，便于增量删除
+    """
+    raw = f"{source}:{content_hash}:{index}".encode("utf-8")
+    return hashlib.md5(raw).hexdigest()
+
+
+class IngestManifest:
+    """
+    增量入库清单
+    记录每个源文件的 mtime、size、内容哈希以及该文件产生的文本块 id：
+    {
+      "path": {"mtime": 0.0, "size": 0, "sha256": "...", "chunk_ids": ["..."], "dup_of": ["..."]}
+    }
+    dup_of 记录该文件中被近似去重、由其他文件的文本块代表的那些代表块 id
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def __len__(self):
+        return len(self.files)
+
+    def diff(self, paths):
+        """
+        对比当前磁盘文件与清单，返回 (新增, 变更, 删除) 三个列表
+        mtime 和 size 都没变的文件直接跳过，不重新计算哈希
+        变更文件返回 (path, stat, sha256)，新增文件返回 (path, stat, None)
+        """
+        added, changed = [], []
+        seen = set()
+        for path in paths:
+            seen.add(path)
+            st = os.stat(path)
+            entry = self.files.get(path)
+            if entry is None:
+                added.append((path, st, None))
+                continue
+            if entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+                continue
+            # mtime/size 变了但内容可能没变（例如 touch、重新拷贝），再比对哈希
+            sha = file_sha256(path)
+            if sha == entry["sha256"]:
+                entry["mtime"], entry["size"] = st.st_mtime, st.st_size
+                continue
+            changed.append((path, st, sha))
+        removed = [p for p in self.files if p not in seen]
+        return added, changed, removed
+
+    def chunk_ids_of(self, path: str):
+        entry = self.files.get(path)
+        return list(entry["chunk_ids"]) if entry else []
+
+    def update(self, path: str, st, sha: str, chunk_ids, dup_of=()):
+        self.files[path] = {
+            "mtime": st.st_mtime,
+            "size": st.st_size,
+            "sha256": sha,
+            "chunk_ids": list(chunk_ids),
+            "dup_of": sorted(set(dup_of)),
+        }
+
+    def dependents_of(self, stale_ids, exclude=()):
+        """
+        返回依赖于 stale_ids 中代表块的文件
+        这些文件的部分内容只以代表块的形式存在于向量库中，代表块被删除后需要重新入库
+        """
+        stale_ids = set(stale_ids)
+        exclude = set(exclude)
+        return [
+            path for path, entry in self.files.items()
+            if path not in exclude and stale_ids.intersection(entry.get("dup_of", ()))
+        ]
+
+    def remove(self, path: str):
+        self.files.pop(path, None)
+
+    def save(self):
+        """先写临时文件再替换，防止中途中断把清单写坏"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
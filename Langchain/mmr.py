@@ -0,0 +1,99 @@
+# mmr.py
+"""
+向量化的最大边际相关性（MMR）重排
+Chroma 自带的 mmr 检索不支持 score_threshold，而且每选一个结果都要对全部候选做一次 Python 循环；
+这里一次取回候选向量，先按相似度阈值过滤，再用 NumPy 矩阵运算完成多样化选择，
+fetch_k 增大到几百时重排耗时仍在毫秒级
+"""
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, Field
+
+from instrumentation import stage
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def mmr_select(query_vector, candidates, k=4, lambda_mult=0.5):
+    """
+    MMR 选择，结果与 langchain 的 maximal_marginal_relevance 一致
+    每一步只用新选中的向量与全部候选做一次矩阵-向量乘法，更新"与已选结果的最大相似度"，
+    总计算量为 k 次 (fetch_k x dim) 乘法，没有逐候选的 Python 循环
+    :param query_vector: 查询向量
+    :param candidates: (n, dim) 候选向量
+    :return: 选中候选的下标列表
+    """
+    candidates = _normalize(candidates)
+    n = len(candidates)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    relevance = candidates @ _normalize(query_vector)
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < k:
+        last = selected[-1]
+        available[last] = False
+        np.maximum(redundancy, candidates @ candidates[last], out=redundancy)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+def threshold_mmr(query_vector, candidates, k=4, lambda_mult=0.5, score_threshold=None):
+    """
+    先去掉与查询余弦相似度低于 score_threshold 的候选，再做 MMR
+    :return: [(候选下标, 与查询的相似度)]
+    """
+    candidates = _normalize(candidates)
+    if len(candidates) == 0:
+        return []
+    relevance = candidates @ _normalize(query_vector)
+    keep = np.arange(len(candidates))
+    if score_threshold is not None:
+        keep = keep[relevance >= score_threshold]
+    picked = mmr_select(query_vector, candidates[keep], k, lambda_mult)
+    return [(int(keep[i]), float(relevance[keep[i]])) for i in picked]
+
+
+class MMRRetriever(BaseRetriever):
+    """
+    Chroma 向量库上的 MMR 检索器，参数与 as_retriever(search_type="mmr") 相同：
+    k、fetch_k、lambda_mult、score_threshold；score_threshold 为与查询的余弦相似度，在多样化之前生效
+    """
+
+    vector_store: object
+    search_kwargs: dict = Field(default_factory=dict)
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        k = self.search_kwargs.get("k", 4)
+        fetch_k = self.search_kwargs.get("fetch_k", 20)
+        lambda_mult = self.search_kwargs.get("lambda_mult", 0.5)
+        threshold = self.search_kwargs.get("score_threshold")
+
+        with stage("embed"):
+            query_vector = self.vector_store.embeddings.embed_query(query)
+        # 一次取回候选的向量、文本和元数据，不再按 id 二次读取
+        with stage("retrieve"):
+            got = self.vector_store._collection.query(
+                query_embeddings=[query_vector],
+                n_results=fetch_k,
+                include=["embeddings", "documents", "metadatas"],
+            )
+        ids = got["ids"][0]
+        if not ids:
+            return []
+        with stage("rerank"):
+            hits = threshold_mmr(query_vector, got["embeddings"][0], k, lambda_mult, threshold)
+        return [
+            Document(page_content=got["documents"][0][i], metadata=got["metadatas"][0][i] or {}, id=ids[i])
+            for i, _ in hits
+        ]
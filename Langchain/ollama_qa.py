@@ -1,24 +1,111 @@
 # ollama_qa.py
 from langchain_chroma import Chroma
-from langchain_ollama import ChatOllama, OllamaEmbeddings
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_ollama import ChatOllama
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+from langchain_core.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+from embedding_backends import build_embeddings, check_store_embeddings
+from quantized_store import QUANTIZED_DIR_NAME, QuantizedIndex, QuantizedRetriever
+from answer_cache import AnswerCache
+from mmr import MMRRetriever
+from context_packing import ContextPacker
+from conversation_memory import SessionStore, build_summarizer
+from instrumentation import METRICS_LOG, Instrumentation
+from lexical_index import LEXICAL_INDEX_NAME, HybridRetriever, open_existing_index
+from operator import itemgetter
+import os
 import readline
 
 # 向量数据库目录
 VECTOR_DIR = "./vector_store"
-# 模型名称
+# 对话模型名称；嵌入模型在 embedding_backends.py 中配置，与 vector.py 共用
 MODEL_NAME = "deepseek-r1:7b"
+# 是否使用压缩向量索引检索（需先运行 vector.py --quantize 或 quantized_store.py 构建）
+USE_QUANTIZED_INDEX = False
+# 检索方式：dense 仅向量检索；hybrid 为 BM25 与向量检索 RRF 融合；
+# lexical 仅用 BM25 倒排索引，不请求嵌入模型，嵌入服务繁忙时使用
+RETRIEVAL_MODE = "hybrid"
+# 是否启用答案缓存，相同或相近的问题直接返回之前的回答
+USE_ANSWER_CACHE = True
+# 多轮对话：保留最近几轮原文，更早的轮次在后台压缩为摘要
+MULTI_TURN = False
+
+# 检索参数：返回 k 个文本块，从 fetch_k 个候选中按相似度阈值过滤后做 MMR 多样化
+SEARCH_KWARGS = {
+    "k": 5,
+    "fetch_k": 20,
+    "lambda_mult": 0.5,
+    "score_threshold": 0.4,
+}
+
+# 构建检索器，问答链和 eval_retrieval.py 共用
+def build_retriever(vector_dir=VECTOR_DIR, search_kwargs=None, mode=None, quantized=None, embeddings=None):
+    """
+    :param vector_dir: 向量库目录，倒排索引和压缩索引也在该目录下
+    :param search_kwargs: 覆盖 SEARCH_KWARGS 中的部分参数
+    :param mode: 检索方式 dense / hybrid / lexical，None 时使用 RETRIEVAL_MODE
+    :param quantized: 是否使用压缩索引，None 时使用 USE_QUANTIZED_INDEX
+    :param embeddings: 查询端嵌入模型，None 时按 embedding_backends.py 的配置创建
+    """
+    mode = mode or RETRIEVAL_MODE
+    quantized = USE_QUANTIZED_INDEX if quantized is None else quantized
+    search_kwargs = {**SEARCH_KWARGS, **(search_kwargs or {})}
 
-# 构建检索链流程
-def build_qa_chain():
     # 1. 初始化向量数据库
     vector_store = Chroma(
-        persist_directory=VECTOR_DIR,
-        embedding_function=OllamaEmbeddings(model=MODEL_NAME),
+        persist_directory=vector_dir,
+        embedding_function=embeddings or build_embeddings(),
     )
+    # 查询端的嵌入模型必须与入库时一致，否则检索结果没有意义
+    check_store_embeddings(vector_store, vector_store.embeddings)
+
+    # 2. 初始化检索器，并设置检索参数
+    index = QuantizedIndex.load(os.path.join(vector_dir, QUANTIZED_DIR_NAME)) if quantized else None
+    if index is not None and index.is_stale(vector_dir):
+        # 压缩索引构建后向量库又有更新，继续使用会漏掉新内容、返回已删除的文本块
+        print("压缩索引已过期，本次改用 Chroma 检索；运行 vector.py 或 quantized_store.py 重建")
+        index = None
+    if index is not None:
+        # 压缩索引检索，候选按 id 从 Chroma 取全精度向量重排后再做 MMR
+        retriever = QuantizedRetriever(
+            index=index,
+            vector_store=vector_store,
+            search_kwargs=search_kwargs,
+        )
+    else:
+        # 候选向量一次取回，先按 score_threshold 过滤再用 NumPy 做 MMR 多样化
+        retriever = MMRRetriever(vector_store=vector_store, search_kwargs=search_kwargs)
+    lexical_index = None
+    if mode in ("hybrid", "lexical"):
+        lexical_index = open_existing_index(os.path.join(vector_dir, LEXICAL_INDEX_NAME))
+        if lexical_index is None:
+            # 早于倒排索引入库的向量库没有 BM25 索引，混合检索会悄悄退化为纯向量检索
+            print("倒排索引不存在或为空，本次只用向量检索；运行 python lexical_index.py --rebuild 从向量库重建")
+    if lexical_index is not None:
+        # 倒排索引在 vector.py 入库时同步构建，对错误码、零件号等精确标识召回更好
+        retriever = HybridRetriever(
+            lexical_index=lexical_index,
+            vector_store=vector_store,
+            dense_retriever=retriever,
+            mode=mode,
+            search_kwargs=search_kwargs,
+        )
+    return retriever
+
+# 构建检索链流程
+def build_qa_chain(stream_to_stdout=True, client_kwargs=None, context_packer=None, multi_turn=False,
+                   retriever=None, llm_base_url=None):
+    """
+    :param stream_to_stdout: 控制台模式下把流式 token 直接打印到标准输出；HTTP 服务中关闭
+    :param client_kwargs: 传给 Ollama httpx 客户端的参数，例如连接池上限
+    :param context_packer: 检索结果的上下文组装器，None 时使用默认 token 预算新建一个
+    :param multi_turn: 为 True 时链的输入为 {"question": 问题, "chat_history": 历史消息列表}，否则为问题字符串
+    :param retriever: 已构建的检索器，None 时用 build_retriever() 的默认配置
+    :param llm_base_url: 对话模型的服务地址，None 时使用 OLLAMA_HOST；评测时可指向替身服务
+    """
+    # 1. 初始化向量数据库和检索器
+    retriever = retriever or build_retriever()
 
     # 2. 初始化 Ollama 对话模型
     llm = ChatOllama(
@@ -27,22 +114,12 @@ def build_qa_chain():
         # 开启流式响应输出，与下面的回调搭配使用
         streaming=True,
         # 流式响应回调
-        callbacks=[StreamingStdOutCallbackHandler()],
-        
+        callbacks=[StreamingStdOutCallbackHandler()] if stream_to_stdout else None,
+        client_kwargs=client_kwargs or {},
+        base_url=llm_base_url,
     )
 
-    # 3. 初始化检索器，并设置检索参数
-    retriever = vector_store.as_retriever(
-        search_type="mmr",
-        search_kwargs={
-            "k": 5,
-            "fetch_k": 20,
-            "lambda_mult": 0.5,
-            "score_threshold": 0.4,
-        },
-    )
-
-    # 4. 设置提示词模板
+    # 3. 设置提示词模板
     system_template = """
         您是一名文章阅读助手，是一个设计用于査询文档来回答问题的代理。
         您可以使用文档检索工具，并基于检索内容来回答问题。
@@ -51,29 +128,49 @@ def build_qa_chain():
         如果有人提问等关于您的名字的问题，您就回答：“我是超级牛逼哄哄的小天才助手”作为答案。
         上下文：{context}
         """
-    prompt = ChatPromptTemplate(
-        [
-            ("system", system_template),
-            ("human", "{question}"),
-        ]
-    )
+    messages = [("system", system_template)]
+    if multi_turn:
+        # 将历史对话（摘要 + 最近几轮）插入到模板中
+        messages.append(MessagesPlaceholder("chat_history"))
+    messages.append(("human", "{question}"))
+    prompt = ChatPromptTemplate(messages)
+    # 合并同一文档中相邻/重叠的文本块并截断到 token 预算，缩短 prefill 时间
+    context_packer = context_packer or ContextPacker()
+    context = retriever | RunnableLambda(context_packer.pack)
+
     # 构建 LangChain 检索链
-    return (
-        {
-            "context": retriever,
+    if multi_turn:
+        inputs = {
+            "context": itemgetter("question") | context,
+            "question": itemgetter("question"),
+            "chat_history": itemgetter("chat_history"),
+        }
+    else:
+        inputs = {
+            "context": context,
             "question": RunnablePassthrough(),
         }
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
+    return inputs | prompt | llm | StrOutputParser()
+
+def build_session_store(client_kwargs=None):
+    """多轮对话的会话记忆，摘要用不带流式回调的同一模型生成"""
+    summarizer = ChatOllama(model=MODEL_NAME, temperature=0, client_kwargs=client_kwargs or {})
+    return SessionStore(build_summarizer(summarizer))
 
 # 控制台聊天对话
 def console_qa():
     print("初始化知识库系统...")
 
     # 初始化检索链
-    chain = build_qa_chain()
+    context_packer = ContextPacker(verbose=True)
+    chain = build_qa_chain(context_packer=context_packer, multi_turn=MULTI_TURN)
+    sessions = build_session_store() if MULTI_TURN else None
+    # 答案缓存，向量库重新入库后自动失效
+    # lexical 模式本来就是为了不请求嵌入模型，答案缓存只做精确匹配
+    answer_cache = (AnswerCache(build_embeddings(), VECTOR_DIR, semantic=RETRIEVAL_MODE != "lexical")
+                    if USE_ANSWER_CACHE else None)
+    # 每次问答的分阶段耗时写入 METRICS_LOG，可用 python instrumentation.py summary 查看分位数
+    metrics = Instrumentation(METRICS_LOG)
     # 交互界面
     print("系统就绪，输入问题开始对话（输入 'exit' 退出）")
     while True:
@@ -83,11 +180,32 @@ def console_qa():
                 break
 
             print("回答：", end="", flush=True)
-            response = ""
 
-            # 回答采用流式输出，invoke 将问题传入到 Runnables 管道中
-            for chunk in chain.invoke(query):
-                response += chunk
+            with metrics.track(mode="console") as handler:
+                # 有历史时问题可能依赖上下文（"它的原因是什么"），不走答案缓存
+                use_cache = answer_cache and (sessions is None or sessions.get("console").is_empty())
+                cached = answer_cache.lookup(query) if use_cache else None
+                if cached is not None:
+                    print(cached, end="", flush=True)
+                    response = cached
+                    handler.record.cached = True
+                else:
+                    response = ""
+
+                    # 回答采用流式输出，invoke 将问题传入到 Runnables 管道中
+                    if sessions is not None:
+                        inputs = {"question": query, "chat_history": sessions.history("console")}
+                    else:
+                        inputs = query
+                    for chunk in chain.invoke(inputs, config={"callbacks": [handler]}):
+                        response += chunk
+
+                    if use_cache:
+                        answer_cache.store(query, response)
+
+            if sessions is not None:
+                # 保存本轮对话（去掉 <think> 部分），旧轮次在后台压缩为摘要
+                sessions.record("console", query, response)
 
             print("\n\n")
             print("==== 请继续对话（输入 'exit' 退出）====")
@@ -97,6 +215,12 @@ def console_qa():
         except Exception as e:
             print(f"出错：{str(e)}")
 
+    if answer_cache:
+        answer_cache.report()
+    context_packer.report()
+    if sessions is not None:
+        sessions.close()
+
 if __name__ == "__main__":
     console_qa()
     print("对话结束")
@@ -109,7 +233,7 @@ if __name__ == "__main__":
 
 
 
-exit()
+# 以下为早期版本的多轮对话与 FastAPI 示例，仅作参考；HTTP 服务见 qa_server.py
 #多轮对话
 # from langchain_chroma import Chroma
 # from langchain_ollama import ChatOllama, OllamaEmbeddings
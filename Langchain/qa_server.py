@@ -0,0 +1,229 @@
+# qa_server.py
+"""
+知识库问答 HTTP 服务
+每个进程只构建一次检索链和向量库；回答通过 SSE（server-sent events）逐 token 推送
+请求中带 session_id 时为多轮对话，各会话的历史相互隔离，旧轮次在回答结束后于后台压缩为摘要
+Ollama 前面有并发上限和有界等待队列：同时生成的请求数不超过 MAX_CONCURRENCY，
+排队的请求超过 MAX_QUEUE 或等待超过 QUEUE_TIMEOUT 秒时直接返回 503，不会把 Ollama 压垮
+用法（在 Langchain 目录下运行）：
+    python qa_server.py --port 8000
+    curl -N -X POST localhost:8000/ask/stream -H 'Content-Type: application/json' -d '{"question": "..."}'
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from context_packing import ContextPacker
+from instrumentation import METRICS_LOG, Instrumentation
+from ollama_qa import build_qa_chain, build_session_store
+
+# 同时在 Ollama 上生成的请求数，与 OLLAMA_NUM_PARALLEL 保持一致
+MAX_CONCURRENCY = 4
+# 等待生成槽位的最大请求数
+MAX_QUEUE = 32
+# 排队等待的最长时间（秒）
+QUEUE_TIMEOUT = 30.0
+
+
+class QueueFull(Exception):
+    pass
+
+
+class AdmissionGate:
+    """并发上限 + 有界等待队列，在事件循环内使用"""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE, timeout=QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.active = 0
+        self.served = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull("等待队列已满")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise QueueFull("排队超时")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.served += 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "served": self.served,
+            "rejected": self.rejected,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+
+class GatedStreamingResponse(StreamingResponse):
+    """
+    发送结束后释放准入名额；释放放在 __call__ 的 finally 中，
+    客户端在生成器开始执行前断开、或回复根本没有发送时也不会占住名额
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+class Question(BaseModel):
+    question: str
+    session_id: Optional[str] = None
+
+
+def sse_event(data, event=None):
+    """编码一条 SSE 消息，data 按 JSON 序列化，避免换行破坏消息边界"""
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def create_app(max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT,
+               metrics_log=METRICS_LOG):
+    state = {}
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # 检索链只构建一次；到 Ollama 的连接由 httpx 连接池复用，上限与并发数一致
+        limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        state["packer"] = ContextPacker()
+        state["chain"] = build_qa_chain(stream_to_stdout=False, client_kwargs={"limits": limits},
+                                        context_packer=state["packer"], multi_turn=True)
+        state["sessions"] = build_session_store(client_kwargs={"limits": limits})
+        state["gate"] = AdmissionGate(max_concurrency, max_queue, queue_timeout)
+        state["metrics"] = Instrumentation(metrics_log)
+        yield
+        state["sessions"].close()
+        state.clear()
+
+    app = FastAPI(title="知识库问答服务", lifespan=lifespan)
+
+    def chain_inputs(question):
+        history = state["sessions"].history(question.session_id) if question.session_id else []
+        return {"question": question.question, "chat_history": history}
+
+    def remember(question, answer):
+        if question.session_id and answer:
+            state["sessions"].record(question.session_id, question.question, answer)
+
+    async def admit():
+        try:
+            await state["gate"].acquire()
+        except QueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    @app.post("/ask/stream")
+    async def ask_stream(question: Question):
+        await admit()
+        gate, chain = state["gate"], state["chain"]
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                gate.release()
+
+        async def events():
+            start = time.perf_counter()
+            first_token = None
+            answer = []
+            try:
+                with state["metrics"].track(mode="stream") as handler:
+                    async for chunk in chain.astream(chain_inputs(question), config={"callbacks": [handler]}):
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        answer.append(chunk)
+                        yield sse_event({"token": chunk})
+                remember(question, "".join(answer))
+                yield sse_event({"ttft": first_token, "elapsed": time.perf_counter() - start}, event="done")
+            except Exception as e:
+                yield sse_event({"error": str(e)}, event="error")
+            finally:
+                # 生成结束就归还名额，不必等连接关闭
+                release()
+
+        try:
+            return GatedStreamingResponse(
+                events(),
+                release,
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+        except BaseException:
+            release()
+            raise
+
+    @app.post("/ask")
+    async def ask(question: Question):
+        await admit()
+        try:
+            with state["metrics"].track(mode="invoke") as handler:
+                answer = await state["chain"].ainvoke(chain_inputs(question), config={"callbacks": [handler]})
+        finally:
+            state["gate"].release()
+        remember(question, answer)
+        return {"answer": answer}
+
+    @app.get("/health")
+    async def health():
+        return {**state["gate"].stats(), "context": state["packer"].stats(), "sessions": len(state["sessions"])}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        return state["metrics"].render_prometheus()
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="知识库问答 HTTP 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY, help="同时在 Ollama 上生成的请求数")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE, help="等待生成槽位的最大请求数")
+    parser.add_argument("--queue-timeout", type=float, default=QUEUE_TIMEOUT, help="排队等待的最长秒数")
+    parser.add_argument("--metrics-log", default=METRICS_LOG, help="逐请求指标的 JSONL 文件")
+    args = parser.parse_args(argv)
+
+    # 输出每次查询的上下文组装日志
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    # 单进程单事件循环，检索链和连接池在进程内共享
+    app = create_app(args.max_concurrency, args.max_queue, args.queue_timeout, args.metrics_log)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
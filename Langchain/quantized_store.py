@@ -0,0 +1,335 @@
+# quantized_store.py
+"""
+压缩向量检索索引
+deepseek-r1:7b 的向量维度很高，逐条计算相似度的开销随文本块数线性增长
+这里从 Chroma 集合中导出向量，按 float16 / int8 标量量化 / 乘积量化（PQ）压缩后常驻内存检索，
+对前若干候选按 id 从 Chroma 读取原始向量做全精度重排，文本和元数据同样从 Chroma 按 id 读取
+这是放在 Chroma 旁边的附加索引，不是替代 Chroma 的存储格式：Chroma 仍然保存全部 float32 向量和 HNSW 索引，
+向量库目录的磁盘占用会增加压缩索引的大小，打开 Chroma 集合后的常驻内存也不会因此减少；
+各模式的 recall、查询延迟、磁盘占用和进程内存与纯 Chroma 的对比用 benchmarks/bench_quantization.py 测量
+压缩索引是向量库的快照，记录构建时的向量库版本号，向量库更新后（bump_store_version）需要重建，
+vector.py 入库后会自动重建已有的压缩索引
+用法（在 Langchain 目录下运行）：
+    python quantized_store.py --mode int8
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, Field
+
+from instrumentation import stage
+from manifest import read_store_version
+from mmr import mmr_select
+
+# 压缩索引默认保存在向量库目录下
+QUANTIZED_DIR_NAME = "quantized"
+QUANTIZE_MODES = ("float16", "int8", "pq")
+# PQ 每个子空间的维度，越小精度越高、压缩率越低
+PQ_SUB_DIM = 8
+# PQ 每个子空间的聚类中心数（uint8 编码）
+PQ_CENTROIDS = 256
+# 检索时按块计算相似度，限制临时内存
+SEARCH_BLOCK = 8192
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(data, k, iterations=10, seed=0):
+    """简单的 Lloyd k-means，用于训练 PQ 码本"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        # ||x - c||^2 = ||x||^2 - 2 x·c + ||c||^2，省略与 c 无关的项
+        dist = (centroids ** 2).sum(axis=1)[None, :] - 2 * data @ centroids.T
+        assign = dist.argmin(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return centroids
+
+
+def top_n(scores, n):
+    n = min(n, len(scores))
+    idx = np.argpartition(-scores, n - 1)[:n]
+    return idx[np.argsort(-scores[idx])]
+
+
+class QuantizedIndex:
+    """
+    余弦相似度检索的压缩向量索引
+    - float16：直接存半精度向量，大小为 float32 的 1/2
+    - int8：按维度对称缩放到 [-127, 127]，大小为 1/4
+    - pq：每 PQ_SUB_DIM 维一个子空间，用 256 个中心的码本编码为 1 字节，大小约为 1/(4*PQ_SUB_DIM)
+    """
+
+    def __init__(self, mode, ids, codes, dim, scale=None, centroids=None, model=None, store_version=None):
+        if mode not in QUANTIZE_MODES:
+            raise ValueError(f"不支持的量化模式：{mode}")
+        self.mode = mode
+        self.ids = list(ids)
+        self.codes = codes
+        self.dim = dim
+        self.scale = scale
+        self.centroids = centroids
+        self.model = model
+        self.store_version = store_version
+
+    @classmethod
+    def build(cls, mode, ids, vectors, model=None, sub_dim=PQ_SUB_DIM, store_version=None):
+        vectors = normalize(vectors)
+        n, dim = vectors.shape
+        if mode == "float16":
+            return cls(mode, ids, vectors.astype(np.float16), dim, model=model, store_version=store_version)
+        if mode == "int8":
+            scale = np.maximum(np.abs(vectors).max(axis=0), 1e-12) / 127.0
+            codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+            return cls(mode, ids, codes, dim, scale=scale.astype(np.float32), model=model,
+                       store_version=store_version)
+        # pq：维度补零到 sub_dim 的整数倍后按子空间训练码本
+        m = -(-dim // sub_dim)
+        padded = np.zeros((n, m * sub_dim), dtype=np.float32)
+        padded[:, :dim] = vectors
+        sub = padded.reshape(n, m, sub_dim)
+        rng = np.random.default_rng(0)
+        sample = rng.choice(n, size=min(n, 20000), replace=False)
+        centroids = np.zeros((m, PQ_CENTROIDS, sub_dim), dtype=np.float32)
+        codes = np.zeros((n, m), dtype=np.uint8)
+        for j in range(m):
+            c = kmeans(sub[sample, j], PQ_CENTROIDS)
+            centroids[j, :len(c)] = c
+            dist = (c ** 2).sum(axis=1)[None, :] - 2 * sub[:, j] @ c.T
+            codes[:, j] = dist.argmin(axis=1)
+        return cls(mode, ids, codes, dim, centroids=centroids, model=model, store_version=store_version)
+
+    @property
+    def nbytes(self):
+        """压缩索引数据的大小（编码、缩放系数和码本），不含 Chroma 中的原始向量"""
+        extra = sum(a.nbytes for a in (self.scale, self.centroids) if a is not None)
+        return self.codes.nbytes + extra
+
+    def scores(self, query):
+        """查询向量与全部向量的近似余弦相似度"""
+        q = normalize(query)
+        out = np.empty(len(self.ids), dtype=np.float32)
+        if self.mode == "pq":
+            m, _, sub_dim = self.centroids.shape
+            qp = np.zeros(m * sub_dim, dtype=np.float32)
+            qp[:self.dim] = q
+            # 查表法（ADC）：先算查询与每个子空间中心的内积，再按编码求和
+            table = np.einsum("mcd,md->mc", self.centroids, qp.reshape(m, sub_dim))
+            cols = np.arange(m)
+            for s in range(0, len(out), SEARCH_BLOCK):
+                out[s:s + SEARCH_BLOCK] = table[cols, self.codes[s:s + SEARCH_BLOCK]].sum(axis=1)
+            return out
+        if self.mode == "int8":
+            q = q * self.scale
+        for s in range(0, len(out), SEARCH_BLOCK):
+            out[s:s + SEARCH_BLOCK] = self.codes[s:s + SEARCH_BLOCK].astype(np.float32) @ q
+        return out
+
+    def search(self, query, k=5, rerank=0, fetch_vectors=None):
+        """
+        返回 [(下标, 相似度)]，按相似度降序
+        rerank > 0 且提供 fetch_vectors 时先取 max(k, rerank) 个候选，
+        再用 fetch_vectors(下标数组) 返回的全精度向量重新打分（QuantizedRetriever 从 Chroma 读取）
+        """
+        approx = self.scores(query)
+        candidates = top_n(approx, max(k, rerank))
+        if rerank and fetch_vectors is not None:
+            exact = normalize(fetch_vectors(candidates)) @ normalize(query)
+            order = np.argsort(-exact)[:k]
+            return [(int(i), float(s)) for i, s in zip(candidates[order], exact[order])]
+        return [(int(i), float(approx[i])) for i in candidates[:k]]
+
+    def decode(self, idx):
+        """由压缩编码还原的近似向量，不做全精度重排时用于 MMR"""
+        codes = self.codes[np.asarray(idx, dtype=np.int64)]
+        if self.mode == "float16":
+            return codes.astype(np.float32)
+        if self.mode == "int8":
+            return codes.astype(np.float32) * self.scale
+        m = self.centroids.shape[0]
+        return self.centroids[np.arange(m), codes].reshape(len(codes), -1)[:, :self.dim]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "codes.npy"), self.codes)
+        for name, value in (("scale.npy", self.scale), ("centroids.npy", self.centroids)):
+            p = os.path.join(path, name)
+            if value is not None:
+                np.save(p, value)
+            elif os.path.exists(p):
+                # 换了量化模式时删除上一个模式留下的文件，load 时不会误读
+                os.remove(p)
+        with open(os.path.join(path, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(self.ids, f)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"mode": self.mode, "dim": self.dim, "count": len(self.ids), "model": self.model,
+                       "store_version": self.store_version}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            ids = json.load(f)
+
+        def optional(name):
+            p = os.path.join(path, name)
+            return np.load(p) if os.path.exists(p) else None
+
+        return cls(
+            meta["mode"],
+            ids,
+            np.load(os.path.join(path, "codes.npy")),
+            meta["dim"],
+            scale=optional("scale.npy"),
+            centroids=optional("centroids.npy"),
+            model=meta.get("model"),
+            store_version=meta.get("store_version"),
+        )
+
+    def is_stale(self, persist_dir):
+        """构建之后向量库是否又有更新"""
+        return self.store_version != read_store_version(persist_dir)
+
+
+def export_vectors(db, batch_size=5000):
+    """分批从 Chroma 集合导出全部 id 和向量"""
+    ids, vectors = [], []
+    total = db._collection.count()
+    for offset in range(0, total, batch_size):
+        got = db._collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+        ids.extend(got["ids"])
+        vectors.append(np.asarray(got["embeddings"], dtype=np.float32))
+    if not vectors:
+        return ids, np.zeros((0, 0), dtype=np.float32)
+    return ids, np.concatenate(vectors)
+
+
+def fetch_store_vectors(vector_store, index, idx):
+    """
+    按压缩索引中的下标从 Chroma 读取全精度向量，用于重排
+    压缩索引构建后被删除的文本块在 Chroma 中已不存在，返回全零向量，相似度为 0
+    """
+    ids = [index.ids[i] for i in idx]
+    got = vector_store.get(ids=ids, include=["embeddings"])
+    by_id = dict(zip(got["ids"], got["embeddings"]))
+    out = np.zeros((len(ids), index.dim), dtype=np.float32)
+    for row, chunk_id in enumerate(ids):
+        if chunk_id in by_id:
+            out[row] = by_id[chunk_id]
+    return out
+
+
+def build_quantized_index(db, mode, persist_dir, model=None):
+    """从 Chroma 集合构建压缩索引并保存到 persist_dir/quantized"""
+    start = time.time()
+    ids, vectors = export_vectors(db)
+    if not ids:
+        print("向量库为空，跳过压缩索引构建")
+        return None
+    index = QuantizedIndex.build(mode, ids, vectors, model=model, store_version=read_store_version(persist_dir))
+    index.save(os.path.join(persist_dir, QUANTIZED_DIR_NAME))
+    print(f"压缩索引（{mode}）构建完成，耗时 {time.time()-start:.2f} 秒，索引 {index.nbytes/1024**2:.1f} MB"
+          f"（Chroma 中的 float32 向量 {vectors.nbytes/1024**2:.1f} MB 仍然保留）")
+    return index
+
+
+def quantized_mode(persist_dir):
+    """已有压缩索引的量化模式，没有时返回 None"""
+    try:
+        with open(os.path.join(persist_dir, QUANTIZED_DIR_NAME, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("mode")
+    except (OSError, ValueError):
+        return None
+
+
+def refresh_quantized_index(db, persist_dir, mode=None, model=None):
+    """
+    向量库内容变化（bump_store_version）后调用：
+    指定 mode 时按该模式构建，否则已有压缩索引时按原模式重建，没有压缩索引时什么也不做
+    """
+    mode = mode or quantized_mode(persist_dir)
+    if mode:
+        return build_quantized_index(db, mode, persist_dir, model=model)
+    return None
+
+
+class QuantizedRetriever(BaseRetriever):
+    """
+    基于压缩索引的检索器，参数与 Chroma 的 mmr 检索器一致：
+    k、fetch_k、lambda_mult、score_threshold，另有 rerank 表示全精度重排的候选数；
+    重排所需的全精度向量按 id 从 Chroma 读取，同一批向量也用于 MMR
+    """
+
+    index: QuantizedIndex
+    vector_store: object
+    search_kwargs: dict = Field(default_factory=dict)
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        k = self.search_kwargs.get("k", 4)
+        fetch_k = self.search_kwargs.get("fetch_k", 20)
+        lambda_mult = self.search_kwargs.get("lambda_mult", 0.5)
+        threshold = self.search_kwargs.get("score_threshold")
+        rerank = self.search_kwargs.get("rerank", fetch_k)
+
+        with stage("embed"):
+            query_vector = np.asarray(self.vector_store.embeddings.embed_query(query), dtype=np.float32)
+        fetched = {}
+
+        def fetch_vectors(idx):
+            out = fetch_store_vectors(self.vector_store, self.index, idx)
+            fetched.update(zip((int(i) for i in idx), out))
+            return out
+
+        with stage("retrieve"):
+            hits = self.index.search(query_vector, fetch_k, rerank=rerank, fetch_vectors=fetch_vectors)
+        if threshold is not None:
+            hits = [(i, s) for i, s in hits if s >= threshold]
+        if not hits:
+            return []
+        idx = [i for i, _ in hits]
+        with stage("rerank"):
+            if fetched:
+                vectors = np.stack([fetched[i] for i in idx])
+            else:
+                vectors = self.index.decode(idx)
+            selected = mmr_select(query_vector, vectors, k=k, lambda_mult=lambda_mult)
+        ids = [self.index.ids[idx[i]] for i in selected]
+        with stage("retrieve"):
+            got = self.vector_store.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {i: Document(page_content=d, metadata=m or {}, id=i)
+                 for i, d, m in zip(got["ids"], got["documents"], got["metadatas"])}
+        return [by_id[i] for i in ids if i in by_id]
+
+
+def main(argv=None):
+    from langchain_chroma import Chroma
+    from vector import EMBED_MODEL, VECTOR_DIR, build_embeddings
+
+    parser = argparse.ArgumentParser(description="从向量库构建压缩向量索引")
+    parser.add_argument("--persist-dir", default=VECTOR_DIR, help="向量数据库目录")
+    parser.add_argument("--mode", choices=QUANTIZE_MODES, default="int8")
+    args = parser.parse_args(argv)
+
+    db = Chroma(persist_directory=args.persist_dir, embedding_function=build_embeddings())
+    build_quantized_index(db, args.mode, args.persist_dir, model=EMBED_MODEL)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,66 @@
 # vector.py
-from langchain_community.document_loaders import (
-    DirectoryLoader,
-    TextLoader,
-    PyPDFLoader,
-    Docx2txtLoader,
-    UnstructuredExcelLoader,
+import argparse
+import os
+import time
+from collections import defaultdict
+
+from langchain_chroma import Chroma
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from cjk_splitter import CJKSentenceSplitter, approx_token_len
+from dedup import DEDUP_THRESHOLD, MinHashDeduper
+from embed_pipeline import (
+    EMBED_BATCH_SIZE,
+    EMBED_WORKERS,
+    QUEUE_DEPTH,
+    embed_and_store,
+    embed_pairs_and_store,
+    iter_batches,
+    prefetch,
 )
+from embedding_backends import EMBED_MODEL, build_embeddings, check_store_embeddings, write_store_signature
+from lexical_index import LEXICAL_INDEX_NAME, LexicalIndex
+from loaders import PARSE_WORKERS, LoadStats, iter_loaded, iter_source_files
+from manifest import IngestManifest, MANIFEST_NAME, bump_store_version, chunk_id, file_sha256
+from quantized_store import QUANTIZE_MODES, refresh_quantized_index
 
 # 指定加载文档的目录
 LOAD_PATH = "./"
 
-def load_documents(source_dir: str):
+def load_documents(source_dir: str, max_workers=PARSE_WORKERS):
     """
     加载指定目录下的所有文档
     支持格式：.txt, .pdf, .docx, .md , .xlsx , .xls, .py
+    只遍历一次目录，按扩展名分派加载器，PDF/DOCX/Excel 在进程池中并行解析；
+    解析失败的文件不会被静默忽略，而是在统计中列出
     """
-
-    # 分别加载不同格式，txt，md ,.py格式
-    text_loader = DirectoryLoader(
-        path=source_dir,  # 指定读取文件的父目录
-        glob=["​**​/*.txt", "​**​/*.md", "​**​/*.py"],  # 指定读取文件的格式
-        show_progress=True,  # 显示加载进度
-        use_multithreading=True,  # 使用多线程
-        silent_errors=True,  # 错误时不抛出异常，直接忽略该文件
-        loader_cls=TextLoader,  # 指定加载器
-        loader_kwargs={"autodetect_encoding": True},  # 自动检测文件编码
-    )
-    # pdf 格式
-    pdf_loader = DirectoryLoader(
-        path=source_dir,
-        glob="**/*.pdf",
-        show_progress=True,
-        use_multithreading=True,
-        silent_errors=True,
-        loader_cls=PyPDFLoader,
-    )
-    # docx 格式
-    docx_loader = DirectoryLoader(
-        path=source_dir,
-        glob="**/*.docx",
-        show_progress=True,
-        use_multithreading=True,
-        silent_errors=True,
-        loader_cls=Docx2txtLoader,
-        loader_kwargs={"autodetect_encoding": True},
-    )
-    # Excel 格式 - 新增部分
-    excel_loader = DirectoryLoader(
-        path=source_dir,
-        glob=["​**​/*.xlsx", "​**​/*.xls"],
-        show_progress=True,
-        use_multithreading=True,
-        silent_errors=True,
-        loader_cls=UnstructuredExcelLoader,
-    )
-    
-    # 合并文档列表
+    stats = LoadStats()
     docs = []
-    docs.extend(text_loader.load())
-    docs.extend(pdf_loader.load())
-    docs.extend(docx_loader.load())
-    docs.extend(excel_loader.load())  
+    for _, file_docs, _ in iter_loaded(iter_source_files(source_dir), max_workers=max_workers, stats=stats):
+        docs.extend(file_docs)
+    stats.report()
     print(f"成功加载 {len(docs)} 份文档")
     return docs
 
-documents = load_documents(LOAD_PATH)
-
-# 测试是否成功加载文档
-for doc in documents[:2]:  # 打印前两篇摘要
-    print(f"文件路径: {doc.metadata['source']}")
-    print(f"内容预览: {doc.page_content[:150]}...\n")
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+# 分割器类型：recursive 为递归字符分割器，cjk 为线性时间的中英文句子分割器
+SPLITTER_KIND = "recursive"
 
-def split_documents(documents, chunk_size=800, chunk_overlap=150):
+def build_text_splitter(chunk_size=800, chunk_overlap=150, kind=SPLITTER_KIND, length_unit="char"):
     """
-    使用递归字符分割器处理文本
+    创建文本分割器
     参数说明：
-    - chunk_size：每个文本块的最大字符数，推荐 500-1000
-    - chunk_overlap：相邻块之间的重叠字符数（保持上下文连贯），推荐 100-200
+    - chunk_size：每个文本块的最大长度，按字符计推荐 500-1000
+    - chunk_overlap：相邻块之间的重叠长度（保持上下文连贯），按字符计推荐 100-200
+    - kind：recursive 或 cjk，cjk 在大型中文 PDF 上明显更快
+    - length_unit：char 按字符计；token 按估算的模型 token 数计（仅 cjk 支持）
     """
-    text_splitter = RecursiveCharacterTextSplitter(
+    if kind == "cjk":
+        length_function = approx_token_len if length_unit == "token" else len
+        return CJKSentenceSplitter(chunk_size, chunk_overlap, length_function, add_start_index=True)
+    if length_unit != "char":
+        raise ValueError("recursive 分割器只支持按字符计长度")
+    return RecursiveCharacterTextSplitter(
         separators=["\n\n", "\n", ".", "。", "!", "?", "？", "！", "；", ";"],
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
@@ -88,6 +68,10 @@ def split_documents(documents, chunk_size=800, chunk_overlap=150):
         add_start_index=True,  # 保留原始文档中的位置信息
     )
 
+def split_documents(documents, chunk_size=800, chunk_overlap=150):
+    """分割全部文档，参数含义见 build_text_splitter"""
+    text_splitter = build_text_splitter(chunk_size, chunk_overlap)
+
     split_docs = text_splitter.split_documents(documents)
     print(f"原始文档数：{len(documents)}")
     print(f"分割后文本块数：{len(split_docs)}")
@@ -99,40 +83,59 @@ def split_documents(documents, chunk_size=800, chunk_overlap=150):
 
     return split_docs
 
-# 执行分割
-split_docs = split_documents(documents)
-
-
-from langchain_ollama import OllamaEmbeddings
-from langchain_chroma import Chroma
-import time
 
 # 指定持久化向量数据库的存储路径
 VECTOR_DIR = "./vector_store"
 
-def create_vector_store(split_docs, persist_dir=VECTOR_DIR):
+def print_cache_stats(embeddings):
+    if not hasattr(embeddings, "cache"):
+        return
+    stats = embeddings.cache.stats()
+    print(f"嵌入缓存：命中 {stats['hits']}，未命中 {stats['misses']}，命中率 {stats['hit_rate']:.1%}")
+
+def create_vector_store(split_docs, persist_dir=VECTOR_DIR,
+                        batch_size=EMBED_BATCH_SIZE, max_workers=EMBED_WORKERS, embeddings=None):
     """
     创建持久化向量数据库
     :param split_docs: 经过分割的文档列表
     :param persist_dir: 向量数据库存储路径（建议使用WSL原生路径）
+    :param batch_size: 每批向量化的文本块数
+    :param max_workers: 同时在途的嵌入请求数
+    :param embeddings: 嵌入模型，默认按 embedding_backends 中的配置创建
     """
 
-    # 初始化本地嵌入模型
-    embeddings = OllamaEmbeddings(model="deepseek-r1:7b")
+    # 初始化嵌入模型（后端与模型见 embedding_backends.py）
+    embeddings = embeddings or build_embeddings()
 
     try:
         start_time = time.time()
 
-        # 创建带进度显示的向量数据库
-        db = Chroma.from_documents(
-            documents=split_docs,
-            embedding=embeddings,
+        db = Chroma(
             persist_directory=persist_dir,  # 持久化存储路径
+            embedding_function=embeddings,
+        )
+        # 向量库已有内容时，嵌入模型必须与入库时一致
+        signature = check_store_embeddings(db, embeddings)
+        # BM25 倒排索引与向量库同步写入
+        lexical = LexicalIndex(os.path.join(persist_dir, LEXICAL_INDEX_NAME))
+        # 分批并发向量化，每批完成后立即写入，单批失败不影响其他批次
+        done, failed_ids = embed_and_store(
+            db, embeddings, split_docs,
+            total=len(split_docs), batch_size=batch_size, max_workers=max_workers,
+            on_stored=lexical.add_many,
         )
+        lexical.close()
+        write_store_signature(db, signature)
 
         print(f"\n向量化完成！耗时 {time.time()-start_time:.2f} 秒")
         print(f"数据库存储路径：{persist_dir}")
         print(f"总文档块数：{db._collection.count()}")
+        if failed_ids:
+            print(f"向量化失败文本块数：{len(failed_ids)}")
+        print_cache_stats(embeddings)
+        bump_store_version(persist_dir)
+        # 已有的压缩索引是旧内容的快照，随向量库版本一起重建
+        refresh_quantized_index(db, persist_dir, model=getattr(embeddings, "embed_model", EMBED_MODEL))
 
         return db
     except Exception as e:
@@ -140,5 +143,239 @@ def create_vector_store(split_docs, persist_dir=VECTOR_DIR):
         return None
 
 
-# 执行向量化（使用之前分割好的split_docs）
-vector_db = create_vector_store(split_docs)
+def iter_file_chunks(files, text_splitter, manifest, file_ids, max_workers=PARSE_WORKERS, stats=None,
+                     deduper=None, duplicates=None):
+    """
+    解析并分割文件，依次产出 (文本块, id)
+    文件在进程池中并行解析，在途文件数有上限；成功分割的文件记入 file_ids，
+    加载失败的文件从清单中移除，下次运行会重试
+    传入 deduper 时，近似重复的文本块不再产出，其来源记入 duplicates[代表块 id]
+    """
+    for (path, st, sha), docs, error in iter_loaded(files, key=lambda f: f[0], max_workers=max_workers, stats=stats):
+        if error:
+            manifest.remove(path)
+            print(f"\n文件加载失败 {path}：{error}")
+            continue
+        sha = sha or file_sha256(path)
+        file_chunks = text_splitter.split_documents(docs)
+        ids_of_file = [chunk_id(path, sha, i) for i in range(len(file_chunks))]
+        dup_of = set()
+        for chunk, cid in zip(file_chunks, ids_of_file):
+            if deduper is not None:
+                rep = deduper.add(cid, chunk.page_content)
+                if rep is not None:
+                    dup_of.add(rep)
+                    duplicates[rep].add(chunk.metadata.get("source", path))
+                    continue
+            yield chunk, cid
+        file_ids.append((path, st, sha, ids_of_file, dup_of))
+
+
+def record_duplicate_sources(db, duplicates):
+    """把被去重文本块的来源路径写入代表块的 duplicate_sources 元数据（换行分隔）"""
+    for batch in iter_batches(list(duplicates), 500):
+        got = db._collection.get(ids=batch, include=["metadatas"])
+        ids, metadatas = [], []
+        for rep_id, meta in zip(got["ids"], got["metadatas"]):
+            meta = dict(meta or {})
+            sources = set(filter(None, meta.get("duplicate_sources", "").split("\n")))
+            sources.update(duplicates[rep_id])
+            sources.discard(meta.get("source"))
+            if sources:
+                meta["duplicate_sources"] = "\n".join(sorted(sources))
+                ids.append(rep_id)
+                metadatas.append(meta)
+        if ids:
+            db._collection.update(ids=ids, metadatas=metadatas)
+
+
+def prune_duplicate_sources(db, stale_sources):
+    """从代表块的 duplicate_sources 元数据中去掉已删除或已变更的文件路径：stale_sources 为 {代表块 id: 路径集合}"""
+    for batch in iter_batches(list(stale_sources), 500):
+        got = db._collection.get(ids=batch, include=["metadatas"])
+        ids, metadatas = [], []
+        for rep_id, meta in zip(got["ids"], got["metadatas"]):
+            meta = dict(meta or {})
+            sources = set(filter(None, meta.get("duplicate_sources", "").split("\n")))
+            if not sources & stale_sources[rep_id]:
+                continue
+            sources -= stale_sources[rep_id]
+            # Chroma 的 update 会合并元数据，置为 None 才会删除该键
+            meta["duplicate_sources"] = "\n".join(sorted(sources)) if sources else None
+            ids.append(rep_id)
+            metadatas.append(meta)
+        if ids:
+            db._collection.update(ids=ids, metadatas=metadatas)
+
+
+def update_vector_store(
+    source_dir=LOAD_PATH,
+    persist_dir=VECTOR_DIR,
+    rebuild=False,
+    chunk_size=800,
+    chunk_overlap=150,
+    batch_size=EMBED_BATCH_SIZE,
+    max_workers=EMBED_WORKERS,
+    queue_depth=QUEUE_DEPTH,
+    parse_workers=PARSE_WORKERS,
+    splitter=SPLITTER_KIND,
+    length_unit="char",
+    dedup=False,
+    dedup_threshold=DEDUP_THRESHOLD,
+    quantize=None,
+    embeddings=None,
+):
+    """
+    增量更新向量数据库
+    只对新增和变更的文件重新加载、分割、向量化；
+    变更和已删除文件的旧文本块按清单中记录的 id 从向量库中删除
+    加载/分割在后台线程中逐文件进行，通过长度为 queue_depth 的队列交给并发向量化阶段，
+    两个阶段同时运行，峰值内存与语料总量无关
+    :param rebuild: 清空向量库和清单后全量重建
+    :param parse_workers: 解析 PDF/DOCX/Excel 的进程数
+    :param splitter / length_unit: 见 build_text_splitter
+    :param dedup: 向量化前用 MinHash 去除本次入库中的近似重复文本块，只向量化一个代表块
+    :param quantize: 入库后按 float16 / int8 / pq 构建压缩向量索引；None 时只在向量库有变化且已有压缩索引时按原模式重建
+    BM25 倒排索引与向量库使用相同的文本块 id，随每批写入同步更新
+    :param embeddings: 嵌入模型，默认按 embedding_backends 中的配置创建；模型与维度记录在集合元数据中
+    """
+    manifest_path = os.path.join(persist_dir, MANIFEST_NAME)
+    embeddings = embeddings or build_embeddings()
+    db = Chroma(persist_directory=persist_dir, embedding_function=embeddings)
+    lexical = LexicalIndex(os.path.join(persist_dir, LEXICAL_INDEX_NAME))
+
+    if rebuild:
+        db.delete_collection()
+        db = Chroma(persist_directory=persist_dir, embedding_function=embeddings)
+        lexical.clear()
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+    # 增量入库时嵌入模型必须与已有向量一致，换模型请用 --rebuild 或 embedding_backends.py migrate
+    signature = check_store_embeddings(db, embeddings)
+    manifest = IngestManifest(manifest_path)
+
+    if len(manifest) == 0 and db._collection.count() > 0:
+        print("警告：向量库非空但没有入库清单，增量入库会产生重复文本块，建议使用 --rebuild 重建")
+
+    start_time = time.time()
+    paths = iter_source_files(source_dir, exclude_dirs=[persist_dir])
+    added, changed, removed = manifest.diff(paths)
+    print(f"新增文件：{len(added)}，变更文件：{len(changed)}，删除文件：{len(removed)}")
+
+    # 先删除变更文件和已删除文件的旧文本块
+    stale_paths = removed + [p for p, _, _ in changed]
+    stale_ids = []
+    for path in stale_paths:
+        stale_ids.extend(manifest.chunk_ids_of(path))
+    # 去重时被其他文件代表的文件，代表块被删除后也要重新入库，直到没有新的依赖
+    handled, pending = set(stale_paths), list(stale_ids)
+    while pending:
+        dependents = manifest.dependents_of(pending, exclude=handled)
+        pending = []
+        for path in dependents:
+            handled.add(path)
+            ids_of_file = manifest.chunk_ids_of(path)
+            stale_ids.extend(ids_of_file)
+            pending.extend(ids_of_file)
+            changed.append((path, os.stat(path), manifest.files[path]["sha256"]))
+    if stale_ids:
+        db.delete(ids=stale_ids)
+        lexical.delete(stale_ids)
+    # 这些文件中曾被去重的文本块记在其他文件代表块的 duplicate_sources 中，先去掉，
+    # 否则检索结果会继续引用已删除的文件；变更文件重新入库时如果仍然重复会再记上
+    stale_sources = defaultdict(set)
+    for path in handled:
+        for rep_id in manifest.files.get(path, {}).get("dup_of", ()):
+            stale_sources[rep_id].add(path)
+    stale_id_set = set(stale_ids)
+    prune_duplicate_sources(db, {k: v for k, v in stale_sources.items() if k not in stale_id_set})
+    for path in removed:
+        manifest.remove(path)
+
+    text_splitter = build_text_splitter(chunk_size, chunk_overlap, splitter, length_unit)
+    file_ids = []
+    stats = LoadStats()
+    deduper = MinHashDeduper(threshold=dedup_threshold) if dedup else None
+    duplicates = defaultdict(set)
+    pairs = prefetch(
+        iter_file_chunks(added + changed, text_splitter, manifest, file_ids, parse_workers, stats,
+                         deduper, duplicates),
+        queue_depth,
+    )
+    total_chunks, failed_ids = embed_pairs_and_store(
+        db, embeddings, pairs, batch_size=batch_size, max_workers=max_workers, on_stored=lexical.add_many,
+    )
+    failed_ids = set(failed_ids)
+    if duplicates:
+        record_duplicate_sources(db, {k: v for k, v in duplicates.items() if k not in failed_ids})
+
+    # 只有全部文本块（包括代表它的文本块）都写入成功的文件才记入清单；id 是确定的，重试时会覆盖已写入的部分
+    for path, st, sha, ids_of_file, dup_of in file_ids:
+        if failed_ids.intersection(ids_of_file) or failed_ids.intersection(dup_of):
+            manifest.remove(path)
+        else:
+            manifest.update(path, st, sha, ids_of_file, dup_of)
+    manifest.save()
+    write_store_signature(db, signature)
+    # 向量库内容有变化时更新版本号，压缩索引和问答端的答案缓存据此失效
+    store_changed = bool(stale_ids or total_chunks or rebuild)
+    if store_changed:
+        bump_store_version(persist_dir)
+
+    stats.report()
+    if deduper is not None:
+        deduper.report(batch_size)
+    print(f"\n增量更新完成！耗时 {time.time()-start_time:.2f} 秒")
+    print(f"删除文本块数：{len(stale_ids)}，新增文本块数：{total_chunks}")
+    print(f"总文档块数：{db._collection.count()}，倒排索引文本块数：{lexical.count()}")
+    print_cache_stats(embeddings)
+    lexical.close()
+
+    # 压缩索引是向量库的快照：指定 --quantize 时构建，向量库有变化时按已有索引的模式重建，不会留下过期的索引
+    if quantize or store_changed:
+        refresh_quantized_index(db, persist_dir, quantize, model=getattr(embeddings, "embed_model", EMBED_MODEL))
+    return db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="加载文档并写入本地向量数据库")
+    parser.add_argument("--source", default=LOAD_PATH, help="文档目录")
+    parser.add_argument("--persist-dir", default=VECTOR_DIR, help="向量数据库目录")
+    parser.add_argument("--rebuild", action="store_true", help="清空向量库后全量重建")
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--chunk-overlap", type=int, default=150)
+    parser.add_argument("--splitter", choices=["recursive", "cjk"], default=SPLITTER_KIND, help="文本分割器")
+    parser.add_argument("--length-unit", choices=["char", "token"], default="char",
+                        help="文本块长度单位，token 仅 cjk 分割器支持")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="每批向量化的文本块数")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="同时在途的嵌入请求数")
+    parser.add_argument("--queue-depth", type=int, default=QUEUE_DEPTH,
+                        help="加载与向量化之间缓冲的最大文本块数")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS,
+                        help="解析 PDF/DOCX/Excel 的进程数，默认等于 CPU 核数")
+    parser.add_argument("--dedup", action="store_true", help="向量化前去除近似重复的文本块")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="近似重复的 Jaccard 相似度阈值")
+    parser.add_argument("--quantize", choices=QUANTIZE_MODES, help="入库后构建压缩检索索引（附加在 Chroma 旁，不替代其中的向量）")
+    args = parser.parse_args(argv)
+
+    update_vector_store(
+        source_dir=args.source,
+        persist_dir=args.persist_dir,
+        rebuild=args.rebuild,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        max_workers=args.workers,
+        queue_depth=args.queue_depth,
+        parse_workers=args.parse_workers,
+        splitter=args.splitter,
+        length_unit=args.length_unit,
+        dedup=args.dedup,
+        dedup_threshold=args.dedup_threshold,
+        quantize=args.quantize,
+    )
+
+
+if __name__ == "__main__":
+    main()
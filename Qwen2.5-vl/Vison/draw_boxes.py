@@ -1,144 +1,278 @@
+# draw_boxes.py
+"""
+把分析结果中的“坐标”画到原图上
+单张：draw_boxes_on_image(图片路径, 结果 JSON)
+批量：从 result_store.py 的结果目录或 JSONL 文件中逐条读取 (图片, 结果)，由进程池并行绘制并写入输出目录；
+每个工作进程只加载一次字体，直接用 PIL 读图、画框、保存，不再经过 OpenCV 的 BGR/RGB 转换
+用法：
+    python draw_boxes.py --store ../results --status 不干净 --output-dir annotated --workers 4
+    python draw_boxes.py --jsonl ../results/inspections.jsonl --output-dir annotated
+"""
+import argparse
+import hashlib
 import json
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-
-def draw_boxes_on_image(image_path, json_data):
-    # 读取图片
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError(f"无法读取图片: {image_path}")
-    
-    # 将OpenCV图片转换为PIL格式
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    pil_image = Image.fromarray(image_rgb)
-    draw = ImageDraw.Draw(pil_image)
-    
-    # 设置字体参数
-    try:
-        # 尝试使用系统中文字体
-        font_large = ImageFont.truetype("simhei.ttf", 40)  # 状态字体
-        font_normal = ImageFont.truetype("simhei.ttf", 24)  # 标签字体
-    except:
-        try:
-            # Windows系统字体
-            font_large = ImageFont.truetype("C:/Windows/Fonts/simhei.ttf", 40)
-            font_normal = ImageFont.truetype("C:/Windows/Fonts/simhei.ttf", 24)
-        except:
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from image_preprocess import map_boxes
+from result_store import COMPLETED_OUTCOMES, iter_jsonl, query_records
+
+# 依次尝试的中文字体
+FONT_CANDIDATES = (
+    "simhei.ttf",
+    "C:/Windows/Fonts/simhei.ttf",
+    "C:/Windows/Fonts/msyh.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/System/Library/Fonts/PingFang.ttc",
+)
+STATUS_FONT_SIZE = 40
+LABEL_FONT_SIZE = 24
+TEXT_COLOR = (255, 0, 0)  # 红色 (RGB格式)
+REQUIRED_BOX_COLOR = (0, 0, 255)   # 蓝色 - 用于required_signs
+CONTAMINANT_BOX_COLOR = (255, 165, 0)   # 橙色 - 用于contaminants
+# 输出 JPEG 质量
+JPEG_QUALITY = 90
+# 每个工作进程最多排队的任务数，结果逐条读取，不会一次性全部提交
+QUEUE_PER_WORKER = 4
+
+_fonts = None
+
+
+def load_fonts():
+    """加载状态和标签字体，结果在进程内缓存，只加载一次"""
+    global _fonts
+    if _fonts is None:
+        for path in FONT_CANDIDATES:
             try:
-                # 微软雅黑字体
-                font_large = ImageFont.truetype("C:/Windows/Fonts/msyh.ttc", 40)
-                font_normal = ImageFont.truetype("C:/Windows/Fonts/msyh.ttc", 24)
-            except:
-                # 如果都找不到，使用默认字体
-                font_large = ImageFont.load_default()
-                font_normal = ImageFont.load_default()
-    
-    text_color = (255, 0, 0)  # 红色 (RGB格式)
-    required_box_color = (0, 0, 255)   # 蓝色 - 用于required_signs
-    contaminant_box_color = (255, 165, 0)   # 橙色 - 用于contaminants
-    
+                _fonts = (ImageFont.truetype(path, STATUS_FONT_SIZE), ImageFont.truetype(path, LABEL_FONT_SIZE))
+                break
+            except OSError:
+                continue
+        else:
+            # 如果都找不到，使用默认字体
+            _fonts = (ImageFont.load_default(), ImageFont.load_default())
+    return _fonts
+
+
+def draw_annotations(pil_image, json_data, fonts=None, verbose=False):
+    """
+    在 PIL 图片上就地绘制状态、必需标识（蓝色框）和违规粘贴物（橙色框）
+    :return: 绘制的框数
+    """
+    font_large, font_normal = fonts or load_fonts()
+    draw = ImageDraw.Draw(pil_image)
+    boxes = 0
+
     # 在左上角绘制状态
-    status = json_data.get('status', '')
-    draw.text((50, 50), status, font=font_large, fill=text_color)
-    
+    status = json_data.get('status') or ''
+    draw.text((50, 50), status, font=font_large, fill=TEXT_COLOR)
+
     # 处理required_signs - 使用蓝色框
-    required_signs = json_data.get('required_signs', {})
-    print(f"处理required_signs: {len(required_signs)}个项目")
+    required_signs = json_data.get('required_signs') or {}
+    if verbose:
+        print(f"处理required_signs: {len(required_signs)}个项目")
     for sign_name, sign_info in required_signs.items():
-        print(f"  - {sign_name}: 状态={sign_info['状态']}")
-        if sign_info['状态'] == '存在':
-            coords = sign_info['坐标']
-            x1, y1, x2, y2 = coords
-            # 绘制蓝色框
-            draw.rectangle([x1, y1, x2, y2], outline=required_box_color, width=3)
-            # 绘制标签
-            draw.text((x1, y1-30), f"[必需]{sign_name}", font=font_normal, fill=text_color)
-            print(f"    绘制框: ({x1}, {y1}) -> ({x2}, {y2})")
-    
+        if verbose:
+            print(f"  - {sign_name}: 状态={sign_info.get('状态')}")
+        if sign_info.get('状态') == '存在' and sign_info.get('坐标'):
+            x1, y1, x2, y2 = sign_info['坐标']
+            draw.rectangle([x1, y1, x2, y2], outline=REQUIRED_BOX_COLOR, width=3)
+            draw.text((x1, y1-30), f"[必需]{sign_name}", font=font_normal, fill=TEXT_COLOR)
+            boxes += 1
+            if verbose:
+                print(f"    绘制框: ({x1}, {y1}) -> ({x2}, {y2})")
+
     # 处理contaminants - 使用橙色框
-    contaminants = json_data.get('contaminants', [])
-    print(f"处理contaminants: {len(contaminants)}个项目")
+    contaminants = json_data.get('contaminants') or []
+    if verbose:
+        print(f"处理contaminants: {len(contaminants)}个项目")
     for i, contaminant in enumerate(contaminants):
         original_type = contaminant.get('类型', '未知类型')
         contaminant_status = contaminant.get('状态', '未知状态')
-        print(f"  - 污染物{i+1}: {original_type}, 状态={contaminant_status}")
-        
-        if contaminant_status == '存在':
-            coords = contaminant['坐标']
-            x1, y1, x2, y2 = coords
-            # 绘制橙色框
-            draw.rectangle([x1, y1, x2, y2], outline=contaminant_box_color, width=3)
+        if verbose:
+            print(f"  - 污染物{i+1}: {original_type}, 状态={contaminant_status}")
+        if contaminant_status == '存在' and contaminant.get('坐标'):
+            x1, y1, x2, y2 = contaminant['坐标']
+            draw.rectangle([x1, y1, x2, y2], outline=CONTAMINANT_BOX_COLOR, width=3)
             # 在图片上统一显示为"其他粘贴物"，不显示描述
-            display_label = "[其他粘贴物]"
-            draw.text((x1, y1-30), display_label, font=font_normal, fill=text_color)
-            print(f"    绘制框: ({x1}, {y1}) -> ({x2}, {y2}), 原类型: {original_type}, 显示: 其他粘贴物")
-        else:
+            draw.text((x1, y1-30), "[其他粘贴物]", font=font_normal, fill=TEXT_COLOR)
+            boxes += 1
+            if verbose:
+                print(f"    绘制框: ({x1}, {y1}) -> ({x2}, {y2}), 原类型: {original_type}, 显示: 其他粘贴物")
+        elif verbose:
             print(f"    跳过绘制: 状态为{contaminant_status}")
-    
-    # 将PIL图片转换回OpenCV格式
-    result_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-    
+    return boxes
+
+
+def annotated_path(image_path, output_dir=None, suffix="_annotated"):
+    """
+    输出路径：不指定输出目录时为原目录下的 <原文件名><suffix><原扩展名>；
+    写入输出目录时，不同摄像头目录中的同名图片会互相覆盖，文件名中再加入原图绝对路径的短哈希
+    """
+    stem, ext = os.path.splitext(os.path.basename(image_path))
+    if not output_dir:
+        return os.path.join(os.path.dirname(image_path), f"{stem}{suffix}{ext or '.jpg'}")
+    digest = hashlib.sha1(os.path.abspath(image_path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(output_dir, f"{stem}_{digest}{suffix}{ext or '.jpg'}")
+
+
+def save_image(pil_image, output_path, quality=JPEG_QUALITY):
+    if output_path.lower().endswith(('.jpg', '.jpeg')):
+        pil_image.save(output_path, quality=quality)
+    else:
+        pil_image.save(output_path)
+
+
+def draw_boxes_on_image(image_path, json_data, scale=None, output_path=None, verbose=True):
+    """
+    scale: 模型看到的是缩小后的图片时传入 (scale_x, scale_y)（即 PreparedImage.scale），
+    坐标先换算回原图像素再画框；qwen2_5.py 保存的结果已经换算过，不需要传
+    output_path: 默认为原图同目录下的 <文件名>_annotated<扩展名>
+    """
+    # 读取图片，按 EXIF 方向摆正（与模型看到的方向一致）
+    try:
+        with Image.open(image_path) as image:
+            pil_image = ImageOps.exif_transpose(image).convert('RGB')
+    except OSError:
+        raise ValueError(f"无法读取图片: {image_path}")
+    if scale is not None:
+        json_data = map_boxes(json_data, scale, pil_image.width, pil_image.height)
+
+    draw_annotations(pil_image, json_data, verbose=verbose)
+
     # 保存结果图片
-    output_path = image_path.replace('.jpg', '_annotated.jpg')
-    cv2.imwrite(output_path, result_image)
+    output_path = output_path or annotated_path(image_path)
+    save_image(pil_image, output_path)
     return output_path
 
-if __name__ == "__main__":
-    # 示例使用
-    image_path = r"F:\XINZAILING\Qwen_reg\094ce015646d45ba952ef3d6a0d35a7.jpg"
-    json_data = {
-  "status": "不干净",
-  "required_signs": {
-    "特种设备使用标志": {
-      "坐标": [
-        320,
-        140,
-        540,
-        360
-      ],
-      "状态": "存在"
-    },
-    "乘用电梯安全注意事项": {
-      "坐标": [
-        320,
-        360,
-        540,
-        480
-      ],
-      "状态": "缺失"
+
+def record_to_result(record):
+    """ResultStore 记录转换为 draw_annotations 使用的结果格式"""
+    return {
+        "status": record.get("status"),
+        "required_signs": record.get("signs"),
+        "contaminants": record.get("contaminants"),
     }
-  },
-  "contaminants": [
-    {
-      "类型": "广告/违规安全注意事项/其他标识牌",
-      "坐标": [
-        320,
-        140,
-        540,
-        360
-      ],
-      "状态": "存在",
-      "描述": "电梯维保公示牌，包含维保时间、维保人员姓名、维保单位名称等信息"
+
+
+def iter_pairs(records):
+    """从结果记录中取出可以绘制的 (图片路径, 结果)，失败或回复格式错误的记录跳过"""
+    for record in records:
+        if record.get("outcome") in COMPLETED_OUTCOMES:
+            yield record["image"], record_to_result(record)
+
+
+def _init_worker():
+    load_fonts()
+
+
+def _annotate_one(image_path, json_data, output_dir, quality):
+    with Image.open(image_path) as image:
+        pil_image = ImageOps.exif_transpose(image).convert('RGB')
+    boxes = draw_annotations(pil_image, json_data)
+    output_path = annotated_path(image_path, output_dir)
+    save_image(pil_image, output_path, quality)
+    return output_path, boxes
+
+
+def annotate_batch(pairs, output_dir, workers=None, quality=JPEG_QUALITY):
+    """
+    并行绘制 (图片路径, 结果) 序列，pairs 可以是生成器，提交的任务数有上限，内存占用与总数无关
+    :return: {"images", "boxes", "failed", "seconds", "images_per_sec"}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    stats = {"images": 0, "boxes": 0, "failed": 0}
+
+    def collect(done):
+        for future in done:
+            try:
+                _, boxes = future.result()
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"绘制失败 {pending.pop(future)}: {str(e)}")
+                continue
+            pending.pop(future)
+            stats["images"] += 1
+            stats["boxes"] += boxes
+
+    start = time.perf_counter()
+    pending = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for image_path, json_data in pairs:
+            if len(pending) >= workers * QUEUE_PER_WORKER:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[pool.submit(_annotate_one, image_path, json_data, output_dir, quality)] = image_path
+        collect(wait(pending)[0])
+    stats["seconds"] = time.perf_counter() - start
+    stats["images_per_sec"] = stats["images"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+# 示例结果，坐标为原图像素
+EXAMPLE_RESULT = {
+    "status": "不干净",
+    "required_signs": {
+        "特种设备使用标志": {"坐标": [320, 140, 540, 360], "状态": "存在"},
+        "乘用电梯安全注意事项": {"坐标": [320, 360, 540, 480], "状态": "缺失"},
     },
-    {
-      "类型": "广告/违规安全注意事项/其他标识牌",
-      "坐标": [
-        57,
-        290,
-        210,
-        480
-      ],
-      "状态": "存在",
-      "描述": "电子显示屏，显示外部建筑画面和部分文字信息"
-    }
-  ]
+    "contaminants": [
+        {
+            "类型": "广告/违规安全注意事项/其他标识牌",
+            "坐标": [320, 140, 540, 360],
+            "状态": "存在",
+            "描述": "电梯维保公示牌，包含维保时间、维保人员姓名、维保单位名称等信息",
+        },
+        {
+            "类型": "广告/违规安全注意事项/其他标识牌",
+            "坐标": [57, 290, 210, 480],
+            "状态": "存在",
+            "描述": "电子显示屏，显示外部建筑画面和部分文字信息",
+        },
+    ],
 }
 
 
-    
-    try:
-        output_path = draw_boxes_on_image(image_path, json_data)
-        print(f"处理完成，结果已保存至: {output_path}")
-    except Exception as e:
-        print(f"处理过程中出现错误: {str(e)}") 
\ No newline at end of file
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="把分析结果的坐标画到图片上")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--store", help="result_store.py 的结果目录，按条件查询后绘制")
+    source.add_argument("--jsonl", help="inspections.jsonl 文件，逐行读取后绘制")
+    source.add_argument("--example", metavar="IMAGE", help="用内置的示例结果绘制一张图片")
+    parser.add_argument("--status", help="只绘制该状态的记录，例如 不干净（--store）")
+    parser.add_argument("--since", help="起始时间（--store）")
+    parser.add_argument("--until", help="截止时间（--store）")
+    parser.add_argument("--output-dir", default="annotated", help="输出目录")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="绘制进程数")
+    parser.add_argument("--quality", type=int, default=JPEG_QUALITY, help="输出 JPEG 质量")
+    args = parser.parse_args(argv)
+
+    if args.example:
+        try:
+            os.makedirs(args.output_dir, exist_ok=True)
+            output_path = draw_boxes_on_image(args.example, EXAMPLE_RESULT,
+                                              output_path=annotated_path(args.example, args.output_dir))
+            print(f"处理完成，结果已保存至: {output_path}")
+        except Exception as e:
+            print(f"处理过程中出现错误: {str(e)}")
+        return
+
+    if args.store:
+        # 只读查询，不会在结果目录中创建或追加文件
+        records = query_records(args.store, status=args.status, since=args.since, until=args.until)
+    else:
+        records = (r for r in iter_jsonl(args.jsonl) if args.status is None or r.get("status") == args.status)
+    stats = annotate_batch(iter_pairs(records), args.output_dir, args.workers, args.quality)
+    print(f"绘制 {stats['images']} 张（{stats['boxes']} 个框），失败 {stats['failed']} 张，"
+          f"耗时 {stats['seconds']:.1f} 秒，{stats['images_per_sec']:.1f} 张/秒，输出目录 {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# mock_vl_server.py
+"""
+本地模拟的 OpenAI 兼容 Qwen2.5-VL 服务，用于离线测试 qwen25_vl_api.py、qwen25_vl_async.py 和 ../qwen2_5.py
+支持 POST /v1/chat/completions（包括 stream=true 的 SSE 输出），可以注入延迟和故障：
+每 fail_every 个请求返回一次 fail_status（默认 429，带 Retry-After 头）
+默认回复最后一条用户消息中的文字和图片数量；请求 JSON 格式（response_format=json_object）时回复一个“干净”的巡检结果
+用法：
+    python mock_vl_server.py --port 18555 --delay 0.2 --fail-every 4
+    # 代码中
+    with MockVLServer(delay=0.05, fail_every=3) as server:
+        client = AsyncQwen25VLClient(api_key="test", base_url=server.base_url)
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+JSON_REPLY = {"status": "干净", "required_signs": {}, "contaminants": []}
+
+
+def _describe(messages):
+    """最后一条用户消息中的文字和图片 / 视频帧数量"""
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            return content, 0
+        texts, images = [], 0
+        for part in content or []:
+            kind = part.get("type")
+            if kind == "text":
+                texts.append(part.get("text", ""))
+            elif kind == "image_url":
+                images += 1
+            elif kind == "video":
+                images += len(part.get("video") or [])
+        return "".join(texts), images
+    return "", 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "code": "NotFound"}})
+            return
+        try:
+            request = json.loads(body)
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid JSON body", "code": "InvalidParameter"}})
+            return
+
+        number = mock._begin()
+        try:
+            if mock.fail_every and number % mock.fail_every == 0:
+                mock._count("failures")
+                headers = [("Retry-After", str(mock.retry_after))] if mock.fail_status == 429 else []
+                self._send_json(mock.fail_status, {"error": {"message": "injected failure", "code": "Throttling"}},
+                                headers)
+                return
+            if mock.delay:
+                time.sleep(mock.delay)
+            content = mock.reply_for(request)
+            if request.get("stream"):
+                self._stream(request, content)
+            else:
+                self._send_json(200, {
+                    "id": f"chatcmpl-mock-{number}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": len(content),
+                              "total_tokens": 10 + len(content)},
+                })
+        finally:
+            mock._end()
+
+    def _stream(self, request, content):
+        mock = self.server.mock
+        mock._count("streams")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # 流式回复不带长度，发送完后关闭连接
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        pieces = [content[i:i + mock.chunk_size] for i in range(0, len(content), mock.chunk_size)]
+        for index, piece in enumerate(pieces + [None]):
+            delta = {"content": piece} if piece is not None else {}
+            if index == 0:
+                delta["role"] = "assistant"
+            chunk = {
+                "id": "chatcmpl-mock-stream",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if piece is not None else "stop"}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if mock.chunk_delay:
+                time.sleep(mock.chunk_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端超时或提前结束流式读取时会断开连接，不打印堆栈
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockVLServer:
+    """
+    在后台线程中运行的模拟服务，port=0 时自动选择空闲端口
+    参数说明：
+        delay: 每个请求回复前等待的秒数
+        fail_every: 每 N 个请求注入一次故障，0 表示不注入
+        fail_status: 注入故障的 HTTP 状态码（429 / 500 / 401 ...）
+        retry_after: 429 回复的 Retry-After 秒数
+        reply: 固定的回复内容，None 时按请求生成
+        chunk_size / chunk_delay: 流式回复每块的字符数和间隔秒数
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, fail_every=0, fail_status=429, retry_after=0.1,
+                 reply=None, chunk_size=4, chunk_delay=0.0):
+        self.delay = delay
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.reply = reply
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "failures": 0, "streams": 0, "in_flight": 0, "max_in_flight": 0}
+        self._server = _Server((host, port), _Handler)
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reply_for(self, request):
+        if self.reply is not None:
+            return self.reply
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            return json.dumps(JSON_REPLY, ensure_ascii=False)
+        text, images = _describe(request.get("messages") or [])
+        return f"[mock] 收到 {images} 张图片：{text}"
+
+    def _begin(self):
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["in_flight"] += 1
+            self._counters["max_in_flight"] = max(self._counters["max_in_flight"], self._counters["in_flight"])
+            return self._counters["requests"]
+
+    def _end(self):
+        with self._lock:
+            self._counters["in_flight"] -= 1
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def stats(self):
+        """requests 请求数，failures 注入的故障数，streams 流式请求数，max_in_flight 同时处理的最大请求数"""
+        with self._lock:
+            return dict(self._counters)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地模拟的 Qwen2.5-VL 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18555)
+    parser.add_argument("--delay", type=float, default=0.0, help="每个请求回复前等待的秒数")
+    parser.add_argument("--fail-every", type=int, default=0, help="每 N 个请求注入一次故障")
+    parser.add_argument("--fail-status", type=int, default=429, help="注入故障的 HTTP 状态码")
+    parser.add_argument("--reply", help="固定的回复内容")
+    args = parser.parse_args(argv)
+
+    server = MockVLServer(args.host, args.port, args.delay, args.fail_every, args.fail_status, reply=args.reply)
+    print(f"模拟服务已启动：{server.base_url}，Ctrl+C 退出")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+        print(f"共处理 {server.stats()['requests']} 个请求")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,22 +6,19 @@ Qwen2.5-VL API调用示例
 """
 
 import os
+import sys
 import base64
 from openai import OpenAI
 import dashscope
 from typing import Optional, List, Dict, Any
 
-# 设置API密钥和基础URL
-API_KEY = os.getenv("DASHSCOPE_API_KEY")
-if not API_KEY:
-    print("请设置环境变量 DASHSCOPE_API_KEY")
-    exit(1)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from image_preprocess import PreparedImage, prepare_image
+from qwen25_vl_async import BASE_URL, VLConfigError
 
-# OpenAI兼容方式的客户端
-openai_client = OpenAI(
-    api_key=API_KEY,
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-)
+# 设置API密钥；并发服务中请使用 qwen25_vl_async.AsyncQwen25VLClient
+API_KEY = os.getenv("DASHSCOPE_API_KEY")
 
 # DashScope原生客户端
 dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1'
@@ -30,11 +27,15 @@ dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1'
 class Qwen25VLClient:
     """Qwen2.5-VL API客户端封装"""
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, preprocess: bool = True):
         self.api_key = api_key or API_KEY
+        if not self.api_key:
+            raise VLConfigError("请设置环境变量 DASHSCOPE_API_KEY")
+        # 本地图片上传前是否缩小并重新编码，见 image_preprocess.py
+        self.preprocess = preprocess
         self.openai_client = OpenAI(
             api_key=self.api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+            base_url=BASE_URL,
         )
     
     def encode_image(self, image_path: str) -> str:
@@ -42,6 +43,10 @@ class Qwen25VLClient:
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode("utf-8")
     
+    def prepare_image(self, image_path: str, **options) -> PreparedImage:
+        """缩小并重新编码本地图像，返回的 PreparedImage 可用 to_original 把模型返回的坐标换算回原图"""
+        return prepare_image(image_path, **options)
+    
     def text_chat(self, 
                   message: str, 
                   model: str = "qwen-vl-max-latest",
@@ -63,15 +68,24 @@ class Qwen25VLClient:
                           image_url: str, 
                           text_prompt: str,
                           model: str = "qwen-vl-max-latest",
-                          is_local: bool = False) -> str:
-        """图像理解功能"""
+                          is_local: bool = False,
+                          prepared: Optional[PreparedImage] = None) -> str:
+        """
+        图像理解功能
+        本地图像默认先缩小并重新编码；需要换算坐标时先调用 prepare_image，再通过 prepared 传入
+        """
         try:
             if is_local:
-                # 本地图像需要Base64编码
-                base64_image = self.encode_image(image_url)
+                if prepared is None and self.preprocess:
+                    prepared = self.prepare_image(image_url)
+                if prepared is not None:
+                    url = prepared.data_url()
+                else:
+                    # 本地图像需要Base64编码
+                    url = f"data:image/png;base64,{self.encode_image(image_url)}"
                 image_content = {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{base64_image}"}
+                    "image_url": {"url": url}
                 }
             else:
                 # 网络图像直接使用URL
@@ -149,6 +163,30 @@ class Qwen25VLClient:
         except Exception as e:
             return f"视频理解出错: {str(e)}"
     
+    def local_video_understanding(self,
+                                  video_path: str,
+                                  text_prompt: str,
+                                  model: str = "qwen-vl-max-latest",
+                                  sample_fps: float = 1.0,
+                                  max_frames: int = 32) -> str:
+        """本地录像理解：按 sample_fps 抽帧，只把画面变化的帧（见 video_ingest.py）作为图像列表上传"""
+        try:
+            import cv2
+            from video_ingest import changed_frames
+
+            frames = []
+            for _, _, frame in changed_frames(video_path, sample_fps):
+                ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                if ok:
+                    frames.append(f"data:image/jpeg;base64,{base64.b64encode(buffer.tobytes()).decode('utf-8')}")
+                if len(frames) >= max_frames:
+                    break
+            if not frames:
+                return f"视频理解出错: 无法从 {video_path} 读取帧"
+            return self.video_understanding(frames, text_prompt, model, sample_fps)
+        except Exception as e:
+            return f"视频理解出错: {str(e)}"
+    
     def video_file_understanding(self, 
                                video_url: str, 
                                text_prompt: str,
@@ -178,8 +216,9 @@ class Qwen25VLClient:
     def stream_chat(self, 
                    message: str,
                    model: str = "qwen-vl-max-latest",
-                   system_prompt: str = "You are a helpful assistant."):
-        """流式对话"""
+                   system_prompt: str = "You are a helpful assistant.",
+                   echo: bool = True):
+        """流式对话，echo 为 True 时边收边打印；异步版本见 AsyncQwen25VLClient.stream_chat"""
         try:
             stream = self.openai_client.chat.completions.create(
                 model=model,
@@ -190,15 +229,18 @@ class Qwen25VLClient:
                 stream=True
             )
             
-            print("流式输出：")
-            full_content = ""
+            if echo:
+                print("流式输出：")
+            pieces = []
             for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
+                if chunk.choices and chunk.choices[0].delta.content is not None:
                     content = chunk.choices[0].delta.content
-                    print(content, end="", flush=True)
-                    full_content += content
-            print("\n")
-            return full_content
+                    if echo:
+                        print(content, end="", flush=True)
+                    pieces.append(content)
+            if echo:
+                print("\n")
+            return "".join(pieces)
         except Exception as e:
             return f"流式对话出错: {str(e)}"
     
@@ -329,10 +371,13 @@ def demo_with_local_image():
     
     if os.path.exists(local_image_path):
         print(f"\n本地图像分析示例（{local_image_path}）：")
+        prepared = client.prepare_image(local_image_path)
+        print(f"预处理：{prepared.report()}")
         response = client.image_understanding(
             local_image_path,
             "请分析这张图片，描述其中的内容。",
-            is_local=True
+            is_local=True,
+            prepared=prepared
         )
         print(f"本地图像分析：{response}")
     else:
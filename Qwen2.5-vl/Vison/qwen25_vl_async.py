@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Qwen2.5-VL 异步客户端
+方法与 qwen25_vl_api.Qwen25VLClient 相同，可以在并发服务中使用：
+所有请求共用一个 httpx 连接池，信号量限制同时进行的请求数；
+按 RetryPolicy 重试限流、超时、连接错误和 5xx（指数退避加抖动，优先使用 Retry-After），按 TimeoutPolicy 设置超时；
+失败时抛出 VLError 的子类，不返回错误字符串；stream_chat 是异步生成器
+analyze_images / iter_analyze_images 并发分析大量图片，同时进行的任务数有上限，本地图片在线程中预处理
+用法：
+    async with AsyncQwen25VLClient(max_concurrency=8) as client:
+        text = await client.text_chat("你好")
+        async for piece in client.stream_chat("写一首诗"):
+            print(piece, end="")
+        results = await client.analyze_images(paths, "描述图片", is_local=True)
+
+    python qwen25_vl_async.py --mock     # 使用 mock_vl_server.py 离线运行示例
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import random
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+import httpx
+from openai import (APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, AuthenticationError,
+                    DefaultAsyncHttpxClient, PermissionDeniedError, RateLimitError)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from image_preprocess import PreparedImage, prepare_image
+
+BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+DEFAULT_MODEL = "qwen-vl-max-latest"
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
+# 同时进行的请求数
+MAX_CONCURRENCY = 8
+# 连接池中空闲连接保持的秒数，连接在请求之间复用
+KEEPALIVE_EXPIRY = 30.0
+# 重试：最多重试次数，退避时间 BACKOFF_BASE * 2^重试次数，加随机抖动，不超过 BACKOFF_MAX 秒
+MAX_RETRIES = 3
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# 超时（秒）：建立连接、两次读取之间、单次请求、包括重试在内的总时间
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 60.0
+REQUEST_TIMEOUT = 120.0
+TOTAL_TIMEOUT = 300.0
+
+
+class VLError(Exception):
+    """Qwen2.5-VL 请求失败；retryable 表示按 RetryPolicy 可以重试的错误"""
+
+    retryable = False
+
+    def __init__(self, message: str, status_code: Optional[int] = None, request_id: Optional[str] = None,
+                 attempts: int = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.request_id = request_id
+        self.attempts = attempts
+
+
+class VLConfigError(VLError, ValueError):
+    """配置错误，例如没有设置 DASHSCOPE_API_KEY"""
+
+
+class VLAuthenticationError(VLError):
+    """API key 无效或没有权限（401 / 403）"""
+
+
+class VLBadRequestError(VLError):
+    """请求内容有误（400 / 404 / 422 等），重试不会成功"""
+
+
+class VLRateLimitError(VLError):
+    """限流（429），retry_after 为服务端建议的等待秒数"""
+
+    retryable = True
+
+    def __init__(self, message: str, retry_after: Optional[float] = None, **kwargs):
+        super().__init__(message, **kwargs)
+        self.retry_after = retry_after
+
+
+class VLTimeoutError(VLError):
+    """请求超时"""
+
+    retryable = True
+
+
+class VLConnectionError(VLError):
+    """无法连接服务端或连接中断"""
+
+    retryable = True
+
+
+class VLServerError(VLError):
+    """服务端错误（5xx）"""
+
+    retryable = True
+
+
+class VLResponseError(VLError):
+    """服务端返回了成功状态，但回复中没有内容"""
+
+
+def _retry_after(response) -> Optional[float]:
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def translate_error(error: BaseException, attempts: int = 1) -> VLError:
+    """把 openai / httpx / asyncio 的异常转换为对应的 VLError"""
+    if isinstance(error, VLError):
+        error.attempts = attempts
+        return error
+    message = str(error) or type(error).__name__
+    if isinstance(error, (APITimeoutError, asyncio.TimeoutError, httpx.TimeoutException)):
+        return VLTimeoutError(message, attempts=attempts)
+    if isinstance(error, (APIConnectionError, httpx.TransportError)):
+        return VLConnectionError(message, attempts=attempts)
+    if isinstance(error, APIStatusError):
+        fields = {"status_code": error.status_code, "request_id": error.request_id, "attempts": attempts}
+        if isinstance(error, RateLimitError):
+            return VLRateLimitError(message, retry_after=_retry_after(error.response), **fields)
+        if isinstance(error, (AuthenticationError, PermissionDeniedError)):
+            return VLAuthenticationError(message, **fields)
+        if error.status_code >= 500:
+            return VLServerError(message, **fields)
+        return VLBadRequestError(message, **fields)
+    return VLError(message, attempts=attempts)
+
+
+class RetryPolicy:
+    """
+    重试策略
+    参数说明：
+        max_retries: 最多重试次数，0 表示不重试
+        backoff_base / backoff_max: 退避时间 backoff_base * 2^重试次数，加抖动，不超过 backoff_max 秒
+        retry_on: 需要重试的错误类型，默认是 retryable 为 True 的错误
+    """
+
+    def __init__(self, max_retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE,
+                 backoff_max: float = BACKOFF_MAX, retry_on: Optional[Tuple[type, ...]] = None):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_on = retry_on
+
+    def should_retry(self, error: VLError, attempt: int) -> bool:
+        """attempt 为已经重试的次数"""
+        if attempt >= self.max_retries:
+            return False
+        return isinstance(error, self.retry_on) if self.retry_on else error.retryable
+
+    def delay(self, error: VLError, attempt: int) -> float:
+        """优先使用服务端返回的 Retry-After，否则指数退避加抖动"""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return min(self.backoff_base * 2 ** attempt, self.backoff_max) * random.uniform(0.5, 1.0)
+
+
+class TimeoutPolicy:
+    """
+    超时策略（秒）
+    参数说明：
+        connect: 建立连接
+        read: 两次读取之间，流式回复中两块之间的间隔也受它限制
+        request: 单次请求从发出到收到完整回复（流式请求为收到回复头）
+        total: 包括重试和退避等待在内的总时间，剩余时间不够下一次退避时不再重试
+    """
+
+    def __init__(self, connect: float = CONNECT_TIMEOUT, read: float = READ_TIMEOUT,
+                 request: float = REQUEST_TIMEOUT, total: float = TOTAL_TIMEOUT):
+        self.connect = connect
+        self.read = read
+        self.request = request
+        self.total = total
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.request, connect=self.connect, read=self.read)
+
+
+class AsyncQwen25VLClient:
+    """
+    Qwen2.5-VL 异步客户端，一个事件循环中共用一个实例
+    参数说明：
+        max_concurrency: 同时进行的请求数（退避等待不占用名额）
+        max_connections: 连接池大小，默认等于 max_concurrency
+        http_client: 外部传入的 httpx.AsyncClient，多个客户端共用同一个连接池时使用，由调用方关闭
+        preprocess: 本地图片上传前是否缩小并重新编码，见 image_preprocess.py
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: str = BASE_URL,
+                 max_concurrency: int = MAX_CONCURRENCY, max_connections: Optional[int] = None,
+                 retry: Optional[RetryPolicy] = None, timeout: Optional[TimeoutPolicy] = None,
+                 http_client: Optional[httpx.AsyncClient] = None, preprocess: bool = True):
+        self.api_key = api_key or os.getenv("DASHSCOPE_API_KEY")
+        if not self.api_key:
+            raise VLConfigError("请设置环境变量 DASHSCOPE_API_KEY 或传入 api_key")
+        self.retry = retry or RetryPolicy()
+        self.timeout = timeout or TimeoutPolicy()
+        self.preprocess = preprocess
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._owns_http_client = http_client is None
+        if http_client is None:
+            connections = max_connections or max_concurrency
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections,
+                                    keepalive_expiry=KEEPALIVE_EXPIRY),
+                timeout=self.timeout.httpx_timeout(),
+            )
+        self.http_client = http_client
+        # 重试由 RetryPolicy 统一处理，关闭 SDK 自带的重试，避免重试次数叠加
+        self.openai_client = AsyncOpenAI(api_key=self.api_key, base_url=base_url, max_retries=0,
+                                         timeout=self.timeout.httpx_timeout(), http_client=http_client)
+        self._counters = {"requests": 0, "retries": 0, "errors": 0}
+
+    async def __aenter__(self) -> "AsyncQwen25VLClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._owns_http_client:
+            await self.http_client.aclose()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._counters)
+
+    def report(self) -> None:
+        s = self.stats()
+        print(f"请求 {s['requests']} 次，重试 {s['retries']} 次，失败 {s['errors']} 次")
+
+    def _retry_delay(self, error: VLError, attempt: int, deadline: float) -> Optional[float]:
+        """可以重试时返回退避秒数；不可重试、次数用完或剩余时间不够时返回 None"""
+        if not self.retry.should_retry(error, attempt):
+            return None
+        delay = self.retry.delay(error, attempt)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    async def _complete(self, messages: List[Dict[str, Any]], model: str, **options) -> str:
+        """发送请求，按策略限并发、超时和重试，返回回复文本"""
+        deadline = time.monotonic() + self.timeout.total
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    self._counters["requests"] += 1
+                    remaining = max(0.0, deadline - time.monotonic())
+                    completion = await asyncio.wait_for(
+                        self.openai_client.chat.completions.create(model=model, messages=messages, **options),
+                        min(self.timeout.request, remaining),
+                    )
+                if not completion.choices or completion.choices[0].message.content is None:
+                    raise VLResponseError("回复中没有内容", request_id=getattr(completion, "id", None))
+                return completion.choices[0].message.content
+            except Exception as e:
+                error = translate_error(e, attempt + 1)
+                delay = self._retry_delay(error, attempt, deadline)
+                if delay is None:
+                    self._counters["errors"] += 1
+                    raise error from (e if e is not error else None)
+            self._counters["retries"] += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _image_url(self, image_url: str, is_local: bool, prepared: Optional[PreparedImage]) -> str:
+        if not is_local:
+            return image_url
+        if prepared is None and self.preprocess:
+            # 缩放和编码是 CPU 密集操作，放到线程中，不阻塞事件循环
+            prepared = await asyncio.to_thread(prepare_image, image_url)
+        if prepared is not None:
+            return prepared.data_url()
+        data = await asyncio.to_thread(_read_file, image_url)
+        return f"data:image/png;base64,{base64.b64encode(data).decode('utf-8')}"
+
+    async def prepare_image(self, image_path: str, **options) -> PreparedImage:
+        """缩小并重新编码本地图像，返回的 PreparedImage 可用 to_original 把模型返回的坐标换算回原图"""
+        return await asyncio.to_thread(prepare_image, image_path, **options)
+
+    async def text_chat(self,
+                        message: str,
+                        model: str = DEFAULT_MODEL,
+                        system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> str:
+        """纯文本对话"""
+        return await self._complete([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": message}
+        ], model)
+
+    async def image_understanding(self,
+                                  image_url: str,
+                                  text_prompt: str,
+                                  model: str = DEFAULT_MODEL,
+                                  is_local: bool = False,
+                                  prepared: Optional[PreparedImage] = None) -> str:
+        """
+        图像理解功能
+        本地图像默认先缩小并重新编码；需要换算坐标时先调用 prepare_image，再通过 prepared 传入
+        """
+        url = await self._image_url(image_url, is_local, prepared)
+        return await self._complete([{
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": url}},
+                {"type": "text", "text": text_prompt}
+            ]
+        }], model)
+
+    async def multi_image_analysis(self,
+                                   image_urls: List[str],
+                                   text_prompt: str,
+                                   model: str = DEFAULT_MODEL) -> str:
+        """多图像分析"""
+        content = [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]
+        content.append({"type": "text", "text": text_prompt})
+        return await self._complete([{"role": "user", "content": content}], model)
+
+    async def video_understanding(self,
+                                  video_frames: List[str],
+                                  text_prompt: str,
+                                  model: str = DEFAULT_MODEL,
+                                  fps: float = 2.0) -> str:
+        """视频理解（通过图像列表）"""
+        return await self._complete([{
+            "role": "user",
+            "content": [
+                {"type": "video", "video": video_frames},
+                {"type": "text", "text": text_prompt}
+            ]
+        }], model)
+
+    async def video_file_understanding(self,
+                                       video_url: str,
+                                       text_prompt: str,
+                                       model: str = DEFAULT_MODEL) -> str:
+        """视频文件理解"""
+        return await self._complete([{
+            "role": "user",
+            "content": [
+                {"type": "video_url", "video_url": {"url": video_url}},
+                {"type": "text", "text": text_prompt}
+            ]
+        }], model)
+
+    async def multi_turn_conversation(self,
+                                      conversations: List[Dict[str, Any]],
+                                      model: str = DEFAULT_MODEL) -> str:
+        """多轮对话，conversations 中每条消息的 content 可以是文本或多模态列表"""
+        messages = [{"role": conv.get("role", "user"), "content": conv.get("content")} for conv in conversations]
+        return await self._complete(messages, model)
+
+    async def stream_chat(self,
+                          message: str,
+                          model: str = DEFAULT_MODEL,
+                          system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> AsyncIterator[str]:
+        """
+        流式对话，逐块生成回复文本，需要完整回复时由调用方 "".join
+        还没有收到任何内容时按策略重试；已经输出部分内容后出错直接抛出，避免重复输出
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": message}
+        ]
+        deadline = time.monotonic() + self.timeout.total
+        attempt = 0
+        while True:
+            received = False
+            try:
+                async with self._semaphore:
+                    self._counters["requests"] += 1
+                    remaining = max(0.0, deadline - time.monotonic())
+                    stream = await asyncio.wait_for(
+                        self.openai_client.chat.completions.create(model=model, messages=messages, stream=True),
+                        min(self.timeout.request, remaining),
+                    )
+                    try:
+                        async for chunk in stream:
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                received = True
+                                yield chunk.choices[0].delta.content
+                    finally:
+                        await stream.close()
+                return
+            except Exception as e:
+                error = translate_error(e, attempt + 1)
+                delay = None if received else self._retry_delay(error, attempt, deadline)
+                if delay is None:
+                    self._counters["errors"] += 1
+                    raise error from (e if e is not error else None)
+            self._counters["retries"] += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def iter_analyze_images(self,
+                                  images: Iterable[str],
+                                  text_prompt: str,
+                                  model: str = DEFAULT_MODEL,
+                                  is_local: bool = False) -> AsyncIterator[Tuple[int, str, Union[str, VLError]]]:
+        """
+        并发分析多张图片，按完成顺序生成 (序号, 图片, 回复文本或 VLError)
+        images 可以是生成器，按需取用；同时处理的图片不超过 max_concurrency 张，
+        本地图片的预处理结果不会大量堆积在内存中
+        """
+        iterator = enumerate(images)
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            for index, image in iterator:
+                try:
+                    result = await self.image_understanding(image, text_prompt, model, is_local)
+                except (VLError, OSError, ValueError) as e:
+                    # 单张图片失败不影响其他图片；本地图片无法读取时为 OSError / ValueError
+                    result = e if isinstance(e, VLError) else VLBadRequestError(f"{image}: {e}")
+                await queue.put((index, image, result))
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_concurrency)]
+        done = asyncio.gather(*workers)
+        try:
+            while True:
+                if not queue.empty():
+                    yield queue.get_nowait()
+                    continue
+                if done.done():
+                    break
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait([getter, done], return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            # 工作任务中未预料的异常在这里抛出
+            await done
+        finally:
+            # 调用方提前退出循环时取消工作任务，并取回 gather 的结果，避免 "exception was never retrieved"
+            done.cancel()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(done, *workers, return_exceptions=True)
+
+    async def analyze_images(self,
+                             images: Iterable[str],
+                             text_prompt: str,
+                             model: str = DEFAULT_MODEL,
+                             is_local: bool = False) -> List[Union[str, VLError]]:
+        """并发分析多张图片，按输入顺序返回回复文本；失败的图片对应位置为 VLError"""
+        results: Dict[int, Union[str, VLError]] = {}
+        async for index, _, result in self.iter_analyze_images(images, text_prompt, model, is_local):
+            results[index] = result
+        return [results[i] for i in range(len(results))]
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def demo(base_url: str, images: List[str]) -> None:
+    """示例：文本、流式和批量图片分析"""
+    async with AsyncQwen25VLClient(base_url=base_url, max_concurrency=4) as client:
+        print("1. 纯文本对话：")
+        print(await client.text_chat("你好，请介绍一下Qwen2.5-VL模型的主要功能。"))
+
+        print("\n2. 流式输出：")
+        pieces = []
+        async for piece in client.stream_chat("请写一首关于人工智能的七言律诗。"):
+            print(piece, end="", flush=True)
+            pieces.append(piece)
+        print(f"\n（共 {len(''.join(pieces))} 字）")
+
+        if images:
+            print(f"\n3. 并发分析 {len(images)} 张本地图片：")
+            start = time.perf_counter()
+            async for index, image, result in client.iter_analyze_images(images, "请描述这张图片。", is_local=True):
+                status = f"出错（{type(result).__name__}）: {result}" if isinstance(result, VLError) else result
+                print(f"  {os.path.basename(image)}: {status}")
+            print(f"耗时 {time.perf_counter() - start:.2f} 秒")
+        client.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Qwen2.5-VL 异步客户端示例")
+    parser.add_argument("images", nargs="*", help="本地图片，并发分析")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--mock", action="store_true", help="启动本地模拟服务（mock_vl_server.py）代替 DashScope")
+    args = parser.parse_args(argv)
+
+    if not args.mock:
+        asyncio.run(demo(args.base_url, args.images))
+        return
+    from mock_vl_server import MockVLServer
+
+    os.environ.setdefault("DASHSCOPE_API_KEY", "mock")
+    with MockVLServer(delay=0.2, fail_every=3, retry_after=0.1) as server:
+        asyncio.run(demo(server.base_url, args.images))
+        s = server.stats()
+        print(f"模拟服务：收到 {s['requests']} 个请求，注入故障 {s['failures']} 次，"
+              f"最多同时处理 {s['max_in_flight']} 个")
+
+
+if __name__ == "__main__":
+    main()
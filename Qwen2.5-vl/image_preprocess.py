@@ -0,0 +1,210 @@
+# image_preprocess.py
+"""
+上传前的图片预处理
+监控相机的原图分辨率高、文件大，直接 base64 上传时请求体大、上传慢，模型侧的视觉 token 也多；
+这里按最长边和像素预算缩小图片（边长对齐到 28 的倍数，与 Qwen2.5-VL 的 patch 大小一致，服务端不再二次缩放），
+再按指定质量重新编码为 JPEG，并记录缩放比例：
+模型返回的“坐标”基于上传的图片，用 to_original / map_boxes_to_original 换算回原图像素后再画框
+用法：
+    python image_preprocess.py images/ --max-side 1344 --quality 85
+"""
+import argparse
+import base64
+import io
+import math
+import os
+
+from PIL import Image, ImageOps
+
+# Qwen2.5-VL 每个视觉 token 对应 28x28 像素
+PATCH_SIZE = 28
+# 服务端缩放时的像素上下限（DashScope 默认最多 1280 个视觉 token）
+MODEL_MIN_PIXELS = 4 * PATCH_SIZE * PATCH_SIZE
+MODEL_MAX_PIXELS = 1280 * PATCH_SIZE * PATCH_SIZE
+# 上传前缩小后的最长边和像素预算
+MAX_SIDE = 1344
+MAX_PIXELS = 768 * PATCH_SIZE * PATCH_SIZE
+# 重新编码的 JPEG 质量
+JPEG_QUALITY = 85
+
+
+def smart_resize(width, height, factor=PATCH_SIZE, min_pixels=MODEL_MIN_PIXELS, max_pixels=MODEL_MAX_PIXELS):
+    """按 Qwen2.5-VL 的规则计算缩放后的尺寸：边长为 factor 的倍数，总像素在 [min_pixels, max_pixels] 内"""
+    w = max(factor, round(width / factor) * factor)
+    h = max(factor, round(height / factor) * factor)
+    if w * h > max_pixels:
+        beta = math.sqrt(width * height / max_pixels)
+        w = max(factor, math.floor(width / beta / factor) * factor)
+        h = max(factor, math.floor(height / beta / factor) * factor)
+    elif w * h < min_pixels:
+        beta = math.sqrt(min_pixels / (width * height))
+        w = math.ceil(width * beta / factor) * factor
+        h = math.ceil(height * beta / factor) * factor
+    return w, h
+
+
+def estimate_visual_tokens(width, height):
+    """估算模型对该尺寸图片使用的视觉 token 数（含图片起止标记）"""
+    w, h = smart_resize(width, height)
+    return w * h // (PATCH_SIZE * PATCH_SIZE) + 2
+
+
+def target_size(width, height, max_side=MAX_SIDE, max_pixels=MAX_PIXELS):
+    """不超过最长边和像素预算的尺寸，边长对齐到 PATCH_SIZE；原图已经足够小时只做对齐"""
+    scale = min(1.0, max_side / max(width, height), math.sqrt(max_pixels / (width * height)))
+    return smart_resize(width * scale, height * scale, max_pixels=max_pixels)
+
+
+class PreparedImage:
+    """预处理后的图片及其与原图的对应关系"""
+
+    def __init__(self, data, mime, width, height, orig_width, orig_height, orig_bytes):
+        self.data = data
+        self.mime = mime
+        self.width = width
+        self.height = height
+        self.orig_width = orig_width
+        self.orig_height = orig_height
+        self.orig_bytes = orig_bytes
+        # 上传图片坐标乘以该比例得到原图坐标
+        self.scale_x = orig_width / width
+        self.scale_y = orig_height / height
+
+    @property
+    def scale(self):
+        return self.scale_x, self.scale_y
+
+    def data_url(self):
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+    def to_original(self, box):
+        """把上传图片上的 [x1, y1, x2, y2] 换算为原图像素，并限制在原图范围内"""
+        return scale_box(box, self.scale, self.orig_width, self.orig_height)
+
+    def stats(self):
+        orig_tokens = estimate_visual_tokens(self.orig_width, self.orig_height)
+        tokens = estimate_visual_tokens(self.width, self.height)
+        return {
+            "orig_size": [self.orig_width, self.orig_height],
+            "size": [self.width, self.height],
+            "orig_bytes": self.orig_bytes,
+            "bytes": len(self.data),
+            "bytes_saved": self.orig_bytes - len(self.data),
+            "orig_tokens": orig_tokens,
+            "tokens": tokens,
+            "tokens_saved": orig_tokens - tokens,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"{s['orig_size'][0]}x{s['orig_size'][1]} -> {s['size'][0]}x{s['size'][1]}，"
+                f"字节 {s['orig_bytes']} -> {s['bytes']}（节省 {s['bytes_saved']}），"
+                f"视觉 token {s['orig_tokens']} -> {s['tokens']}（节省 {s['tokens_saved']}）")
+
+
+def scale_box(box, scale, width=None, height=None):
+    """按 (scale_x, scale_y) 缩放一个框，给出 width / height 时限制在图片范围内"""
+    sx, sy = scale
+    x1, y1, x2, y2 = box
+    out = [round(x1 * sx), round(y1 * sy), round(x2 * sx), round(y2 * sy)]
+    if width is not None and height is not None:
+        out = [min(max(out[0], 0), width), min(max(out[1], 0), height),
+               min(max(out[2], 0), width), min(max(out[3], 0), height)]
+    return out
+
+
+def map_boxes(result, scale, width=None, height=None):
+    """
+    把分析结果中 required_signs 和 contaminants 的“坐标”按 scale 换算，返回新的结果，原结果不变
+    状态不是“存在”或坐标格式不对的项目原样保留
+    """
+    if not isinstance(result, dict):
+        return result
+    mapped = dict(result)
+
+    def convert(item):
+        coords = item.get('坐标') if isinstance(item, dict) else None
+        if isinstance(coords, (list, tuple)) and len(coords) == 4 and all(isinstance(v, (int, float)) for v in coords):
+            item = dict(item)
+            item['坐标'] = scale_box(coords, scale, width, height)
+        return item
+
+    if isinstance(result.get('required_signs'), dict):
+        mapped['required_signs'] = {name: convert(info) for name, info in result['required_signs'].items()}
+    if isinstance(result.get('contaminants'), list):
+        mapped['contaminants'] = [convert(item) for item in result['contaminants']]
+    return mapped
+
+
+def map_boxes_to_original(result, prepared):
+    """把基于上传图片的坐标换算为原图像素"""
+    return map_boxes(result, prepared.scale, prepared.orig_width, prepared.orig_height)
+
+
+def original_size(image_path):
+    """按 EXIF 方向摆正后的原图尺寸 (宽, 高)，只读取文件头"""
+    with Image.open(image_path) as image:
+        width, height = image.size
+        # EXIF 方向 5~8 表示旋转了 90 度
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+
+def prepare_image(image_path, max_side=MAX_SIDE, max_pixels=MAX_PIXELS, quality=JPEG_QUALITY):
+    """
+    缩小并重新编码图片
+    参数说明：
+        max_side: 最长边上限（像素）
+        max_pixels: 总像素上限
+        quality: JPEG 质量
+    """
+    with open(image_path, 'rb') as f:
+        raw = f.read()
+    with Image.open(io.BytesIO(raw)) as image:
+        # 按 EXIF 方向摆正，与 cv2.imread 读到的原图方向一致，坐标才能对上
+        image = ImageOps.exif_transpose(image)
+        orig_width, orig_height = image.size
+        width, height = target_size(orig_width, orig_height, max_side, max_pixels)
+        if (width, height) != image.size:
+            image = image.resize((width, height), Image.LANCZOS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    data = buffer.getvalue()
+    if len(data) >= len(raw) and (width, height) == (orig_width, orig_height) and raw[:2] == b'\xff\xd8':
+        # 原图已经足够小且重新编码没有变小时直接上传原文件
+        data = raw
+    return PreparedImage(data, 'image/jpeg', width, height, orig_width, orig_height, len(raw))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="图片预处理效果统计")
+    parser.add_argument("paths", nargs="+", help="图片文件或目录")
+    parser.add_argument("--max-side", type=int, default=MAX_SIDE)
+    parser.add_argument("--max-pixels", type=int, default=MAX_PIXELS)
+    parser.add_argument("--quality", type=int, default=JPEG_QUALITY)
+    args = parser.parse_args(argv)
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path))
+                         if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        else:
+            files.append(path)
+    total = {"orig_bytes": 0, "bytes": 0, "orig_tokens": 0, "tokens": 0}
+    for path in files:
+        prepared = prepare_image(path, args.max_side, args.max_pixels, args.quality)
+        print(f"{os.path.basename(path)}: {prepared.report()}")
+        for key, value in prepared.stats().items():
+            if key in total:
+                total[key] += value
+    if files:
+        print(f"合计 {len(files)} 张：字节 {total['orig_bytes']} -> {total['bytes']}，"
+              f"视觉 token {total['orig_tokens']} -> {total['tokens']}")
+
+
+if __name__ == "__main__":
+    main()
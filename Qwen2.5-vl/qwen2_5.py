@@ -1,16 +1,55 @@
-from openai import OpenAI
+# qwen2_5.py
+"""
+电梯轿厢照片批量分析
+多个线程并发调用 DashScope 上的 Qwen2.5-VL，客户端限速（每分钟请求数）以免超出账号配额；
+遇到限流（429）、超时、连接错误和 5xx 时按指数退避重试；
+每张图片一条结构化记录，写入 result_store.py 的 JSONL + SQLite，中断后重新运行会跳过已有结果的图片；
+上传前按 image_preprocess.py 缩小并重新编码图片，结果中的坐标已换算回原图像素；
+与之前分析过的画面感知哈希足够接近时直接使用 result_cache.py 中缓存的结果，不请求模型；
+也可以直接分析录像，由 video_ingest.py 流式抽帧，只有画面变化的帧才请求模型
+用法：
+    export DASHSCOPE_API_KEY=sk-...
+    python qwen2_5.py --input 轿厢照片 --output results --workers 8 --rpm 60
+    python qwen2_5.py --video 录像/ --sample-fps 1 --output results      # 录像只分析画面变化的帧
+    python result_store.py query results --status 不干净
+"""
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import argparse
 import os
 import json
 import base64
+import hashlib
+import random
+import threading
+import time
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+from image_preprocess import (JPEG_QUALITY, MAX_PIXELS, MAX_SIDE, map_boxes, map_boxes_to_original, original_size,
+                              prepare_image)
+from result_cache import HASH_THRESHOLD, RESULT_CACHE_PATH, ResultCache, context_hash, perceptual_hash
+from result_store import ResultStore
 
-def analyze_elevator_image(client, image_path):
-    base64_image = encode_image(image_path)
-    
-    system_prompt = """这是一个电梯监控画面，请你仔细分析图中内容：
+BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+DEFAULT_MODEL = "qwen2.5-vl-32b-instruct"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# 并发请求数
+DEFAULT_WORKERS = 8
+# 每分钟最多发出的请求数，按账号的 DashScope 限流配额设置
+DEFAULT_RPM = 60
+# 每个线程排队的任务数上限，逐帧产生图片的录像模式不会一次提交全部任务
+QUEUE_PER_WORKER = 4
+# 单张图片的最大重试次数
+MAX_RETRIES = 5
+# 退避时间：BACKOFF_BASE * 2^重试次数，加随机抖动，不超过 BACKOFF_MAX 秒
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 60.0
+# 单次请求超时（秒）
+REQUEST_TIMEOUT = 120.0
+# 可以重试的错误：限流、超时、连接失败、服务端错误
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+# 系统提示词和用户提示词；修改后结果缓存自动失效
+SYSTEM_PROMPT = """这是一个电梯监控画面，请你仔细分析图中内容：
 
 观察有特种设备使用标志 和乘用电梯安全注意事项吗？
 
@@ -51,25 +90,38 @@ def analyze_elevator_image(client, image_path):
 状态：只有特种设备使用标志和电梯安全注意事项标识牌且同时存在，干净，否则不干净。
 
 """
+USER_PROMPT = "这是一个电梯监控画面，请按照要求分析并输出JSON格式的结果"
+
+def encode_image(image_path):
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+def analyze_elevator_image(client, image_path, model=DEFAULT_MODEL, image=None):
+    return request_analysis(client, image_path, model, image).choices[0].message.content
+
+def request_analysis(client, image_path, model=DEFAULT_MODEL, image=None):
+    """返回完整的 ChatCompletion，包含 token 用量"""
+    # image 为预处理后的 PreparedImage，未提供时上传原图
+    image_url = image.data_url() if image is not None else f"data:image/jpeg;base64,{encode_image(image_path)}"
     
     response = client.chat.completions.create(
-        model="qwen2.5-vl-32b-instruct",
+        model=model,
         messages=[
             {
                 "role": "system",
-                "content": system_prompt
+                "content": SYSTEM_PROMPT
             },
             {
                 "role": "user",
                 "content": [
                     {
                         "type": "text",
-                        "text": "这是一个电梯监控画面，请按照要求分析并输出JSON格式的结果"
+                        "text": USER_PROMPT
                     },
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
+                            "url": image_url
                         }
                     }
                 ]
@@ -78,43 +130,304 @@ def analyze_elevator_image(client, image_path):
         response_format={"type": "json_object"}
     )
     
-    return response.choices[0].message.content
+    return response
 
-def process_images():
-    client = OpenAI(
-        api_key="sk-52918409d9904c8699a5e0765371cf22",
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-    
-    os.makedirs('32bresults', exist_ok=True)
-    
-    with open('results/result-v3.txt', 'w', encoding='utf-8') as result_file:
-        for filename in os.listdir(r'C:\Users\zhupailiang\Desktop\电梯\轿厢照片'):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                image_path = os.path.join(r'C:\Users\zhupailiang\Desktop\电梯\轿厢照片', filename)
-                
-                try:
-                    print(f"Processing {filename}...")
-                    response = analyze_elevator_image(client, image_path)
-                    
-                    try:
-                        json_response = json.loads(response)
-                        formatted_response = json.dumps(json_response, ensure_ascii=False, indent=2)
-                    except json.JSONDecodeError:
-                        formatted_response = f"Invalid JSON response:\n{response}"
-                    
-                    result_file.write(f"图片: {filename}\n分析结果:\n{formatted_response}\n\n")
-                    print(f"Successfully processed {filename}")
-                    
-                except Exception as e:
-                    error_msg = f"处理图片 {filename} 时出错: {str(e)}"
-                    result_file.write(f"{error_msg}\n\n")
-                    print(error_msg)
+class RateLimiter:
+    """令牌桶限速，多个线程共用；令牌不足时阻塞到下一个令牌产生"""
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.interval = 60.0 / rate_per_minute
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.interval
+            time.sleep(wait)
+
+
+def retry_delay(error, attempt):
+    """优先使用服务端返回的 Retry-After，否则指数退避加抖动"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+
+def analyze_with_retry(client, image_path, model, limiter, max_retries=MAX_RETRIES, image=None):
+    """
+    限速后调用模型，可重试的错误按退避时间等待后重试，超过次数后抛出最后一次的错误
+    :return: (ChatCompletion, 成功那次请求的耗时秒数, 请求次数)
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            start = time.perf_counter()
+            completion = request_analysis(client, image_path, model, image)
+            return completion, time.perf_counter() - start, attempt + 1
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = retry_delay(e, attempt)
+            print(f"{os.path.basename(image_path)} 请求失败（{type(e).__name__}），{delay:.1f} 秒后第 {attempt + 1} 次重试")
+            time.sleep(delay)
+
+
+def to_original_pixels(response, image):
+    """模型返回的坐标基于上传的缩小图，换算回原图像素，draw_boxes 直接使用；不是合法 JSON 时原样返回"""
+    if image is None:
+        return response
+    try:
+        return json.dumps(map_boxes_to_original(json.loads(response), image), ensure_ascii=False)
+    except json.JSONDecodeError:
+        return response
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def analyze_file(client, image_path, model, limiter, max_retries=MAX_RETRIES, preprocess=None, cache=None):
+    """
+    在工作线程中预处理并分析一张图片，预处理只做一次，重试时复用
+    :param preprocess: prepare_image 的参数，None 时上传原图
+    :param cache: ResultCache，画面与已分析过的图片足够接近时直接返回缓存的结果
+    :return: 写入 ResultStore 的记录，response 为坐标已换算到原图像素的回复文本
+    """
+    width, height = original_size(image_path)
+    # 保存绝对路径，draw_boxes 等下游工具在其他目录下运行时也能找到原图
+    record = {"image": os.path.abspath(image_path), "sha256": file_sha256(image_path), "model": model,
+              "width": width, "height": height}
+    if cache is not None:
+        phash = perceptual_hash(image_path)
+        record["phash"] = f"{phash:016x}"
+        # 提示词、模型或预处理参数变化后旧结果不再命中
+        context = context_hash(SYSTEM_PROMPT, USER_PROMPT, model, json.dumps(preprocess, sort_keys=True))
+        hit = cache.lookup(phash, context)
+        if hit is not None:
+            result = hit["result"]
+            if hit["width"] and hit["height"] and (hit["width"], hit["height"]) != (width, height):
+                # 同一画面不同分辨率，坐标按尺寸比例换算
+                result = map_boxes(result, (width / hit["width"], height / hit["height"]), width, height)
+            return {**record, "response": json.dumps(result, ensure_ascii=False), "cached": True,
+                    "cache_distance": hit["distance"]}
+
+    image = prepare_image(image_path, **preprocess) if preprocess is not None else None
+    completion, latency, attempts = analyze_with_retry(client, image_path, model, limiter, max_retries, image)
+    response = to_original_pixels(completion.choices[0].message.content, image)
+    usage = completion.usage
+    record.update(response=response, latency=round(latency, 3), attempts=attempts,
+                  prompt_tokens=getattr(usage, "prompt_tokens", None),
+                  completion_tokens=getattr(usage, "completion_tokens", None))
+    if image is not None:
+        record["preprocess"] = image.stats()
+    if cache is not None:
+        try:
+            cache.store(phash, context, json.loads(response), width, height)
+        except json.JSONDecodeError:
+            # 格式错误的回复不缓存，下次重新请求
+            pass
+    return record
+
+
+def create_client():
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        raise SystemExit("请设置环境变量 DASHSCOPE_API_KEY")
+    # 重试由 analyze_with_retry 统一处理，关闭 SDK 自带的重试，避免重试次数叠加
+    return OpenAI(api_key=api_key, base_url=BASE_URL, max_retries=0, timeout=REQUEST_TIMEOUT)
+
+
+def run_batch(client, store, items, total, model=DEFAULT_MODEL, workers=DEFAULT_WORKERS, rpm=DEFAULT_RPM,
+              max_retries=MAX_RETRIES, preprocess=None, cache=None):
+    """
+    并发分析 items 中的图片并写入 store
+    参数说明：
+        items: 可迭代的 (图片路径, 附加字段)，可以是生成器；附加字段合并进记录
+        total: 待处理数量，仅用于显示进度，未知时为 None
+    同时提交的任务不超过 workers * QUEUE_PER_WORKER 个，items 是生成器时按需取用，不会一次全部读入
+    """
+    limiter = RateLimiter(rpm, burst=min(workers, rpm))
+    counts = {"succeeded": 0, "failed": 0, "cached": 0}
+    saved = {"orig_bytes": 0, "bytes": 0, "orig_tokens": 0, "tokens": 0}
+
+    def collect(future, image_path, fields):
+        # 记录在主线程中按完成顺序写入，存储不需要加锁
+        filename = os.path.basename(image_path)
+        try:
+            record = store.append({**future.result(), **fields})
+        except Exception as e:
+            counts["failed"] += 1
+            store.append_error(os.path.abspath(image_path), model, str(e), **fields)
+            print(f"处理图片 {filename} 时出错: {str(e)}")
+            return
+        counts["succeeded"] += 1
+        if record["outcome"] == "cached":
+            counts["cached"] += 1
+            note = f"缓存命中（汉明距离 {record['cache_distance']}）"
+        else:
+            note = f"{record['status'] or record['outcome']}，{record['latency']:.1f} 秒"
+        for key in saved:
+            saved[key] += (record.get("preprocess") or {}).get(key, 0)
+        progress = counts["succeeded"] + counts["failed"]
+        print(f"Successfully processed {filename}（{progress}/{total if total is not None else '?'}），{note}")
 
-if __name__ == '__main__':
-    import time
     start = time.time()
-    process_images()
-    end = time.time()
-    print("time: ",(end-start)*1000,'ms')
-    print("所有图片处理完成，结果已保存到 results/result.txt")
\ No newline at end of file
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for image_path, fields in items:
+                if len(futures) >= workers * QUEUE_PER_WORKER:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, *futures.pop(future))
+                future = pool.submit(analyze_file, client, image_path, model, limiter, max_retries, preprocess, cache)
+                futures[future] = image_path, fields
+            for future in as_completed(futures):
+                collect(future, *futures[future])
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            print(f"已中断，已完成的图片记录在 {store.sqlite_path}，重新运行即可继续")
+            raise
+
+    elapsed = time.time() - start
+    succeeded, failed, cached = counts["succeeded"], counts["failed"], counts["cached"]
+    rate = succeeded / elapsed * 60 if elapsed else 0.0
+    print(f"成功 {succeeded} 张（其中缓存命中 {cached} 张），失败 {failed} 张，耗时 {elapsed:.1f} 秒（{rate:.1f} 张/分钟）")
+    if saved["orig_bytes"]:
+        print(f"上传字节 {saved['orig_bytes']} -> {saved['bytes']}（节省 {saved['orig_bytes'] - saved['bytes']}），"
+              f"视觉 token {saved['orig_tokens']} -> {saved['tokens']}（节省 {saved['orig_tokens'] - saved['tokens']}）")
+    return succeeded, failed
+
+
+def process_images(input_dir, output_dir, model=DEFAULT_MODEL, workers=DEFAULT_WORKERS, rpm=DEFAULT_RPM,
+                   max_retries=MAX_RETRIES, restart=False, preprocess=None, cache=None):
+    """
+    参数说明：
+        input_dir: 图片目录
+        output_dir: 结果目录，记录写入其中的 inspections.jsonl 和 inspections.sqlite3
+        workers: 并发请求数
+        rpm: 每分钟最多发出的请求数
+        restart: 忽略已有结果，所有图片重新分析（旧记录保留，按时间可以区分）
+        preprocess: prepare_image 的参数（max_side / max_pixels / quality），None 时上传原图
+        cache: ResultCache，None 时每张图片都请求模型
+    """
+    client = create_client()
+    store = ResultStore(output_dir)
+    try:
+        # 已有结果的图片即检查点（按绝对路径），失败或回复格式错误的图片下次运行时重新处理
+        filenames = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        pending = [f for f in filenames if restart or not store.is_completed(os.path.join(input_dir, f))]
+        print(f"共 {len(filenames)} 张图片，已完成 {len(filenames) - len(pending)} 张，待处理 {len(pending)} 张")
+        items = ((os.path.join(input_dir, filename), {}) for filename in pending)
+        return run_batch(client, store, items, len(pending), model, workers, rpm, max_retries, preprocess, cache)
+    finally:
+        store.close()
+
+
+def process_videos(video_paths, output_dir, model=DEFAULT_MODEL, workers=DEFAULT_WORKERS, rpm=DEFAULT_RPM,
+                   max_retries=MAX_RETRIES, restart=False, preprocess=None, cache=None, sample_fps=None,
+                   diff_threshold=None, hist_threshold=None):
+    """
+    分析录像：按 sample_fps 抽帧，只有画面变化的帧（见 video_ingest.py）保存到 output_dir/frames 并送去分析
+    记录额外包含 video（视频路径）、frame（帧序号）和 timestamp（秒）；
+    帧文件名由视频名、视频路径的短哈希和帧序号组成，中断后重新运行时已有结果的帧不再请求模型
+    其余参数同 process_images
+    """
+    # 只有分析录像时才需要 OpenCV
+    import video_ingest
+
+    sample_fps = sample_fps or video_ingest.SAMPLE_FPS
+    diff_threshold = video_ingest.DIFF_THRESHOLD if diff_threshold is None else diff_threshold
+    hist_threshold = video_ingest.HIST_THRESHOLD if hist_threshold is None else hist_threshold
+    videos = video_ingest.list_videos(video_paths)
+    frames_dir = os.path.join(output_dir, "frames")
+    os.makedirs(frames_dir, exist_ok=True)
+    client = create_client()
+    store = ResultStore(output_dir)
+    stats = video_ingest.VideoStats()
+    resumed = 0
+
+    def items():
+        nonlocal resumed
+        for video in videos:
+            print(f"开始处理视频 {video}（每秒抽 {sample_fps:g} 帧）")
+            for index, timestamp, frame in video_ingest.changed_frames(video, sample_fps, diff_threshold,
+                                                                       hist_threshold, stats):
+                path = os.path.join(frames_dir, video_ingest.frame_name(video, index))
+                if not restart and store.is_completed(path):
+                    resumed += 1
+                    continue
+                video_ingest.save_frame(frame, path)
+                yield path, {"video": os.path.abspath(video), "frame": index, "timestamp": round(timestamp, 3)}
+
+    try:
+        print(f"共 {len(videos)} 个视频")
+        result = run_batch(client, store, items(), None, model, workers, rpm, max_retries, preprocess, cache)
+    finally:
+        store.close()
+    stats.report()
+    if resumed:
+        print(f"其中 {resumed} 帧上次运行已有结果，本次未重新分析")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="电梯轿厢照片批量分析")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="图片目录")
+    source.add_argument("--video", nargs="+", help="录像文件或目录，抽取画面变化的帧后分析")
+    parser.add_argument("--output", default="results", help="结果目录（inspections.jsonl + inspections.sqlite3）")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="并发请求数")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM, help="每分钟最多发出的请求数")
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES, help="限流或网络错误时的最大重试次数")
+    parser.add_argument("--restart", action="store_true", help="忽略已有结果，从头处理")
+    parser.add_argument("--max-side", type=int, default=MAX_SIDE, help="上传图片的最长边")
+    parser.add_argument("--max-pixels", type=int, default=MAX_PIXELS, help="上传图片的像素上限")
+    parser.add_argument("--quality", type=int, default=JPEG_QUALITY, help="重新编码的 JPEG 质量")
+    parser.add_argument("--no-preprocess", action="store_true", help="上传原图，不缩放和重新编码")
+    parser.add_argument("--cache", default=RESULT_CACHE_PATH, help="结果缓存文件")
+    parser.add_argument("--hash-threshold", type=int, default=HASH_THRESHOLD, help="视为同一画面的最大汉明距离（0~64）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用结果缓存，每张图片都请求模型")
+    parser.add_argument("--sample-fps", type=float, help="录像每秒抽样的帧数（默认 1）")
+    parser.add_argument("--diff-threshold", type=float, help="录像相邻保留帧的平均像素差阈值（0~1）")
+    parser.add_argument("--hist-threshold", type=float, help="录像相邻保留帧的直方图距离阈值（0~1）")
+    args = parser.parse_args(argv)
+
+    preprocess = None if args.no_preprocess else {
+        "max_side": args.max_side, "max_pixels": args.max_pixels, "quality": args.quality}
+    cache = None if args.no_cache else ResultCache(args.cache, threshold=args.hash_threshold)
+    try:
+        if args.video:
+            process_videos(args.video, args.output, args.model, args.workers, args.rpm, args.max_retries,
+                           args.restart, preprocess, cache, args.sample_fps, args.diff_threshold, args.hist_threshold)
+        else:
+            process_images(args.input, args.output, args.model, args.workers, args.rpm, args.max_retries,
+                           args.restart, preprocess, cache)
+    finally:
+        if cache is not None:
+            cache.report()
+            cache.close()
+    print(f"所有图片处理完成，结果已保存到 {args.output}")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
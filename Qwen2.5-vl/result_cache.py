@@ -0,0 +1,239 @@
+# result_cache.py
+"""
+按感知哈希缓存分析结果
+同一台电梯的摄像头反复上传几乎相同的画面，这些画面没有必要每次都送进 VL 模型：
+对图片计算 64 位 DCT 感知哈希（pHash，对 JPEG 压缩噪声和整体明暗变化不敏感），
+同一提示词 + 模型下，与已缓存图片的汉明距离不超过阈值时直接返回缓存的 JSON 结果
+缓存保存在本地 SQLite 中，条目超过 TTL 后失效，超过条数上限时按最近使用时间淘汰
+用法：
+    python result_cache.py hash a.jpg b.jpg        # 输出哈希及与第一张图片的汉明距离，用于调整阈值
+    python result_cache.py stats
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# 缓存文件路径
+RESULT_CACHE_PATH = "./vl_result_cache.sqlite3"
+# 汉明距离不超过该值时视为同一画面（64 位哈希）
+HASH_THRESHOLD = 6
+# 最多缓存的条目数，超出后淘汰最久未使用的条目
+CACHE_MAX_ENTRIES = 50000
+# 缓存条目的有效期（秒），过期后重新请求模型，画面中新贴的广告最迟在这之后被发现
+CACHE_TTL = 7 * 24 * 3600
+
+# pHash：缩放到 32x32 灰度图，取 DCT 左上角 8x8 低频系数
+_HASH_SIZE = 8
+_IMG_SIZE = 32
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    m[0] *= 1 / np.sqrt(2)
+    return m * np.sqrt(2 / n)
+
+
+_DCT = _dct_matrix(_IMG_SIZE)
+
+
+def perceptual_hash(image_path):
+    """64 位感知哈希：低频 DCT 系数与中位数比较，直流分量不参与，整体变亮变暗不影响结果"""
+    with Image.open(image_path) as image:
+        gray = ImageOps.exif_transpose(image).convert('L').resize((_IMG_SIZE, _IMG_SIZE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float64)
+    coeffs = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE].flatten()
+    bits = coeffs > np.median(coeffs[1:])
+    bits[0] = False
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def context_hash(*parts):
+    """提示词、模型等影响结果的参数的哈希，任何一项变化时缓存条目不再命中"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8') + b'\0')
+    return digest.hexdigest()[:16]
+
+
+def _to_signed(value):
+    # SQLite 的 INTEGER 为有符号 64 位
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _popcount64(values):
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class ResultCache:
+    """
+    线程安全；每个 context 的哈希在内存中保存为 uint64 数组，查找时一次性计算全部汉明距离
+    结果以原图像素坐标保存，同时记录原图尺寸，命中尺寸不同的图片时由调用方按比例换算坐标
+    """
+
+    def __init__(self, path=RESULT_CACHE_PATH, threshold=HASH_THRESHOLD, max_entries=CACHE_MAX_ENTRIES,
+                 ttl=CACHE_TTL):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " id INTEGER PRIMARY KEY,"
+            " context TEXT NOT NULL,"
+            " phash INTEGER NOT NULL,"
+            " result TEXT NOT NULL,"
+            " width INTEGER,"
+            " height INTEGER,"
+            " created REAL NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_context ON results (context)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access)")
+        self._conn.execute("DELETE FROM results WHERE created < ?", (time.time() - ttl,))
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """从数据库重建内存索引：context -> (id 数组, 哈希数组, 创建时间数组)"""
+        index = {}
+        for row_id, context, phash, created in self._conn.execute(
+                "SELECT id, context, phash, created FROM results ORDER BY id"):
+            ids, hashes, times = index.setdefault(context, ([], [], []))
+            ids.append(row_id)
+            hashes.append(phash & 0xFFFFFFFFFFFFFFFF)
+            times.append(created)
+        self._index = {
+            context: (np.array(ids, dtype=np.int64), np.array(hashes, dtype=np.uint64), np.array(times))
+            for context, (ids, hashes, times) in index.items()
+        }
+        self._count = sum(len(v[0]) for v in self._index.values())
+
+    def lookup(self, phash, context):
+        """
+        查找汉明距离不超过阈值的最近条目，距离相同时取最新的
+        :return: {"result": 结果字典, "width", "height", "distance"}，未命中时返回 None
+        """
+        with self._lock:
+            entry = self._index.get(context)
+            match = None
+            if entry is not None and len(entry[0]):
+                ids, hashes, times = entry
+                distances = _popcount64(hashes ^ np.uint64(phash))
+                distances[times < time.time() - self.ttl] = 65
+                best = np.flatnonzero(distances == distances.min())
+                best = best[np.argmax(ids[best])]
+                if distances[best] <= self.threshold:
+                    match = int(ids[best]), int(distances[best])
+            if match is None:
+                self.misses += 1
+                return None
+            row_id, distance = match
+            row = self._conn.execute("SELECT result, width, height FROM results WHERE id = ?", (row_id,)).fetchone()
+            self._conn.execute("UPDATE results SET last_access = ?, hits = hits + 1 WHERE id = ?",
+                               (time.time(), row_id))
+            self._conn.commit()
+            self.hits += 1
+        return {"result": json.loads(row[0]), "width": row[1], "height": row[2], "distance": distance}
+
+    def store(self, phash, context, result, width=None, height=None):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO results (context, phash, result, width, height, created, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (context, _to_signed(phash), json.dumps(result, ensure_ascii=False), width, height, now, now),
+            )
+            self._conn.commit()
+            ids, hashes, times = self._index.get(context, (np.array([], dtype=np.int64),
+                                                           np.array([], dtype=np.uint64), np.array([])))
+            self._index[context] = (np.append(ids, cursor.lastrowid), np.append(hashes, np.uint64(phash)),
+                                    np.append(times, now))
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """淘汰最久未使用的条目，一次多删 10%，避免每次写入都触发"""
+        target = int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM results WHERE id IN (SELECT id FROM results ORDER BY last_access LIMIT ?)",
+            (self._count - target,),
+        )
+        self._conn.commit()
+        self._load()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+            self._load()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def report(self):
+        s = self.stats()
+        print(f"结果缓存：命中 {s['hits']} 次，未命中 {s['misses']} 次，命中率 {s['hit_rate']:.1%}，"
+              f"共 {s['entries']} 条")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="感知哈希结果缓存")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("hash", help="输出图片的感知哈希及与第一张图片的汉明距离")
+    p.add_argument("images", nargs="+")
+    p = sub.add_parser("stats", help="缓存条目数")
+    p.add_argument("--path", default=RESULT_CACHE_PATH)
+    p = sub.add_parser("clear", help="清空缓存")
+    p.add_argument("--path", default=RESULT_CACHE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "hash":
+        hashes = [perceptual_hash(path) for path in args.images]
+        for path, phash in zip(args.images, hashes):
+            print(f"{phash:016x}  距离 {hamming_distance(hashes[0], phash):2d}  {os.path.basename(path)}")
+        return
+    cache = ResultCache(args.path)
+    if args.command == "clear":
+        cache.clear()
+        print("缓存已清空")
+    else:
+        rows = cache._conn.execute(
+            "SELECT context, COUNT(*), SUM(hits) FROM results GROUP BY context").fetchall()
+        print(f"共 {cache.stats()['entries']} 条")
+        for context, count, hits in rows:
+            print(f"  {context}: {count} 条，累计命中 {hits or 0} 次")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
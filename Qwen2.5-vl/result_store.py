@@ -0,0 +1,260 @@
+# result_store.py
+"""
+电梯巡检结果存储
+每张图片一条记录，同时写入两处：
+    inspections.jsonl    逐行追加，便于流式读取和同步到其他系统
+    inspections.sqlite3  按状态、时间、文件名建索引，便于查询和统计
+记录包含图片路径、文件哈希、感知哈希、模型、耗时、token 用量、解析后的状态、必需标识和违规粘贴物；
+读取都是逐行 / 逐条迭代，百万级记录也不需要一次载入内存
+用法：
+    python result_store.py stats results/
+    python result_store.py query results/ --status 不干净 --since 2025-01-01 --limit 20
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from urllib.request import pathname2url
+
+JSONL_NAME = "inspections.jsonl"
+SQLITE_NAME = "inspections.sqlite3"
+
+# outcome：ok 模型返回了合法 JSON；cached 来自结果缓存；invalid 回复不是合法 JSON；error 请求失败
+# 中断后恢复时只有 ok / cached 算完成，invalid 和 error 的图片下次运行时重新请求
+COMPLETED_OUTCOMES = ("ok", "cached")
+
+_COLUMNS = (
+    "ts", "image", "name", "sha256", "phash", "model", "outcome", "status", "latency", "attempts",
+    "prompt_tokens", "completion_tokens", "width", "height", "cache_distance", "signs", "contaminants",
+    "raw", "error",
+)
+# 以 JSON 文本保存的列
+_JSON_COLUMNS = ("signs", "contaminants")
+
+
+def parse_verdict(response):
+    """
+    解析模型回复
+    :return: (outcome, status, required_signs, contaminants)，回复不是合法 JSON 时 outcome 为 invalid
+    """
+    try:
+        verdict = json.loads(response)
+    except (TypeError, json.JSONDecodeError):
+        return "invalid", None, None, None
+    if not isinstance(verdict, dict):
+        return "invalid", None, None, None
+    return "ok", verdict.get("status"), verdict.get("required_signs"), verdict.get("contaminants")
+
+
+def _parse_time(value):
+    """ISO 日期 / 时间或 Unix 时间戳"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class ResultStore:
+    """
+    写入在单个线程中进行（qwen2_5.py 的主线程）；
+    先追加 JSONL 再提交 SQLite，进程在两者之间中断时 JSONL 中可能多一条重复记录，以 SQLite 为准
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.jsonl_path = os.path.join(directory, JSONL_NAME)
+        self.sqlite_path = os.path.join(directory, SQLITE_NAME)
+        self._jsonl = open(self.jsonl_path, "a", encoding="utf-8")
+        self._conn = sqlite3.connect(self.sqlite_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS inspections ("
+            " id INTEGER PRIMARY KEY,"
+            " ts REAL NOT NULL,"
+            " image TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " sha256 TEXT,"
+            " phash TEXT,"
+            " model TEXT,"
+            " outcome TEXT NOT NULL,"
+            " status TEXT,"
+            " latency REAL,"
+            " attempts INTEGER,"
+            " prompt_tokens INTEGER,"
+            " completion_tokens INTEGER,"
+            " width INTEGER,"
+            " height INTEGER,"
+            " cache_distance INTEGER,"
+            " signs TEXT,"
+            " contaminants TEXT,"
+            " raw TEXT,"
+            " error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_inspections_status_ts ON inspections (status, ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_inspections_ts ON inspections (ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_inspections_name ON inspections (name)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_inspections_image ON inspections (image, outcome)")
+        self._conn.commit()
+
+    def is_completed(self, image):
+        """
+        图片是否已经得到结果，用于中断后恢复；按绝对路径判断，不同目录中的同名图片互不影响
+        走 image 索引，不需要把全部记录载入内存
+        """
+        placeholders = ",".join("?" * len(COMPLETED_OUTCOMES))
+        row = self._conn.execute(
+            f"SELECT 1 FROM inspections WHERE image = ? AND outcome IN ({placeholders}) LIMIT 1",
+            (os.path.abspath(image), *COMPLETED_OUTCOMES),
+        ).fetchone()
+        return row is not None
+
+    def append(self, record):
+        """
+        写入一条记录；record 中有 response（模型回复文本）时解析出 status / signs / contaminants
+        :return: 写入的记录（JSONL 中的一行）
+        """
+        record = dict(record)
+        record.setdefault("ts", time.time())
+        record.setdefault("name", os.path.basename(record["image"]))
+        response = record.pop("response", None)
+        if record.get("outcome") != "error":
+            outcome, status, signs, contaminants = parse_verdict(response)
+            if outcome == "ok" and record.get("cached"):
+                outcome = "cached"
+            record.update(outcome=outcome, status=status, signs=signs, contaminants=contaminants)
+            if outcome == "invalid":
+                record["raw"] = response
+        record.pop("cached", None)
+        row = {key: record.get(key) for key in _COLUMNS}
+        line = {**row, **{k: v for k, v in record.items() if k not in row}}
+        self._jsonl.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self._jsonl.flush()
+        for key in _JSON_COLUMNS:
+            if row[key] is not None:
+                row[key] = json.dumps(row[key], ensure_ascii=False)
+        self._conn.execute(
+            f"INSERT INTO inspections ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+            [row[key] for key in _COLUMNS],
+        )
+        self._conn.commit()
+        return line
+
+    def append_error(self, image, model, error, **fields):
+        return self.append({"image": image, "model": model, "outcome": "error", "error": error, **fields})
+
+    def query(self, status=None, since=None, until=None, outcome=None, name=None, limit=None):
+        """按条件逐条返回记录（字典），按时间排序；走 status / ts 索引"""
+        return query_records(self.directory, status, since, until, outcome, name, limit)
+
+    def stats(self):
+        total, tokens_in, tokens_out, latency = self._conn.execute(
+            "SELECT COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), AVG(latency) FROM inspections"
+        ).fetchone()
+        return {
+            "total": total,
+            "by_outcome": dict(self._conn.execute("SELECT outcome, COUNT(*) FROM inspections GROUP BY outcome")),
+            "by_status": dict(self._conn.execute(
+                "SELECT COALESCE(status, ''), COUNT(*) FROM inspections WHERE status IS NOT NULL GROUP BY status")),
+            "prompt_tokens": tokens_in or 0,
+            "completion_tokens": tokens_out or 0,
+            "avg_latency": latency,
+        }
+
+    def close(self):
+        self._jsonl.close()
+        self._conn.close()
+
+
+def query_records(directory, status=None, since=None, until=None, outcome=None, name=None, limit=None):
+    """
+    只读查询，参数同 ResultStore.query；不创建结果目录和文件，只需要读取结果时使用
+    结果数据库不存在时抛出 FileNotFoundError
+    """
+    path = os.path.join(directory, SQLITE_NAME)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"结果数据库不存在: {path}")
+    clauses, params = [], []
+    for column, value in (("status", status), ("outcome", outcome), ("name", name)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        clauses.append("ts >= ?")
+        params.append(_parse_time(since))
+    if until is not None:
+        clauses.append("ts < ?")
+        params.append(_parse_time(until))
+    sql = f"SELECT {', '.join(_COLUMNS)} FROM inspections"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY ts"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return _iter_rows(path, sql, params)
+
+
+def _iter_rows(path, sql, params):
+    # 独立的只读连接，迭代过程中不影响写入
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        for row in conn.execute(sql, params):
+            record = dict(zip(_COLUMNS, row))
+            for key in _JSON_COLUMNS:
+                if record[key] is not None:
+                    record[key] = json.loads(record[key])
+            yield record
+    finally:
+        conn.close()
+
+
+def iter_jsonl(path):
+    """逐行读取 JSONL 记录，path 可以是文件或结果目录"""
+    if os.path.isdir(path):
+        path = os.path.join(path, JSONL_NAME)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="电梯巡检结果查询")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("stats", help="按结果和状态统计")
+    p.add_argument("directory")
+    p = sub.add_parser("query", help="按条件输出记录（JSONL）")
+    p.add_argument("directory")
+    p.add_argument("--status", help="例如 不干净")
+    p.add_argument("--outcome", choices=("ok", "cached", "invalid", "error"))
+    p.add_argument("--name", help="图片文件名")
+    p.add_argument("--since", help="起始时间（ISO 格式或时间戳）")
+    p.add_argument("--until", help="截止时间（ISO 格式或时间戳）")
+    p.add_argument("--limit", type=int)
+    args = parser.parse_args(argv)
+
+    store = ResultStore(args.directory)
+    try:
+        if args.command == "stats":
+            s = store.stats()
+            print(f"共 {s['total']} 条记录")
+            print("按结果：" + "，".join(f"{k} {v}" for k, v in s["by_outcome"].items()))
+            print("按状态：" + "，".join(f"{k} {v}" for k, v in s["by_status"].items()))
+            if s["avg_latency"] is not None:
+                print(f"平均耗时 {s['avg_latency']:.2f} 秒，prompt token {s['prompt_tokens']}，"
+                      f"completion token {s['completion_tokens']}")
+        else:
+            for record in store.query(args.status, args.since, args.until, args.outcome, args.name, args.limit):
+                sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# video_ingest.py
+"""
+录像抽帧与画面变化检测
+逐帧流式解码本地视频，按 sample_fps 抽样（未抽中的帧只 grab 不取像素），
+再把抽样帧与上一张保留的帧比较：缩略图平均像素差或灰度直方图距离超过阈值时才认为画面变化，
+只有变化的帧送去 VL 模型分析，长时间录像不会整段载入内存
+用法：
+    python video_ingest.py 录像.mp4 --sample-fps 1 --output-dir frames     # 只抽帧，查看跳过了多少帧，用于调整阈值
+    python qwen2_5.py --video 录像.mp4 --output results                    # 抽帧后直接分析
+"""
+import argparse
+import hashlib
+import os
+import time
+
+import cv2
+import numpy as np
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.ts')
+# 每秒抽样的帧数
+SAMPLE_FPS = 1.0
+# 缩略图平均像素差（0~1）超过该值视为画面变化
+DIFF_THRESHOLD = 0.08
+# 灰度直方图的 Bhattacharyya 距离（0~1）超过该值视为画面变化，用于捕捉整体明暗或内容分布的变化
+HIST_THRESHOLD = 0.25
+# 变化检测使用的缩略图尺寸，越小越快，对噪声越不敏感
+THUMB_SIZE = (64, 64)
+HIST_BINS = 32
+# 保存帧的 JPEG 质量
+FRAME_QUALITY = 95
+
+
+class VideoStats:
+    """抽帧统计：总帧数、抽样帧数、画面变化帧数"""
+
+    def __init__(self):
+        self.videos = 0
+        self.frames = 0
+        self.sampled = 0
+        self.changed = 0
+        self.seconds = 0.0
+
+    @property
+    def skipped(self):
+        return self.frames - self.changed
+
+    def stats(self):
+        return {
+            "videos": self.videos,
+            "frames": self.frames,
+            "sampled": self.sampled,
+            "changed": self.changed,
+            "skipped_by_sampling": self.frames - self.sampled,
+            "skipped_unchanged": self.sampled - self.changed,
+            "decode_fps": self.frames / self.seconds if self.seconds else 0.0,
+        }
+
+    def report(self):
+        s = self.stats()
+        ratio = self.skipped / self.frames if self.frames else 0.0
+        print(f"视频 {s['videos']} 个，共 {s['frames']} 帧，抽样 {s['sampled']} 帧，画面变化 {s['changed']} 帧；"
+              f"跳过 {self.skipped} 帧（{ratio:.1%}，抽样跳过 {s['skipped_by_sampling']}，"
+              f"画面无变化 {s['skipped_unchanged']}），解码速度 {s['decode_fps']:.0f} 帧/秒")
+
+
+def sample_frames(video_path, sample_fps=SAMPLE_FPS, stats=None):
+    """
+    逐帧读取视频，按 sample_fps 抽样，每次只保留一帧在内存中
+    :return: 生成 (帧序号, 时间戳秒, BGR 图像)
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"无法打开视频: {video_path}")
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    if not fps or fps != fps:
+        fps = 25.0
+    step = max(1, round(fps / sample_fps))
+    index = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            if index % step == 0:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                if stats is not None:
+                    stats.sampled += 1
+                yield index, index / fps, frame
+            elif not capture.grab():
+                # 未抽中的帧只解码不取出像素
+                break
+            index += 1
+    finally:
+        capture.release()
+        if stats is not None:
+            stats.videos += 1
+            stats.frames += index
+            stats.seconds += time.perf_counter() - start
+
+
+class ChangeDetector:
+    """与上一张保留的帧比较，缓慢累积的变化最终也会超过阈值"""
+
+    def __init__(self, diff_threshold=DIFF_THRESHOLD, hist_threshold=HIST_THRESHOLD):
+        self.diff_threshold = diff_threshold
+        self.hist_threshold = hist_threshold
+        self._reference = None
+
+    @staticmethod
+    def signature(frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        thumb = cv2.GaussianBlur(cv2.resize(gray, THUMB_SIZE, interpolation=cv2.INTER_AREA), (3, 3), 0)
+        hist = cv2.calcHist([thumb], [0], None, [HIST_BINS], [0, 256])
+        cv2.normalize(hist, hist)
+        return thumb, hist
+
+    def check(self, frame):
+        """
+        :return: (是否变化, 平均像素差, 直方图距离)；第一帧总是视为变化
+        """
+        thumb, hist = self.signature(frame)
+        if self._reference is None:
+            self._reference = thumb, hist
+            return True, 1.0, 1.0
+        ref_thumb, ref_hist = self._reference
+        diff = float(np.mean(cv2.absdiff(thumb, ref_thumb))) / 255
+        distance = float(cv2.compareHist(ref_hist, hist, cv2.HISTCMP_BHATTACHARYYA))
+        changed = diff > self.diff_threshold or distance > self.hist_threshold
+        if changed:
+            self._reference = thumb, hist
+        return changed, diff, distance
+
+
+def changed_frames(video_path, sample_fps=SAMPLE_FPS, diff_threshold=DIFF_THRESHOLD,
+                   hist_threshold=HIST_THRESHOLD, stats=None):
+    """抽样后只生成画面变化的帧：(帧序号, 时间戳秒, BGR 图像)"""
+    detector = ChangeDetector(diff_threshold, hist_threshold)
+    for index, timestamp, frame in sample_frames(video_path, sample_fps, stats):
+        if detector.check(frame)[0]:
+            if stats is not None:
+                stats.changed += 1
+            yield index, timestamp, frame
+
+
+def frame_name(video_path, index):
+    """
+    帧图片文件名，同一视频同一帧的名字固定，结果存储据此判断是否已经分析过；
+    不同摄像头目录中的录像常常同名，名字中加入视频绝对路径的短哈希，避免互相覆盖
+    """
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    digest = hashlib.sha1(os.path.abspath(video_path).encode("utf-8")).hexdigest()[:8]
+    return f"{stem}_{digest}_{index:08d}.jpg"
+
+
+def save_frame(frame, path, quality=FRAME_QUALITY):
+    if not cv2.imwrite(path, frame, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        raise ValueError(f"无法写入帧图片: {path}")
+    return path
+
+
+def list_videos(paths):
+    """展开命令行中的视频文件和目录"""
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos.extend(os.path.join(path, f) for f in sorted(os.listdir(path))
+                          if f.lower().endswith(VIDEO_EXTENSIONS))
+        else:
+            videos.append(path)
+    return videos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="录像抽帧与画面变化检测")
+    parser.add_argument("videos", nargs="+", help="视频文件或目录")
+    parser.add_argument("--sample-fps", type=float, default=SAMPLE_FPS, help="每秒抽样的帧数")
+    parser.add_argument("--diff-threshold", type=float, default=DIFF_THRESHOLD, help="平均像素差阈值（0~1）")
+    parser.add_argument("--hist-threshold", type=float, default=HIST_THRESHOLD, help="直方图距离阈值（0~1）")
+    parser.add_argument("--output-dir", help="保存画面变化的帧；不指定时只统计")
+    args = parser.parse_args(argv)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    stats = VideoStats()
+    for video in list_videos(args.videos):
+        for index, timestamp, frame in changed_frames(video, args.sample_fps, args.diff_threshold,
+                                                      args.hist_threshold, stats):
+            print(f"{os.path.basename(video)} 第 {index} 帧（{timestamp:.1f} 秒）画面变化")
+            if args.output_dir:
+                save_frame(frame, os.path.join(args.output_dir, frame_name(video, index)))
+    stats.report()
+
+
+if __name__ == "__main__":
+    main()